@@ -4,6 +4,11 @@ import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # legacy path
 from app.services.user_service import user_service  # type: ignore
 from app.core.db import get_db, USE_DATABASE, MONGO_URI, MONGO_DB_NAME
+from app.core.cache import cache_stats
+from app.core.shared_cache import shared_cache_metrics
+from app.services.rendition_service import rendition_service
+from app.services.tile_service import tile_service
+from db_utils import sequence_allocator  # type: ignore
 
 bp = Blueprint('admin', __name__)
 
@@ -41,7 +46,17 @@ def db_status():
         "connected": True,
         "mongo_uri": MONGO_URI,
         "db_name": MONGO_DB_NAME,
-        "collections": counts
+        "collections": counts,
+        # 当前 worker 进程的序列分段分配指标
+        "sequence_allocator": sequence_allocator.metrics(),
+        # 共享缓存后端及当前 worker 的命中 / 未命中计数
+        "shared_cache": shared_cache_metrics(),
+        # 当前 worker 的进程内 LRU 缓存统计
+        "caches": cache_stats(),
+        # 当前 worker 的缩略图 / 预览图磁盘缓存计数
+        "renditions": rendition_service.stats(),
+        # 深度缩放瓦片磁盘缓存计数
+        "tiles": tile_service.stats()
     })
 
 @bp.route('/api/debug/db', methods=['GET'])
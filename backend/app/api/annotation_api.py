@@ -91,3 +91,22 @@ def update_annotation():
     except Exception as e:  # pragma: no cover
         current_app.logger.error(f"更新标注失败: {e}")
         return jsonify({"msg": "error"})
+
+@bp.route('/api/annotations/batch', methods=['POST'])
+def annotate_batch():
+    data = request.json or {}
+    ds_id = data.get('dataset_id')
+    expert_id = data.get('expert_id')
+    items = data.get('annotations') or []
+    if not isinstance(items, list):
+        return jsonify({"msg": "error", "error": "annotations 必须为列表"}), 400
+    try:
+        result = annotation_service.save_annotations_bulk(ds_id, expert_id, items)
+        return jsonify(result)
+    except ValueError as ve:
+        return jsonify({"msg": "error", "error": str(ve)}), 400
+    except RuntimeError as re:
+        return jsonify({"msg": "error", "error": str(re)}), 500
+    except Exception as e:  # pragma: no cover
+        current_app.logger.error(f"批量保存标注失败: {e}")
+        return jsonify({"msg": "error", "error": str(e)}), 500
@@ -71,6 +71,22 @@ def recount_dataset_images(dataset_id):
     count = dataset_service.recount_images(dataset_id)
     return success({"dataset_id": dataset_id, "image_count": count})
 
+@bp.route('/api/admin/progress/reconcile', methods=['POST'])
+def reconcile_dataset_progress():
+    data = request.json or {}
+    if data.get('role') != 'admin':
+        return fail("权限不足", 403, code='forbidden')
+    if not USE_DATABASE:
+        return fail("数据库连接不可用", 500)
+    dataset_id = data.get('dataset_id')
+    if dataset_id is not None:
+        try:
+            dataset_id = int(dataset_id)
+        except (TypeError, ValueError):
+            return fail("dataset_id 必须为整数", 400, code='invalid_param')
+    written = dataset_service.reconcile_progress(dataset_id)
+    return success({"dataset_id": dataset_id, "counters": written})
+
 @bp.route('/api/admin/datasets/<int:dataset_id>/annotations', methods=['DELETE'])
 def clear_dataset_annotations(dataset_id):
     role = request.args.get('role') or (request.json or {}).get('role')
@@ -1,8 +1,11 @@
 """Export endpoint (Phase 2 refactored)."""
-from flask import Blueprint, request, jsonify, send_file, current_app
+from flask import Blueprint, request, jsonify, send_file, current_app, Response, stream_with_context
+from urllib.parse import quote
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # legacy path support
-from app.services.export_service import export_service  # type: ignore
+from app.services.export_service import export_service, STREAM_FORMATS, COLUMNAR_FORMATS, EXPORT_FORMATS, XLSX_MIMETYPE  # type: ignore
+from app.services.export_job_service import export_job_service  # type: ignore
+from app.services.manifest_export import MANIFEST_MIMETYPE, MAX_FOLDS  # type: ignore
 from app.core.db import USE_DATABASE
 
 bp = Blueprint('export', __name__)
@@ -15,11 +18,164 @@ def export():
         raw_ds = request.args.get('dataset_id')
         expert_id = request.args.get('expert_id')
         processed_ds_id = int(raw_ds) if raw_ds and raw_ds.isdigit() else None
-        output = export_service.build_workbook(processed_ds_id, expert_id)
+        fmt = (request.args.get('format') or 'xlsx').lower()
+        if processed_ds_id is None and request.args.get('per_dataset') in ('1', 'true'):
+            return _per_dataset_export(expert_id, fmt)
+        if request.args.get('since') or request.args.get('since_record_id'):
+            return _delta_export(processed_ds_id, expert_id, fmt)
+        if fmt == 'manifest':
+            return _manifest_export(processed_ds_id, expert_id)
+        if fmt in STREAM_FORMATS:
+            return _stream_export(processed_ds_id, expert_id, fmt)
+        if fmt in COLUMNAR_FORMATS:
+            return _columnar_export(processed_ds_id, expert_id, fmt)
+        if fmt != 'xlsx':
+            return jsonify({"msg": "error", "error": f"不支持的导出格式: {fmt}"}), 400
+        # write-only 模式写入临时文件，发送后删除，峰值内存与数据规模无关
+        path = export_service.build_workbook_file(processed_ds_id, expert_id)
         filename = export_service.build_filename(processed_ds_id, expert_id)
-        return send_file(output, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        return _send_temp_file(path, filename, XLSX_MIMETYPE)
     except RuntimeError as re:
         return jsonify({"msg": "error", "error": str(re)}), 500
     except Exception as e:  # pragma: no cover
         current_app.logger.error(f"通用导出失败: {e}")
         return jsonify({"msg": "error", "error": str(e)}), 500
+
+
+@bp.route('/api/export/jobs', methods=['POST'])
+def create_export_job():
+    """异步导出：入队后立即返回 202，客户端轮询任务状态并下载产物。"""
+    if not USE_DATABASE:
+        return jsonify({"msg": "error", "error": "数据库连接不可用"}), 500
+    data = request.get_json(silent=True) or {}
+    raw_ds = data.get('dataset_id')
+    fmt = str(data.get('format') or 'xlsx').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"msg": "error", "error": f"不支持的导出格式: {fmt}"}), 400
+    try:
+        dataset_id = int(raw_ds) if raw_ds not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({"msg": "error", "error": "dataset_id 必须为整数"}), 400
+    try:
+        job = export_job_service.submit(dataset_id, data.get('expert_id'), fmt)
+        return jsonify({"msg": "success", **export_job_service.public(job)}), 202
+    except RuntimeError as re:
+        return jsonify({"msg": "error", "error": str(re)}), 500
+    except Exception as e:  # pragma: no cover
+        current_app.logger.error(f"创建导出任务失败: {e}")
+        return jsonify({"msg": "error", "error": str(e)}), 500
+
+
+@bp.route('/api/export/jobs/<job_id>', methods=['GET'])
+def get_export_job(job_id):
+    if not USE_DATABASE:
+        return jsonify({"msg": "error", "error": "数据库连接不可用"}), 500
+    job = export_job_service.get(job_id)
+    if not job:
+        return jsonify({"msg": "error", "error": "导出任务不存在"}), 404
+    return jsonify({"msg": "success", **export_job_service.public(job)})
+
+
+@bp.route('/api/export/jobs/<job_id>/download', methods=['GET'])
+def download_export_job(job_id):
+    if not USE_DATABASE:
+        return jsonify({"msg": "error", "error": "数据库连接不可用"}), 500
+    job = export_job_service.get(job_id)
+    if not job:
+        return jsonify({"msg": "error", "error": "导出任务不存在"}), 404
+    if job['status'] != 'done':
+        return jsonify({"msg": "error", "error": f"导出任务未完成: {job['status']}", "status": job['status']}), 409
+    path = export_job_service.artifact(job)
+    if not path:
+        return jsonify({"msg": "error", "error": "导出文件已过期，请重新创建任务"}), 410
+    ext, mimetype = EXPORT_FORMATS[job['format']]
+    filename = export_service.build_filename(job.get('dataset_id'), job.get('expert_id'), ext=ext)
+    # 缓存产物由清理策略回收，发送后不删除
+    return send_file(path, as_attachment=True, download_name=filename, mimetype=mimetype)
+
+
+def _attachment_header(filename: str) -> str:
+    # 中文文件名按 RFC 5987 编码，并提供 ASCII 回退名
+    return f"attachment; filename=\"export.{filename.rsplit('.', 1)[-1]}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _stream_export(dataset_id, expert_id, fmt):
+    """csv / ndjson：生成器逐批输出，worker 内存与数据集规模无关。"""
+    export_service.ensure_db()
+    chunks = export_service.stream_annotations(dataset_id, expert_id, fmt)
+    filename = export_service.build_filename(dataset_id, expert_id, ext=fmt)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=STREAM_FORMATS[fmt],
+        headers={"Content-Disposition": _attachment_header(filename), "X-Accel-Buffering": "no"}
+    )
+
+
+def _delta_export(dataset_id, expert_id, fmt):
+    """增量导出（csv / ndjson）：仅输出水位之后新增或修改的标注，新水位放在响应头。"""
+    if fmt not in STREAM_FORMATS:
+        return jsonify({"msg": "error", "error": "增量导出仅支持 csv / ndjson"}), 400
+    raw_rid = request.args.get('since_record_id')
+    if raw_rid and not raw_rid.isdigit():
+        return jsonify({"msg": "error", "error": "since_record_id 必须为整数"}), 400
+    try:
+        watermark, rows = export_service.annotation_delta(
+            dataset_id, expert_id, since=request.args.get('since'),
+            since_record_id=int(raw_rid) if raw_rid else None
+        )
+    except ValueError as ve:
+        return jsonify({"msg": "error", "error": str(ve)}), 400
+    filename = export_service.build_filename(dataset_id, expert_id, ext=f"delta.{fmt}")
+    headers = {
+        "Content-Disposition": _attachment_header(filename),
+        "X-Accel-Buffering": "no",
+        "X-Export-Watermark-Since": watermark['since'] or '',
+        "X-Export-Watermark-Record-Id": '' if watermark['since_record_id'] is None else str(watermark['since_record_id']),
+        "Access-Control-Expose-Headers": "X-Export-Watermark-Since, X-Export-Watermark-Record-Id",
+    }
+    return Response(stream_with_context(export_service.render_stream(rows, fmt)), mimetype=STREAM_FORMATS[fmt], headers=headers)
+
+
+def _manifest_export(dataset_id, expert_id):
+    """训练清单：id,image_path,mask_path[,fold]；folds>=2 时按标签分层做确定性 k 折。"""
+    raw_folds = request.args.get('folds') or ''
+    raw_seed = request.args.get('seed') or '42'
+    if (raw_folds and not raw_folds.isdigit()) or not raw_seed.lstrip('-').isdigit():
+        return jsonify({"msg": "error", "error": "folds / seed 必须为整数"}), 400
+    folds = int(raw_folds) if raw_folds else None
+    if folds is not None and not 2 <= folds <= MAX_FOLDS:
+        return jsonify({"msg": "error", "error": f"folds 取值范围为 2~{MAX_FOLDS}"}), 400
+    export_service.ensure_db()
+    chunks = export_service.stream_manifest(dataset_id, expert_id, folds=folds, seed=int(raw_seed))
+    filename = export_service.build_filename(dataset_id, expert_id, ext='manifest.csv')
+    return Response(
+        stream_with_context(chunks),
+        mimetype=MANIFEST_MIMETYPE,
+        headers={"Content-Disposition": _attachment_header(filename), "X-Accel-Buffering": "no"}
+    )
+
+
+def _per_dataset_export(expert_id, fmt):
+    """全库导出：每个数据集一个文件（线程池并行生成），打包为流式 zip。"""
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"msg": "error", "error": f"不支持的导出格式: {fmt}"}), 400
+    chunks = export_service.stream_datasets_zip(expert_id, fmt)
+    filename = export_service.build_filename(None, expert_id, ext=f"datasets.{fmt}.zip")
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/zip',
+        headers={"Content-Disposition": _attachment_header(filename), "X-Accel-Buffering": "no"}
+    )
+
+
+def _columnar_export(dataset_id, expert_id, fmt):
+    """parquet / arrow：每张表一个 zstd 压缩文件，打包为 zip 下载，发送后删除临时文件。"""
+    zip_path = export_service.build_columnar_archive(dataset_id, expert_id, fmt)
+    filename = export_service.build_filename(dataset_id, expert_id, ext=f"{fmt}.zip")
+    return _send_temp_file(zip_path, filename, 'application/zip')
+
+
+def _send_temp_file(path, filename, mimetype):
+    response = send_file(path, as_attachment=True, download_name=filename, mimetype=mimetype)
+    response.call_on_close(lambda: os.path.exists(path) and os.remove(path))
+    return response
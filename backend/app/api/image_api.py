@@ -1,8 +1,11 @@
 """Image listing & upload endpoints (Phase 2 refactored)."""
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, send_file
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # compatibility if needed
 from app.services.image_service import image_service  # type: ignore
+from app.services.rendition_service import rendition_service, FORMATS  # type: ignore
+from app.services.image_delivery import file_response  # type: ignore
+from app.services.tile_service import tile_service  # type: ignore
 from app.core.db import USE_DATABASE  # centralized flag
 
 bp = Blueprint('images', __name__)
@@ -24,6 +27,7 @@ def upload_dataset_images(dataset_id):
             "msg": "success",
             "uploaded": len(uploaded),
             "failed": len(failed),
+            "duplicates": sum(1 for u in uploaded if u.get('duplicate')),
             "images": uploaded,
             "errors": failed
         }), 201
@@ -50,3 +54,97 @@ def get_dataset_images(dataset_id):
     except Exception as e:  # pragma: no cover
         current_app.logger.error(f"获取数据集图片失败: {e}")
         return jsonify([])
+
+
+@bp.route('/api/images/<int:image_id>/file', methods=['GET'])
+def image_file(image_id):
+    """原图：强 ETag（内容哈希）+ immutable 长缓存，支持 If-None-Match / Range；可交由 nginx X-Accel-Redirect 发送。"""
+    if not USE_DATABASE:
+        return jsonify({"msg": "error", "error": "数据库连接不可用"}), 500
+    image = image_service.locate(image_id)
+    if not image:
+        return jsonify({"msg": "error", "error": "图片不存在"}), 404
+    try:
+        return file_response(image, request)
+    except FileNotFoundError:
+        return jsonify({"msg": "error", "error": "图片文件不存在"}), 404
+
+
+@bp.route('/api/images/<int:image_id>/render', methods=['GET'])
+def render_image(image_id):
+    """缩略图 / 预览图：size=thumb(256)|preview(1024)，format=webp|jpeg（缺省按 Accept 协商）。"""
+    if not USE_DATABASE:
+        return jsonify({"msg": "error", "error": "数据库连接不可用"}), 500
+    try:
+        px = rendition_service.parse_size(request.args.get('size'))
+        fmt = rendition_service.negotiate(request.args.get('format'), request.headers.get('Accept', ''))
+    except ValueError as ve:
+        return jsonify({"msg": "error", "error": str(ve)}), 400
+    image = image_service.locate(image_id)
+    if not image:
+        return jsonify({"msg": "error", "error": "图片不存在"}), 404
+    try:
+        path = rendition_service.render(image, px, fmt)
+    except FileNotFoundError:
+        return jsonify({"msg": "error", "error": "图片文件不存在"}), 404
+    except Exception as e:
+        current_app.logger.error(f"生成缩略图失败 image_id={image_id}: {e}")
+        return jsonify({"msg": "error", "error": "无法生成缩略图"}), 422
+    # 同一 image_id 的源内容不会改变：长期缓存
+    response = send_file(path, mimetype=FORMATS[fmt][1], max_age=365 * 24 * 3600, conditional=True)
+    response.cache_control.immutable = True
+    if not request.args.get('format'):
+        response.vary.add('Accept')
+    return response
+
+
+@bp.route('/api/images/<int:image_id>/tiles', methods=['GET'])
+def image_tiles_descriptor(image_id):
+    """深度缩放（DZI）描述；format=webp|jpeg（缺省按 Accept 协商）。"""
+    if not USE_DATABASE:
+        return jsonify({"msg": "error", "error": "数据库连接不可用"}), 500
+    try:
+        fmt = rendition_service.negotiate(request.args.get('format'), request.headers.get('Accept', ''))
+    except ValueError as ve:
+        return jsonify({"msg": "error", "error": str(ve)}), 400
+    image = image_service.locate(image_id)
+    if not image:
+        return jsonify({"msg": "error", "error": "图片不存在"}), 404
+    try:
+        info = tile_service.describe(image)
+    except FileNotFoundError:
+        return jsonify({"msg": "error", "error": "图片文件不存在"}), 404
+    except Exception as e:
+        current_app.logger.error(f"读取瓦片信息失败 image_id={image_id}: {e}")
+        return jsonify({"msg": "error", "error": "无法解码图片"}), 422
+    response = jsonify(tile_service.dzi(info, request.script_root + request.path + '/', fmt))
+    if not request.args.get('format'):
+        response.vary.add('Accept')
+    return response
+
+
+@bp.route('/api/images/<int:image_id>/tiles/<int:level>/<tile>', methods=['GET'])
+def image_tile(image_id, level, tile):
+    """瓦片 <x>_<y>[.webp|.jpg]：首次访问在进程池中生成并落盘，之后直接发送文件。"""
+    if not USE_DATABASE:
+        return jsonify({"msg": "error", "error": "数据库连接不可用"}), 500
+    try:
+        col, row, fmt = tile_service.parse_tile(tile)
+        fmt = fmt or rendition_service.negotiate(None, request.headers.get('Accept', ''))
+    except ValueError as ve:
+        return jsonify({"msg": "error", "error": str(ve)}), 400
+    image = image_service.locate(image_id)
+    if not image:
+        return jsonify({"msg": "error", "error": "图片不存在"}), 404
+    try:
+        path = tile_service.tile(image, level, col, row, fmt)
+    except (FileNotFoundError, IndexError):
+        return jsonify({"msg": "error", "error": "图片或瓦片不存在"}), 404
+    except Exception as e:
+        current_app.logger.error(f"生成瓦片失败 image_id={image_id} {level}/{tile}: {e}")
+        return jsonify({"msg": "error", "error": "无法生成瓦片"}), 422
+    response = send_file(path, mimetype=FORMATS[fmt][1], max_age=365 * 24 * 3600, conditional=True)
+    response.cache_control.immutable = True
+    if '.' not in tile:
+        response.vary.add('Accept')
+    return response
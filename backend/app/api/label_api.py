@@ -57,8 +57,8 @@ def update_dataset_labels(dataset_id):
         return jsonify({"msg": "error", "error": "数据库连接不可用"}), 500
     labels_req = data.get('labels', [])
     try:
-        updated = label_service.update_dataset_labels(dataset_id, labels_req)
-        return jsonify({"msg": "success", "updated_labels": updated})
+        summary = label_service.update_dataset_labels(dataset_id, labels_req)
+        return jsonify({"msg": "success", "updated_labels": summary.pop("total"), **summary})
     except Exception as e:
         current_app.logger.error(f"更新标签失败: {e}")
         return jsonify({"msg": "error", "error": str(e)}), 500
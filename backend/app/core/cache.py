@@ -0,0 +1,246 @@
+"""Bounded, thread-safe in-process caches for service hot lookups.
+
+``LRUCache`` combines TTL expiry with LRU eviction under an entry budget and an
+(approximate) byte budget. Keys are spread over ``stripes`` independent
+OrderedDicts, each with its own lock, so gthread workers touching different keys
+do not contend; each stripe owns 1/stripes of the budgets.
+
+``get_or_load`` coalesces concurrent misses for the same key (single-flight):
+one thread runs the loader, the others wait for its result, so a stampede costs
+one DB query. Every cache registers itself; ``cache_stats()`` reports hits,
+misses, loads, coalesced waits, evictions and current size per cache.
+
+These caches are per process. Values shared by several workers and invalidated
+by writes belong in ``app.core.shared_cache``; here a short TTL bounds the
+staleness other workers may observe.
+"""
+from __future__ import annotations
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+_MISSING = object()
+
+
+def approx_size(obj: Any, _depth: int = 0) -> int:
+    """粗略估算对象占用字节数（递归容器，深度受限）。"""
+    size = sys.getsizeof(obj)
+    if _depth >= 4:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(v, _depth + 1) for v in obj)
+    return size
+
+
+class SingleFlight:
+    """Run at most one loader per key at a time; concurrent callers share its result."""
+
+    class _Call:
+        __slots__ = ('event', 'value', 'error')
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.value: Any = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, 'SingleFlight._Call'] = {}
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+class _Stripe:
+    __slots__ = ('lock', 'data', 'bytes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> (value, expires_at, size)
+        self.data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self.bytes = 0
+
+
+class LRUCache:
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        stripes: int = 8,
+        sizer: Callable[[Any], int] = approx_size
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizer = sizer
+        self._stripes: List[_Stripe] = [_Stripe() for _ in range(max(1, stripes))]
+        self._entries_per_stripe = max(1, max_entries // len(self._stripes))
+        self._bytes_per_stripe = max(1, max_bytes // len(self._stripes)) if max_bytes else None
+        self._flight = SingleFlight()
+        self._counters = {'hits': 0, 'misses': 0, 'loads': 0, 'evictions': 0, 'expirations': 0}
+        _register(self)
+
+    def _stripe(self, key: Hashable) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def _count(self, name: str, n: int = 1) -> None:
+        # 计数允许轻微竞争误差，不为统计再加锁
+        self._counters[name] += n
+
+    # --- Queries ---
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        stripe = self._stripe(key)
+        with stripe.lock:
+            item = stripe.data.get(key)
+            if item is not None:
+                value, expires_at, size = item
+                if expires_at is None or expires_at > time.monotonic():
+                    stripe.data.move_to_end(key)
+                    self._count('hits')
+                    return value
+                del stripe.data[key]
+                stripe.bytes -= size
+                self._count('expirations')
+        self._count('misses')
+        return default
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """命中直接返回；未命中时同一 key 的并发请求只执行一次 loader。"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        def load():
+            # 等待期间可能已被其它 leader 填充
+            cached = self.peek(key)
+            if cached is not _MISSING:
+                return cached
+            self._count('loads')
+            result = loader()
+            self.set(key, result, ttl)
+            return result
+
+        return self._flight.do(key, load)
+
+    def peek(self, key: Hashable) -> Any:
+        """读取但不计入命中统计、不调整 LRU 顺序。"""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            item = stripe.data.get(key)
+            if item is not None and (item[1] is None or item[1] > time.monotonic()):
+                return item[0]
+        return _MISSING
+
+    # --- Mutations ---
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        size = self._sizer(value) if self._bytes_per_stripe else 0
+        if self._bytes_per_stripe and size > self._bytes_per_stripe:
+            # 单个值超过分片预算：不缓存，且移除旧值
+            self.invalidate(key)
+            return
+        stripe = self._stripe(key)
+        with stripe.lock:
+            old = stripe.data.pop(key, None)
+            if old is not None:
+                stripe.bytes -= old[2]
+            stripe.data[key] = (value, expires_at, size)
+            stripe.bytes += size
+            evicted = 0
+            while len(stripe.data) > self._entries_per_stripe or (
+                self._bytes_per_stripe and stripe.bytes > self._bytes_per_stripe
+            ):
+                _, (_, _, old_size) = stripe.data.popitem(last=False)
+                stripe.bytes -= old_size
+                evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
+
+    def invalidate(self, key: Hashable) -> None:
+        stripe = self._stripe(key)
+        with stripe.lock:
+            item = stripe.data.pop(key, None)
+            if item is not None:
+                stripe.bytes -= item[2]
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """删除满足 predicate(key) 的条目，返回删除数量。"""
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                for key in [k for k in stripe.data if predicate(k)]:
+                    stripe.bytes -= stripe.data.pop(key)[2]
+                    removed += 1
+        return removed
+
+    def clear(self) -> None:
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.data.clear()
+                stripe.bytes = 0
+
+    # --- Stats ---
+    def __len__(self) -> int:
+        return sum(len(s.data) for s in self._stripes)
+
+    def stats(self) -> Dict[str, Any]:
+        c = dict(self._counters)
+        lookups = c['hits'] + c['misses']
+        c.update({
+            'coalesced': self._flight.coalesced,
+            'entries': len(self),
+            'bytes': sum(s.bytes for s in self._stripes) if self._bytes_per_stripe else None,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hit_ratio': round(c['hits'] / lookups, 4) if lookups else None,
+        })
+        return c
+
+
+_registry: Dict[str, LRUCache] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(cache: LRUCache) -> None:
+    with _registry_lock:
+        _registry[cache.name] = cache
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """当前进程内所有 LRUCache 的统计。"""
+    with _registry_lock:
+        caches = list(_registry.values())
+    return {c.name: c.stats() for c in caches}
+
+
+__all__ = ['LRUCache', 'SingleFlight', 'approx_size', 'cache_stats']
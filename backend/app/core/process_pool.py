@@ -0,0 +1,68 @@
+"""Shared process pool for CPU-bound image work (renditions, tiles).
+
+Decoding and resampling large images holds the GIL for a long time, so it runs
+in separate processes and web workers only wait on futures. The pool is created
+lazily per process: a gunicorn worker forked after preload gets its own pool,
+and a pool broken by a crashed child is replaced on the next call.
+
+    IMAGE_WORKERS             processes per web worker (default 2)
+    IMAGE_POOL_START_METHOD   multiprocessing start method (default spawn)
+
+Tasks must be plain functions from a light module (see backend/imaging.py):
+with ``spawn`` each child imports only that module.
+"""
+from __future__ import annotations
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+IMAGE_WORKERS = max(1, int(os.environ.get('IMAGE_WORKERS', '2')))
+START_METHOD = os.environ.get('IMAGE_POOL_START_METHOD', 'spawn')
+
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pid: Optional[int] = None
+_start_method = START_METHOD
+
+
+def configure(start_method: str) -> None:
+    """切换启动方式（测试使用 fork）；已创建的池将被替换。"""
+    global _start_method
+    shutdown()
+    _start_method = start_method
+
+
+def image_pool() -> ProcessPoolExecutor:
+    global _pool, _pid
+    with _lock:
+        if _pool is None or _pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context(_start_method)
+            )
+            _pid = os.getpid()
+        return _pool
+
+
+def submit(fn: Callable[..., Any], *args: Any) -> Future:
+    """提交任务；池已损坏（子进程崩溃）时重建一次。"""
+    global _pool
+    try:
+        return image_pool().submit(fn, *args)
+    except BrokenProcessPool:
+        with _lock:
+            _pool = None
+        return image_pool().submit(fn, *args)
+
+
+def shutdown() -> None:
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None and _pid == os.getpid():
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+__all__ = ['image_pool', 'submit', 'shutdown', 'configure', 'IMAGE_WORKERS']
@@ -0,0 +1,238 @@
+"""Cross-worker shared cache for hot reads (statistics etc.).
+
+Gunicorn workers are separate processes, so a class-level dict only caches (and
+invalidates) inside the worker that handled the request. This module puts the
+cached values in one store that every worker on the host reads and writes:
+
+    SHARED_CACHE_BACKEND=sqlite   (default) WAL-mode SQLite file at SHARED_CACHE_PATH
+    SHARED_CACHE_BACKEND=memory   in-process dict (single worker / tests)
+
+Values must be JSON-serializable. Keys are namespaced (``<namespace>:<key>``) and
+invalidation is by exact key or key prefix, so a write in one worker is visible
+to all others on their next read. Each namespace keeps hit / miss counters for
+the current process (see ``shared_cache_metrics``).
+
+Usage:
+    stats_cache = shared_cache('stats', ttl=15)
+    value = stats_cache.get_or_set(f"{ds}:{expert}", lambda: compute())
+    stats_cache.delete_prefix(f"{ds}:")
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """进程内后端：仅用于单 worker 部署或测试。"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISSING
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                self._data.pop(key, None)
+                return _MISSING
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (json.loads(json.dumps(value)), expires_at)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for k in [k for k in self._data if k.startswith(prefix)]:
+                self._data.pop(k, None)
+
+
+class SQLiteBackend:
+    """同机多 worker 共享的 SQLite 后端（WAL，按线程 / 进程持有连接）。"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._purge_every = 512
+        self._writes = 0
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        # fork 后不得复用父进程的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> Any:
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return _MISSING
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at)
+        )
+        # 过期行在读路径上只被忽略；写入时定期批量清理
+        self._writes += 1
+        if self._writes % self._purge_every == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str) -> None:
+        # 以 substr 比较前缀，避免 LIKE 对 '_' / '%' 的转义问题
+        self._conn().execute(
+            "DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+        )
+
+
+def _create_backend():
+    kind = (os.getenv('SHARED_CACHE_BACKEND') or 'sqlite').lower()
+    if kind == 'sqlite':
+        path = os.getenv('SHARED_CACHE_PATH') or os.path.join(tempfile.gettempdir(), 'medc_shared_cache.sqlite3')
+        try:
+            return SQLiteBackend(path)
+        except Exception as e:  # pragma: no cover - 只读文件系统等
+            logging.warning(f"共享缓存 SQLite 不可用（{e}），退回进程内缓存")
+    return MemoryBackend()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+class SharedCache:
+    """One namespace in the shared store, with per-process hit / miss counters."""
+
+    def __init__(self, namespace: str, ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            value = get_backend().get(self._key(key))
+        except Exception as e:
+            # 缓存故障不影响业务读：按未命中处理
+            self.errors += 1
+            logging.warning(f"共享缓存读取失败 {self.namespace}: {e}")
+            value = _MISSING
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            get_backend().set(self._key(key), value, ttl if ttl is not None else self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logging.warning(f"共享缓存写入失败 {self.namespace}: {e}")
+
+    def get_or_set(self, key: str, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, key: str) -> None:
+        try:
+            get_backend().delete(self._key(key))
+        except Exception as e:
+            self.errors += 1
+            logging.warning(f"共享缓存失效失败 {self.namespace}: {e}")
+
+    def delete_prefix(self, prefix: str = '') -> None:
+        try:
+            get_backend().delete_prefix(self._key(prefix))
+        except Exception as e:
+            self.errors += 1
+            logging.warning(f"共享缓存失效失败 {self.namespace}: {e}")
+
+    def clear(self) -> None:
+        self.delete_prefix('')
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+_caches: Dict[str, SharedCache] = {}
+
+
+def shared_cache(namespace: str, ttl: Optional[float] = None) -> SharedCache:
+    """按命名空间获取（并登记）共享缓存实例。"""
+    cache = _caches.get(namespace)
+    if cache is None:
+        cache = _caches.setdefault(namespace, SharedCache(namespace, ttl))
+    return cache
+
+
+def shared_cache_metrics() -> Dict[str, Any]:
+    """当前 worker 进程内各命名空间的命中统计。"""
+    return {
+        'backend': get_backend().name,
+        'namespaces': {name: c.metrics() for name, c in _caches.items()},
+    }
+
+
+__all__ = ['shared_cache', 'shared_cache_metrics', 'SharedCache', 'MemoryBackend', 'SQLiteBackend', 'get_backend']
@@ -1,4 +1,4 @@
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING
 import logging
 
 def init_database(mongo_uri, db_name):
@@ -12,6 +12,7 @@ def init_database(mongo_uri, db_name):
         current_version = system_info.get("value", 0) if system_info else 0
         
         logging.info(f"当前数据库版本: {current_version}")
+        retry_pending_indexes(db)
         
         # 如果版本低于1，执行v1升级
         if current_version < 1:
@@ -35,8 +36,149 @@ def init_database(mongo_uri, db_name):
                     upsert=True
                 )
                 logging.info("数据库已升级到版本2（索引创建）")
+                current_version = 2
             else:
                 logging.warning("数据库升级到版本2失败，后续可重试或手动创建索引")
+
+        # 如果版本为2，执行v3升级（预计算图片顺序集合索引；前序升级失败时不跳级）
+        if current_version == 2:
+            upgraded = upgrade_to_v3(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 3}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本3（image_orders 索引）")
+                current_version = 3
+            else:
+                logging.warning("数据库升级到版本3失败，后续可重试或手动创建索引")
+
+        # 如果版本为3，执行v4升级（标注去重 + 唯一复合索引）
+        if current_version == 3:
+            upgraded = upgrade_to_v4(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 4}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本4（annotations 唯一索引）")
+                current_version = 4
+            else:
+                logging.warning("数据库升级到版本4失败，请检查重复标注后重试")
+
+        # 如果版本为4，执行v5升级（已标注位图集合索引）
+        if current_version == 4:
+            upgraded = upgrade_to_v5(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 5}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本5（annotated_bitmaps 索引）")
+                current_version = 5
+            else:
+                logging.warning("数据库升级到版本5失败，后续可重试或手动创建索引")
+
+        # 如果版本为5，执行v6升级（物化进度计数）
+        if current_version == 5:
+            upgraded = upgrade_to_v6(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 6}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本6（dataset_progress 计数）")
+                current_version = 6
+            else:
+                logging.warning("数据库升级到版本6失败，统计接口将按数据集惰性对账")
+
+        # 如果版本为6，执行v7升级（label_id 序列初始化 + 唯一索引）
+        if current_version == 6:
+            upgraded = upgrade_to_v7(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 7}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本7（labels.label_id 唯一索引）")
+                current_version = 7
+            else:
+                logging.warning("数据库升级到版本7失败，后续可重试")
+
+        # 如果版本为7，执行v8升级（export_jobs 索引）
+        if current_version == 7:
+            upgraded = upgrade_to_v8(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 8}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本8（export_jobs 索引）")
+                current_version = 8
+            else:
+                logging.warning("数据库升级到版本8失败，导出任务查询将退化为全表扫描")
+
+        # 如果版本为8，执行v9升级（增量导出索引）
+        if current_version == 8:
+            upgraded = upgrade_to_v9(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 9}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本9（annotations record_id 索引）")
+                current_version = 9
+            else:
+                logging.warning("数据库升级到版本9失败，全量导出排序将退化为内存排序")
+
+        # 如果版本为9，执行v10升级（内容寻址存储的哈希索引）
+        if current_version == 9:
+            upgraded = upgrade_to_v10(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 10}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本10（images.content_hash 唯一索引）")
+                current_version = 10
+            else:
+                logging.warning("数据库升级到版本10失败，上传去重将退化为全表扫描")
+
+        # 如果版本为10，执行v11升级（增量导出的服务端变更标记）
+        if current_version == 10:
+            upgraded = upgrade_to_v11(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 11}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本11（annotations.changed_at）")
+                current_version = 11
+            else:
+                logging.warning("数据库升级到版本11失败，历史标注不会出现在增量导出中")
+
+        # 如果版本为11，执行v12升级（导出任务同键构建的唯一占位）
+        if current_version == 11:
+            upgraded = upgrade_to_v12(db)
+            if upgraded:
+                db.system_info.update_one(
+                    {"key": "db_version"},
+                    {"$set": {"value": 12}},
+                    upsert=True
+                )
+                logging.info("数据库已升级到版本12（export_jobs.active_key 唯一索引）")
+                current_version = 12
+            else:
+                logging.warning("数据库升级到版本12失败，并发提交的同键导出可能重复构建")
         
         return True
     except Exception as e:
@@ -124,3 +266,236 @@ def upgrade_to_v2(db):
     except Exception as e:
         logging.error(f"升级到版本2失败: {str(e)}")
         return False
+
+
+def upgrade_to_v3(db):
+    """升级数据库到版本3（每个专家的预计算图片顺序）。
+
+    - image_orders: (dataset_id, expert_id) 唯一索引，next_image 依赖其单次查找
+    """
+    try:
+        db.image_orders.create_index([
+            ("dataset_id", ASCENDING), ("expert_id", ASCENDING)
+        ], name="imgorder_ds_expert", unique=True)
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本3失败: {str(e)}")
+        return False
+
+
+def dedupe_annotations(db, batch_size=1000):
+    """删除同一 (dataset_id, expert_id, image_id) 的重复标注，仅保留最新一条。
+
+    “最新”按 datetime 降序、_id 降序判定（与用户最后一次保存的内容一致）。
+    返回删除的文档数。
+    """
+    pipeline = [
+        {"$sort": {"datetime": DESCENDING, "_id": DESCENDING}},
+        {"$group": {
+            "_id": {"dataset_id": "$dataset_id", "expert_id": "$expert_id", "image_id": "$image_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    removed = 0
+    pending = []
+    for group in db.annotations.aggregate(pipeline, allowDiskUse=True):
+        pending.extend(group["ids"][1:])
+        if len(pending) >= batch_size:
+            removed += db.annotations.delete_many({"_id": {"$in": pending}}).deleted_count
+            pending = []
+    if pending:
+        removed += db.annotations.delete_many({"_id": {"$in": pending}}).deleted_count
+    return removed
+
+
+def upgrade_to_v4(db):
+    """升级数据库到版本4（标注唯一性）。
+
+    - 去重：同一 (dataset_id, expert_id, image_id) 只保留最新一条
+    - annotations: 以唯一复合索引替换 v2 的普通索引 ann_ds_expert_img
+      （键相同、选项不同的索引不能并存，需先删除旧索引）
+    """
+    try:
+        removed = dedupe_annotations(db)
+        logging.info(f"已删除重复标注 {removed} 条")
+        existing = db.annotations.index_information()
+        if "ann_ds_expert_img" in existing and not existing["ann_ds_expert_img"].get("unique"):
+            db.annotations.drop_index("ann_ds_expert_img")
+        db.annotations.create_index([
+            ("dataset_id", ASCENDING), ("expert_id", ASCENDING), ("image_id", ASCENDING)
+        ], name="ann_ds_expert_img_unique", unique=True)
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本4失败: {str(e)}")
+        return False
+
+
+def upgrade_to_v5(db):
+    """升级数据库到版本5（每个专家的已标注图片位图）。
+
+    - annotated_bitmaps: (dataset_id, expert_id) 唯一索引；位图文档在首次读取时由 annotations 惰性构建
+    """
+    try:
+        db.annotated_bitmaps.create_index([
+            ("dataset_id", ASCENDING), ("expert_id", ASCENDING)
+        ], name="annbitmap_ds_expert", unique=True)
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本5失败: {str(e)}")
+        return False
+
+
+def upgrade_to_v6(db):
+    """升级数据库到版本6（物化的数据集进度计数）。
+
+    - dataset_progress: (dataset_id, expert_id) 唯一索引
+    - 由 image_datasets / annotations 对账一次，生成全部数据集的初始计数
+    """
+    try:
+        db.dataset_progress.create_index([
+            ("dataset_id", ASCENDING), ("expert_id", ASCENDING)
+        ], name="progress_ds_expert", unique=True)
+        from app.repositories.progress_repository import reconcile_progress
+        written = reconcile_progress(db)
+        logging.info(f"dataset_progress 初始对账完成，写入 {written} 条计数")
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本6失败: {str(e)}")
+        return False
+
+
+def create_labels_label_id_unique(db):
+    """labels.label_id 唯一索引；存在重复 label_id 时记录并返回 False（重复 ID 可能已被标注引用，不能自动删除或重新编号）。"""
+    duplicates = list(db.labels.aggregate([
+        {"$group": {"_id": "$label_id", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": 20}
+    ]))
+    if duplicates:
+        logging.error(f"labels 存在重复 label_id，暂不创建唯一索引，处理后重启即可自动补建: {[d['_id'] for d in duplicates]}")
+        return False
+    db.labels.create_index([("label_id", ASCENDING)], name="labels_label_id_unique", unique=True)
+    return True
+
+
+# 因数据问题暂缓的索引：名称 -> 创建函数；记录在 system_info(pending_indexes)，每次启动重试
+PENDING_INDEX_BUILDERS = {
+    "labels_label_id_unique": create_labels_label_id_unique,
+}
+
+
+def defer_index(db, name):
+    db.system_info.update_one({"key": "pending_indexes"}, {"$addToSet": {"value": name}}, upsert=True)
+
+
+def retry_pending_indexes(db):
+    """重试暂缓的索引；成功的从待办中移除。版本号不依赖这些索引，后续升级照常进行。"""
+    pending = db.system_info.find_one({"key": "pending_indexes"}) or {}
+    for name in pending.get("value", []):
+        builder = PENDING_INDEX_BUILDERS.get(name)
+        try:
+            if builder is None or builder(db):
+                db.system_info.update_one({"key": "pending_indexes"}, {"$pull": {"value": name}})
+                logging.info(f"暂缓的索引已处理: {name}")
+        except Exception as e:
+            logging.error(f"重试索引 {name} 失败: {str(e)}")
+
+
+def upgrade_to_v7(db):
+    """升级数据库到版本7（标签 ID 改由 sequences 原子分配）。
+
+    - sequences(labels_id): 以 $max 抬升到现有最大 label_id（只做一次，此后分配不再扫描 labels）
+    - labels: label_id 唯一索引；存在重复 label_id 时记入 pending_indexes 暂缓创建，
+      版本仍升到 7，v8 及以后的升级不被阻塞（重复处理后下次启动自动补建）
+    """
+    try:
+        max_label = db.labels.find_one({"label_id": {"$type": "number"}}, sort=[("label_id", DESCENDING)])
+        current_max = max_label.get("label_id", 0) if max_label else 0
+        db.sequences.update_one({"_id": "labels_id"}, {"$max": {"sequence_value": current_max}}, upsert=True)
+        if not create_labels_label_id_unique(db):
+            defer_index(db, "labels_label_id_unique")
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本7失败: {str(e)}")
+        return False
+
+
+def upgrade_to_v8(db):
+    """升级数据库到版本8（异步导出任务）。
+
+    - export_jobs: (cache_key, status) 用于复用进行中的同键任务
+    - export_jobs: created_at TTL 索引，7 天后自动删除任务记录（产物由磁盘缓存自行清理）
+    """
+    try:
+        db.export_jobs.create_index([("cache_key", ASCENDING), ("status", ASCENDING)], name="export_jobs_key_status")
+        db.export_jobs.create_index([("created_at", ASCENDING)], name="export_jobs_ttl", expireAfterSeconds=7 * 24 * 3600)
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本8失败: {str(e)}")
+        return False
+
+
+def upgrade_to_v9(db):
+    """升级数据库到版本9（导出按 record_id 的索引范围扫描）。
+
+    - annotations: (dataset_id, record_id) / (record_id)：全量导出的排序
+    （增量导出的水位分页索引见 v11 的 changed_at 索引）
+    """
+    try:
+        db.annotations.create_index([("dataset_id", ASCENDING), ("record_id", ASCENDING)], name="ann_ds_rid")
+        # setup_database / db_utils 可能已建过 record_id 唯一索引（同键不同名会冲突）
+        if not any(info.get("key") == [("record_id", 1)] for info in db.annotations.index_information().values()):
+            db.annotations.create_index([("record_id", ASCENDING)], name="ann_record_id")
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本9失败: {str(e)}")
+        return False
+
+
+def upgrade_to_v10(db):
+    """升级数据库到版本10（内容寻址图片存储）。
+
+    - images: content_hash 唯一索引（部分索引，仅约束带哈希的文档；历史扁平路径的图片不参与去重）
+    """
+    try:
+        db.images.create_index(
+            [("content_hash", ASCENDING)], name="images_content_hash_unique", unique=True,
+            partialFilterExpression={"content_hash": {"$exists": True}}
+        )
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本10失败: {str(e)}")
+        return False
+
+
+def upgrade_to_v11(db):
+    """升级数据库到版本11（增量导出改用服务端变更标记）。
+
+    - annotations: 缺少 changed_at 的历史标注统一标记为升级时刻（下一次增量会完整重发一次，不丢行）
+    - annotations: (dataset_id, changed_at, record_id) / (changed_at, record_id)：水位键集分页
+    """
+    try:
+        db.annotations.update_many({"changed_at": {"$exists": False}}, {"$currentDate": {"changed_at": True}})
+        db.annotations.create_index([("dataset_id", ASCENDING), ("changed_at", ASCENDING), ("record_id", ASCENDING)], name="ann_ds_changed_rid")
+        db.annotations.create_index([("changed_at", ASCENDING), ("record_id", ASCENDING)], name="ann_changed_rid")
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本11失败: {str(e)}")
+        return False
+
+
+def upgrade_to_v12(db):
+    """升级数据库到版本12（同键导出任务只构建一次）。
+
+    - export_jobs: active_key 稀疏唯一索引。queued/running 的任务带 active_key = cache_key，
+      结束时移除，因此同一 cache_key 同时只能有一个进行中的任务（4.4 的部分索引不支持 $in，
+      故用仅在进行中存在的字段表达 “status in (queued, running)”）
+    """
+    try:
+        db.export_jobs.create_index([("active_key", ASCENDING)], name="export_jobs_active_key", unique=True, sparse=True)
+        return True
+    except Exception as e:
+        logging.error(f"升级到版本12失败: {str(e)}")
+        return False
@@ -1,11 +1,29 @@
 """Repository layer package (Phase 3).
 
-Currently only implements DatasetRepository as a pattern example.
-Other collections can follow the same shape incrementally to reduce refactor risk.
+Implements DatasetRepository as a pattern example, ImageOrderRepository for
+the precomputed per-expert image order, ImageListingRepository for the
+aggregation-based paginated listings, AnnotatedBitmapRepository for the
+per-expert annotated-image bitmaps and ProgressRepository for the materialized
+progress counters. Other collections can follow the same
+shape incrementally to reduce refactor risk.
 """
 from .dataset_repository import dataset_repository, DatasetRepository  # noqa: F401
+from .annotated_bitmap_repository import annotated_bitmap_repository, AnnotatedBitmapRepository, AnnotatedBitmap  # noqa: F401
+from .image_order_repository import image_order_repository, ImageOrderRepository, stable_order  # noqa: F401
+from .image_listing_repository import image_listing_repository, ImageListingRepository  # noqa: F401
+from .progress_repository import progress_repository, ProgressRepository  # noqa: F401
 
 __all__ = [
     'dataset_repository',
-    'DatasetRepository'
+    'DatasetRepository',
+    'image_order_repository',
+    'ImageOrderRepository',
+    'stable_order',
+    'image_listing_repository',
+    'ImageListingRepository',
+    'annotated_bitmap_repository',
+    'AnnotatedBitmapRepository',
+    'AnnotatedBitmap',
+    'progress_repository',
+    'ProgressRepository'
 ]
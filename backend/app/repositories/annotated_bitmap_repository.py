@@ -0,0 +1,159 @@
+"""Per-expert annotated-image bitmap (collection: annotated_bitmaps).
+
+One document per (dataset_id, expert_id) records which image_ids the expert has
+annotated as a sparse set of 64-bit words keyed by word index (image_id >> 6):
+
+    { dataset_id, expert_id, words: {"<image_id >> 6>": Int64}, built_at, building? }
+
+Only non-zero words are stored, so sparse id ranges cost nothing, and a dense
+100k-image dataset costs ~1.6k words. Saves set bits with atomic ``$bit``
+updates (no read-modify-write race); clears drop the document. A missing
+document is rebuilt from the annotations collection.
+
+Saves only update an existing document, so a rebuild first creates it with
+``building: true`` and only then scans annotations: a save that skipped its
+mark did so before the document existed, hence committed before the scan and
+is picked up by it; every later save marks the document directly. Readers treat
+a ``building`` document as missing until the scan has been merged in.
+
+Readers load the document in one point read and then answer membership and
+"first unannotated in order" with O(1) word tests; counts are a popcount.
+"""
+from __future__ import annotations
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, List, Dict, Any, Optional
+
+from bson.int64 import Int64
+
+from app.core.db import get_db, USE_DATABASE
+
+_WORD_BITS = 64
+_UNSIGNED = (1 << _WORD_BITS) - 1
+
+
+def _to_int64(word: int) -> Int64:
+    """unsigned 64 位字 -> BSON Int64（有符号补码）。"""
+    word &= _UNSIGNED
+    return Int64(word - (1 << _WORD_BITS) if word >= (1 << (_WORD_BITS - 1)) else word)
+
+
+class AnnotatedBitmap:
+    """In-memory view of one persisted bitmap (word index -> unsigned 64-bit word)."""
+
+    __slots__ = ('words',)
+
+    def __init__(self, words: Optional[Dict[int, int]] = None):
+        self.words: Dict[int, int] = words or {}
+
+    @classmethod
+    def from_doc(cls, doc: Optional[Dict[str, Any]]) -> 'AnnotatedBitmap':
+        raw = (doc or {}).get('words') or {}
+        return cls({int(k): int(v) & _UNSIGNED for k, v in raw.items() if v})
+
+    @classmethod
+    def from_ids(cls, image_ids: Iterable[int]) -> 'AnnotatedBitmap':
+        bm = cls()
+        for iid in image_ids:
+            bm.add(iid)
+        return bm
+
+    def add(self, image_id: int) -> None:
+        wi, bit = divmod(int(image_id), _WORD_BITS)
+        self.words[wi] = self.words.get(wi, 0) | (1 << bit)
+
+    def __contains__(self, image_id) -> bool:
+        if image_id is None:
+            return False
+        wi, bit = divmod(int(image_id), _WORD_BITS)
+        return bool(self.words.get(wi, 0) >> bit & 1)
+
+    def count(self) -> int:
+        return sum(bin(w).count('1') for w in self.words.values())
+
+    def first_missing(self, image_ids: Iterable[int], start: int = 0) -> Optional[int]:
+        """返回序列中（从 start 位置起）第一个未置位图片的位置；全部置位返回 None。"""
+        words = self.words
+        for pos, iid in enumerate(image_ids, start):
+            wi, bit = divmod(int(iid), _WORD_BITS)
+            if not (words.get(wi, 0) >> bit & 1):
+                return pos
+        return None
+
+
+class AnnotatedBitmapRepository:
+    def __init__(self):
+        self.db = get_db()
+
+    def _ensure(self):
+        if self.db is None or not USE_DATABASE:
+            self.db = get_db()
+        if not USE_DATABASE or self.db is None:
+            raise RuntimeError("数据库连接不可用")
+
+    @staticmethod
+    def _bit_update(image_ids: Iterable[int]) -> Dict[str, Any]:
+        masks: Dict[int, int] = defaultdict(int)
+        for iid in image_ids:
+            wi, bit = divmod(int(iid), _WORD_BITS)
+            masks[wi] |= 1 << bit
+        return {f'words.{wi}': {'or': _to_int64(mask)} for wi, mask in masks.items()}
+
+    # --- Queries ---
+    def load(self, dataset_id: int, expert_id: Optional[str]) -> AnnotatedBitmap:
+        """单次点查加载位图；文档不存在或仍在构建时由 annotations 重建。"""
+        self._ensure()
+        doc = self.db.annotated_bitmaps.find_one(
+            {'dataset_id': dataset_id, 'expert_id': expert_id}, {'_id': 0, 'words': 1, 'building': 1}
+        )
+        if doc is None or doc.get('building'):
+            return self.rebuild(dataset_id, expert_id)
+        return AnnotatedBitmap.from_doc(doc)
+
+    # --- Mutations ---
+    def rebuild(self, dataset_id: int, expert_id: Optional[str]) -> AnnotatedBitmap:
+        """从 annotations 全量重建。以 $bit or 合并写入，不会覆盖并发保存已置的位。
+
+        先建出 building 文档再扫描 annotations，使扫描期间的保存都能直接置位；
+        合并扫描结果后去掉 building 标记（不 upsert：期间被 clear 则保持删除）。
+        """
+        self._ensure()
+        key = {'dataset_id': dataset_id, 'expert_id': expert_id}
+        self.db.annotated_bitmaps.update_one(key, {'$set': {'building': True}}, upsert=True)
+        image_ids = [
+            a.get('image_id') for a in self.db.annotations.find(
+                {'dataset_id': dataset_id, 'expert_id': expert_id}, {'_id': 0, 'image_id': 1}
+            ) if a.get('image_id') is not None
+        ]
+        bm = AnnotatedBitmap.from_ids(image_ids)
+        update: Dict[str, Any] = {'$set': {'built_at': datetime.now().isoformat()}, '$unset': {'building': ''}}
+        if image_ids:
+            update['$bit'] = self._bit_update(image_ids)
+        self.db.annotated_bitmaps.update_one(key, update)
+        return bm
+
+    def mark(self, dataset_id: int, expert_id: Optional[str], image_ids: List[int]) -> None:
+        """保存标注后置位（批量保存合并为一次更新）。
+
+        仅更新已存在的位图（包括构建中的）：尚未构建时由首次 load 从 annotations 重建，避免得到不完整位图。
+        """
+        self._ensure()
+        ids = [iid for iid in image_ids if iid is not None]
+        if not ids:
+            return
+        self.db.annotated_bitmaps.update_one(
+            {'dataset_id': dataset_id, 'expert_id': expert_id}, {'$bit': self._bit_update(ids)}
+        )
+
+    def clear(self, dataset_id: int, expert_id: Optional[str] = None) -> None:
+        """标注被清空 / 数据集删除后丢弃位图。"""
+        self._ensure()
+        query: Dict[str, Any] = {'dataset_id': dataset_id}
+        if expert_id is not None:
+            query['expert_id'] = expert_id
+        self.db.annotated_bitmaps.delete_many(query)
+
+
+annotated_bitmap_repository = AnnotatedBitmapRepository()
+
+__all__ = ['annotated_bitmap_repository', 'AnnotatedBitmapRepository', 'AnnotatedBitmap']
@@ -0,0 +1,152 @@
+"""Paginated image listing repository (server-side join via aggregation).
+
+Pushes the image ⨝ annotation join, the annotated/unannotated filter, the
+stable ordering and $skip/$limit into a single MongoDB aggregation so that a
+page costs O(page_size) documents instead of loading the whole dataset.
+
+Rows returned: {image_id, image_path, annotation | None}; label enrichment and
+response shaping stay in the service layer.
+
+Correlated $lookup uses the ``let`` + ``$expr`` form so it runs on MongoDB 4.4
+(the compose files' image); ``localField`` + ``pipeline`` would need 5.0.
+"""
+from __future__ import annotations
+from typing import List, Dict, Any, Optional
+
+from app.core.db import get_db, USE_DATABASE
+
+
+class ImageListingRepository:
+    def __init__(self):
+        self.db = get_db()
+
+    def _ensure(self):
+        if self.db is None or not USE_DATABASE:
+            self.db = get_db()
+        if not USE_DATABASE or self.db is None:
+            raise RuntimeError("数据库连接不可用")
+
+    # --- Pipeline fragments ---
+    @staticmethod
+    def _annotation_lookup(local_field: str, dataset_id: int, expert_id: Optional[str]) -> Dict[str, Any]:
+        # (dataset_id, expert_id) 等值 + image_id 的 $expr 等值，命中 ann_ds_expert_img 复合索引
+        return {'$lookup': {
+            'from': 'annotations',
+            'let': {'iid': f'${local_field}'},
+            'pipeline': [
+                {'$match': {'dataset_id': dataset_id, 'expert_id': expert_id,
+                            '$expr': {'$eq': ['$image_id', '$$iid']}}},
+                {'$project': {'_id': 0, 'changed_at': 0}},
+                {'$limit': 1}
+            ],
+            'as': 'ann'
+        }}
+
+    @staticmethod
+    def _annotated_filter(annotated: Optional[bool]) -> List[Dict[str, Any]]:
+        if annotated is None:
+            return []
+        return [{'$match': {'ann.0': {'$exists': bool(annotated)}}}]
+
+    @staticmethod
+    def _page(skip: int, limit: int) -> List[Dict[str, Any]]:
+        stages: List[Dict[str, Any]] = []
+        if skip > 0:
+            stages.append({'$skip': int(skip)})
+        stages.append({'$limit': int(limit)})
+        return stages
+
+    @staticmethod
+    def _image_projection(local_field: str) -> List[Dict[str, Any]]:
+        return [
+            {'$lookup': {
+                'from': 'images',
+                'let': {'iid': f'${local_field}'},
+                'pipeline': [
+                    {'$match': {'$expr': {'$eq': ['$image_id', '$$iid']}}},
+                    {'$project': {'_id': 0, 'image_path': 1}},
+                    {'$limit': 1}
+                ],
+                'as': 'img'
+            }},
+            # 关联不到图片文档的悬挂链接与旧实现一致地被排除
+            {'$match': {'img.0': {'$exists': True}}},
+            {'$project': {
+                '_id': 0,
+                'image_id': f'${local_field}',
+                'image_path': {'$ifNull': [{'$arrayElemAt': ['$img.image_path', 0]}, '']},
+                'annotation': {'$arrayElemAt': ['$ann', 0]}
+            }}
+        ]
+
+    @staticmethod
+    def _rows(cursor) -> List[Dict[str, Any]]:
+        rows = []
+        for r in cursor:
+            r.setdefault('annotation', None)
+            rows.append(r)
+        return rows
+
+    # --- Queries ---
+    def page_by_dataset(
+        self,
+        dataset_id: int,
+        expert_id: Optional[str],
+        skip: int,
+        limit: int,
+        annotated: Optional[bool] = None,
+        with_annotations: bool = True
+    ) -> List[Dict[str, Any]]:
+        """按 image_id 升序（image_datasets 索引顺序）分页；可选合并某专家的标注并按是否已标注过滤。"""
+        self._ensure()
+        if limit <= 0:
+            return []
+        pipeline: List[Dict[str, Any]] = [
+            {'$match': {'dataset_id': dataset_id}},
+            {'$sort': {'image_id': 1}},
+        ]
+        if annotated is not None:
+            # 需要过滤时 join 必须位于 $skip 之前
+            pipeline.append(self._annotation_lookup('image_id', dataset_id, expert_id))
+            pipeline += self._annotated_filter(annotated)
+            pipeline += self._page(skip, limit)
+        else:
+            # 无过滤：先分页再 join，代价只与页大小相关
+            pipeline += self._page(skip, limit)
+            if with_annotations:
+                pipeline.append(self._annotation_lookup('image_id', dataset_id, expert_id))
+        pipeline += self._image_projection('image_id')
+        return self._rows(self.db.image_datasets.aggregate(pipeline))
+
+    def page_by_order(
+        self,
+        dataset_id: int,
+        expert_id: Optional[str],
+        annotated: Optional[bool],
+        skip: int,
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """按 image_orders 中该专家的稳定随机顺序分页（$unwind 保持数组顺序，无需 $sort）。"""
+        self._ensure()
+        if limit <= 0:
+            return []
+        pipeline: List[Dict[str, Any]] = [
+            {'$match': {'dataset_id': dataset_id, 'expert_id': expert_id}},
+            {'$limit': 1},
+            {'$project': {'_id': 0, 'order': 1}},
+            {'$unwind': {'path': '$order', 'includeArrayIndex': 'pos'}},
+            self._annotation_lookup('order', dataset_id, expert_id),
+        ]
+        pipeline += self._annotated_filter(annotated)
+        pipeline += self._page(skip, limit)
+        pipeline += self._image_projection('order')
+        return self._rows(self.db.image_orders.aggregate(pipeline))
+
+    def annotated_count(self, dataset_id: int, expert_id: Optional[str]) -> int:
+        self._ensure()
+        return self.db.annotations.count_documents({'dataset_id': dataset_id, 'expert_id': expert_id})
+
+
+image_listing_repository = ImageListingRepository()
+
+__all__ = ['image_listing_repository', 'ImageListingRepository']
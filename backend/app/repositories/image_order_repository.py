@@ -0,0 +1,172 @@
+"""Per-expert image order repository (collection: image_orders).
+
+Each (dataset_id, expert_id) pair owns one document holding the stable shuffled
+image id order plus a persistent cursor:
+
+    { dataset_id, expert_id, order: [image_id, ...], cursor, size, built_at }
+
+Invariant: every position < cursor is annotated by the expert, so "next image"
+is simply order[cursor]. The order reproduces the historical MD5-seeded shuffle
+(see ``stable_order``) so switching to the stored order keeps user progress
+identical.
+"""
+from __future__ import annotations
+import hashlib
+import random
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+from app.core.db import get_db, USE_DATABASE
+from .annotated_bitmap_repository import annotated_bitmap_repository
+
+
+def order_seed(dataset_id, expert_id) -> int:
+    """用户+数据集 的稳定随机种子（与历史实现保持一致）。"""
+    seed_src = f"{dataset_id}:{expert_id}"
+    return int(hashlib.md5(seed_src.encode('utf-8')).hexdigest(), 16) % (2**31)
+
+
+def stable_order(dataset_id, expert_id, image_ids: List[int]) -> List[int]:
+    """Return a shuffled copy of ``image_ids`` using the (dataset, expert) seed."""
+    ids = list(image_ids)
+    random.Random(order_seed(dataset_id, expert_id)).shuffle(ids)
+    return ids
+
+
+class ImageOrderRepository:
+    # cursor 前移时每次向后读取的顺序窗口大小（已标注判定走位图）
+    SCAN_WINDOW = 256
+
+    def __init__(self):
+        self.db = get_db()
+
+    def _ensure(self):
+        if self.db is None or not USE_DATABASE:
+            self.db = get_db()
+        if not USE_DATABASE or self.db is None:
+            raise RuntimeError("数据库连接不可用")
+
+    # --- Build ---
+    def _dataset_image_ids(self, dataset_id: int) -> List[int]:
+        """数据集图片 ID，顺序与历史 images.find($in) 返回顺序一致（洗牌输入必须相同）。"""
+        links = self.db.image_datasets.find({'dataset_id': dataset_id}, {'_id': 0, 'image_id': 1})
+        image_ids = [l['image_id'] for l in links]
+        if not image_ids:
+            return []
+        imgs = self.db.images.find({'image_id': {'$in': image_ids}}, {'_id': 0, 'image_id': 1})
+        return [img.get('image_id') for img in imgs]
+
+    def build(self, dataset_id: int, expert_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """计算并持久化 (dataset, expert) 的顺序与 cursor；数据集无图片时返回 None。"""
+        self._ensure()
+        order = stable_order(dataset_id, expert_id, self._dataset_image_ids(dataset_id))
+        if not order:
+            return None
+        done = annotated_bitmap_repository.load(dataset_id, expert_id)
+        cursor = done.first_missing(order)
+        if cursor is None:
+            cursor = len(order)
+        doc = {
+            'dataset_id': dataset_id,
+            'expert_id': expert_id,
+            'order': order,
+            'cursor': cursor,
+            'size': len(order),
+            'built_at': datetime.now().isoformat()
+        }
+        self.db.image_orders.replace_one({'dataset_id': dataset_id, 'expert_id': expert_id}, doc, upsert=True)
+        return doc
+
+    # --- Queries ---
+    def current(self, dataset_id: int, expert_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """单次索引查找：返回 {image_id, image_path, cursor, size}；无顺序文档时返回 None。
+
+        image_id 为 None 表示该专家已全部标注完成。
+        """
+        self._ensure()
+        pipeline = [
+            {'$match': {'dataset_id': dataset_id, 'expert_id': expert_id}},
+            {'$limit': 1},
+            {'$project': {
+                '_id': 0,
+                'cursor': 1,
+                'size': 1,
+                'image_id': {'$arrayElemAt': ['$order', '$cursor']}
+            }},
+            {'$lookup': {'from': 'images', 'localField': 'image_id', 'foreignField': 'image_id', 'as': 'image'}},
+            {'$project': {
+                'cursor': 1,
+                'size': 1,
+                'image_id': 1,
+                'image_path': {'$arrayElemAt': ['$image.image_path', 0]}
+            }}
+        ]
+        docs = list(self.db.image_orders.aggregate(pipeline))
+        if not docs:
+            return None
+        doc = docs[0]
+        if doc.get('cursor', 0) >= doc.get('size', 0):
+            doc['image_id'] = None
+        return doc
+
+    def _window(self, dataset_id: int, expert_id: Optional[str], start: int) -> List[int]:
+        doc = self.db.image_orders.find_one(
+            {'dataset_id': dataset_id, 'expert_id': expert_id},
+            {'_id': 0, 'order': {'$slice': [start, self.SCAN_WINDOW]}}
+        )
+        return (doc or {}).get('order') or []
+
+    # --- Mutations ---
+    def advance(self, dataset_id: int, expert_id: Optional[str], image_id: int) -> Optional[int]:
+        """专家保存 image_id 后推进 cursor（跳过其后已乱序标注的图片）。
+
+        仅当 image_id 恰为当前 cursor 指向的图片时才需要扫描；调用前须已在位图中标记该图片。
+        返回新的 cursor（未变化返回 None）。
+        """
+        self._ensure()
+        state = self.db.image_orders.find_one(
+            {'dataset_id': dataset_id, 'expert_id': expert_id}, {'_id': 0, 'cursor': 1, 'size': 1}
+        )
+        if not state:
+            return None
+        cursor, size = state.get('cursor', 0), state.get('size', 0)
+        head = self._window(dataset_id, expert_id, cursor)
+        if not head or head[0] != image_id:
+            return None
+        done = annotated_bitmap_repository.load(dataset_id, expert_id)
+        pos, window = cursor + 1, head[1:]
+        while pos < size:
+            if not window:
+                window = self._window(dataset_id, expert_id, pos)
+                if not window:
+                    break
+            first_open = done.first_missing(window)
+            if first_open is not None:
+                pos += first_open
+                break
+            pos += len(window)
+            window = []
+        pos = min(pos, size)
+        # $max 保证并发保存时 cursor 只前进不回退
+        self.db.image_orders.update_one(
+            {'dataset_id': dataset_id, 'expert_id': expert_id}, {'$max': {'cursor': pos}}
+        )
+        return pos
+
+    def reset_cursors(self, dataset_id: int, expert_id: Optional[str] = None) -> None:
+        """标注被清空后 cursor 归零（顺序本身不变）。"""
+        self._ensure()
+        query: Dict[str, Any] = {'dataset_id': dataset_id}
+        if expert_id is not None:
+            query['expert_id'] = expert_id
+        self.db.image_orders.update_many(query, {'$set': {'cursor': 0}})
+
+    def invalidate(self, dataset_id: int) -> None:
+        """数据集图片集合变化（上传/删除）后丢弃顺序，下次访问时惰性重建。"""
+        self._ensure()
+        self.db.image_orders.delete_many({'dataset_id': dataset_id})
+
+
+image_order_repository = ImageOrderRepository()
+
+__all__ = ['image_order_repository', 'ImageOrderRepository', 'stable_order', 'order_seed']
@@ -0,0 +1,169 @@
+"""Materialized dataset progress counters (collection: dataset_progress).
+
+Two kinds of documents share the unique (dataset_id, expert_id) index:
+
+    { dataset_id, expert_id: None, total_count }        # 数据集图片总数
+    { dataset_id, expert_id: <id>, annotated_count }    # 某专家已标注数
+
+Writers keep them current with ``$inc`` (upload, new annotation) or by dropping
+the affected documents (clear / delete). ``reconcile_progress`` recomputes them
+from image_datasets + annotations in one aggregation and ``$set``s each key in
+place, deleting only keys that existed before the aggregation and are absent
+from its result, so the counters never disappear mid-reconcile and documents
+created meanwhile survive. The statistics endpoint is a single indexed read.
+
+The total document marks a dataset as tracked: a missing expert document means
+0, but increments never create a total document (an untracked dataset is
+reconciled instead), and reconcile writes ``total_count: 0`` for empty
+datasets so they are not recounted on every read. A read that finds a dataset
+untracked reconciles it under a short lease (``system_info`` document
+``progress_reconcile:<dataset_id>``); concurrent readers that miss the lease
+answer from two indexed counts without writing.
+"""
+from __future__ import annotations
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app.core.db import get_db, USE_DATABASE
+
+RECONCILE_LEASE_SECONDS = 60
+
+
+def reconcile_progress(db, dataset_id: Optional[int] = None) -> int:
+    """按 image_datasets / annotations 重算计数（一次聚合 + 一次逐键 $set 的批量写）；返回写入的文档数。"""
+    match: Dict[str, Any] = {'dataset_id': dataset_id} if dataset_id is not None else {}
+    pipeline = [
+        {'$match': match},
+        {'$group': {'_id': {'dataset_id': '$dataset_id', 'expert_id': None}, 'total_count': {'$sum': 1}}},
+        {'$unionWith': {'coll': 'annotations', 'pipeline': [
+            {'$match': match},
+            {'$group': {'_id': {'dataset_id': '$dataset_id', 'expert_id': '$expert_id'}, 'annotated_count': {'$sum': 1}}}
+        ]}},
+    ]
+    # 聚合前的快照：只删除其中已不在结果里的键，聚合期间新建的计数文档保留
+    stale = {
+        (d.get('dataset_id'), d.get('expert_id')): d['_id']
+        for d in db.dataset_progress.find(match, {'dataset_id': 1, 'expert_id': 1})
+    }
+    ops = []
+    tracked = set()
+    for row in db.image_datasets.aggregate(pipeline, allowDiskUse=True):
+        key = {'dataset_id': row['_id'].get('dataset_id'), 'expert_id': row['_id'].get('expert_id')}
+        if 'total_count' in row:
+            values = {'total_count': row['total_count']}
+            tracked.add(key['dataset_id'])
+        else:
+            values = {'annotated_count': row['annotated_count']}
+        stale.pop((key['dataset_id'], key['expert_id']), None)
+        ops.append(UpdateOne(key, {'$set': values}, upsert=True))
+    # 没有图片的数据集也写入 0 总数，避免每次读取都重新对账
+    empty = [dataset_id] if dataset_id is not None else [d['id'] for d in db.datasets.find({}, {'_id': 0, 'id': 1}) if 'id' in d]
+    for ds_id in empty:
+        if ds_id not in tracked:
+            stale.pop((ds_id, None), None)
+            ops.append(UpdateOne({'dataset_id': ds_id, 'expert_id': None}, {'$set': {'total_count': 0}}, upsert=True))
+    if ops:
+        db.dataset_progress.bulk_write(ops, ordered=False)
+    # 逐键覆盖后再删除已无来源的计数（例如已无标注的专家），不做整体先删
+    if stale:
+        db.dataset_progress.delete_many({'_id': {'$in': list(stale.values())}})
+    return len(ops)
+
+
+def _take_lease(db, name: str, seconds: int = RECONCILE_LEASE_SECONDS) -> bool:
+    """以 system_info 文档（_id 唯一）做跨 worker 租约；过期租约（持有者已退出）可被接管。"""
+    now = datetime.utcnow()
+    try:
+        db.system_info.insert_one({'_id': name, 'until': now + timedelta(seconds=seconds)})
+        return True
+    except DuplicateKeyError:
+        return db.system_info.update_one(
+            {'_id': name, 'until': {'$lt': now}}, {'$set': {'until': now + timedelta(seconds=seconds)}}
+        ).modified_count == 1
+
+
+class ProgressRepository:
+    def __init__(self):
+        self.db = get_db()
+
+    def _ensure(self):
+        if self.db is None or not USE_DATABASE:
+            self.db = get_db()
+        if not USE_DATABASE or self.db is None:
+            raise RuntimeError("数据库连接不可用")
+
+    # --- Queries ---
+    def get(self, dataset_id: int, expert_id: Optional[str]) -> Dict[str, int]:
+        """单次索引查询读取 {total_count, annotated_count}。
+
+        数据集尚无计数时在租约保护下对其对账一次；未拿到租约（其它 worker 正在对账）时直接计数返回，不写入。
+        """
+        self._ensure()
+        experts: List[Optional[str]] = [None, expert_id] if expert_id else [None]
+        docs = list(self.db.dataset_progress.find(
+            {'dataset_id': dataset_id, 'expert_id': {'$in': experts}}, {'_id': 0}
+        ))
+        if not any(d.get('expert_id') is None for d in docs):
+            lease = f'progress_reconcile:{dataset_id}'
+            if not _take_lease(self.db, lease):
+                return {
+                    'total_count': self.db.image_datasets.count_documents({'dataset_id': dataset_id}),
+                    'annotated_count': self.db.annotations.count_documents(
+                        {'dataset_id': dataset_id, 'expert_id': expert_id}) if expert_id else 0,
+                }
+            try:
+                reconcile_progress(self.db, dataset_id)
+            finally:
+                self.db.system_info.delete_one({'_id': lease})
+            docs = list(self.db.dataset_progress.find(
+                {'dataset_id': dataset_id, 'expert_id': {'$in': experts}}, {'_id': 0}
+            ))
+        total = next((d.get('total_count', 0) for d in docs if d.get('expert_id') is None), 0)
+        annotated = next((d.get('annotated_count', 0) for d in docs if expert_id and d.get('expert_id') == expert_id), 0)
+        return {'total_count': total, 'annotated_count': annotated}
+
+    # --- Mutations ---
+    def inc_total(self, dataset_id: int, delta: int) -> None:
+        """只递增已存在的总数；数据集尚无计数时改为对账（调用方已写入新图片，对账结果包含本次变化）。"""
+        self._ensure()
+        if delta:
+            result = self.db.dataset_progress.update_one(
+                {'dataset_id': dataset_id, 'expert_id': None}, {'$inc': {'total_count': int(delta)}}
+            )
+            if not result.matched_count:
+                reconcile_progress(self.db, dataset_id)
+
+    def set_total(self, dataset_id: int, value: int) -> None:
+        self._ensure()
+        self.db.dataset_progress.update_one(
+            {'dataset_id': dataset_id, 'expert_id': None}, {'$set': {'total_count': int(value)}}, upsert=True
+        )
+
+    def inc_annotated(self, dataset_id: int, expert_id: Optional[str], delta: int) -> None:
+        """专家计数缺失即为 0，可以 upsert；数据集未被跟踪（无总数文档）时 get() 会整体对账并覆盖它。"""
+        self._ensure()
+        if delta and expert_id:
+            self.db.dataset_progress.update_one(
+                {'dataset_id': dataset_id, 'expert_id': expert_id}, {'$inc': {'annotated_count': int(delta)}}, upsert=True
+            )
+
+    def clear_annotated(self, dataset_id: int) -> None:
+        """清空标注后删除所有专家计数（缺失即视为 0）。"""
+        self._ensure()
+        self.db.dataset_progress.delete_many({'dataset_id': dataset_id, 'expert_id': {'$ne': None}})
+
+    def drop(self, dataset_id: int) -> None:
+        self._ensure()
+        self.db.dataset_progress.delete_many({'dataset_id': dataset_id})
+
+    def reconcile(self, dataset_id: Optional[int] = None) -> int:
+        self._ensure()
+        return reconcile_progress(self.db, dataset_id)
+
+
+progress_repository = ProgressRepository()
+
+__all__ = ['progress_repository', 'ProgressRepository', 'reconcile_progress']
@@ -0,0 +1,67 @@
+"""Shared image ⨝ annotation join used by the listing services.
+
+Annotations are indexed by image_id once per request (hash join, O(images +
+annotations)) and label-name enrichment happens in the same pass. Rows coming
+from the aggregation listings already carry their ``annotation`` and only go
+through enrichment/shaping.
+
+Entry shape (unchanged): {image_id, filename, image_path, annotation}
+where annotation gains the compatibility fields ``label_name`` and ``label``.
+"""
+from __future__ import annotations
+from typing import Iterable, List, Dict, Any, Optional
+
+from app.services.image_store import relative_path
+
+
+def filename_from_path(path: str) -> str:
+    # 前端以 /static/img/<filename> 取图：内容寻址路径（ab/cd/<hash>.<ext>）保留分片目录
+    return relative_path(path)
+
+
+def index_annotations(annotations: Iterable[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+    """image_id -> annotation（同一图片多条时保留第一条，与旧的 next(...) 语义一致）。"""
+    index: Dict[Any, Dict[str, Any]] = {}
+    for ann in annotations:
+        index.setdefault(ann.get('image_id'), ann)
+    return index
+
+
+def enrich_annotation(ann: Optional[Dict[str, Any]], labels_dict: Dict[Any, str]) -> Optional[Dict[str, Any]]:
+    if ann and ann.get('label_id'):
+        ann['label_name'] = labels_dict.get(ann['label_id'], '')
+        # 兼容前端沿用的字段名 'label'
+        ann['label'] = ann.get('label_id')
+    return ann
+
+
+def join_images(
+    images: Iterable[Dict[str, Any]],
+    labels_dict: Dict[Any, str],
+    annotations: Optional[Iterable[Dict[str, Any]]] = None,
+    include_annotated: bool = True
+) -> List[Dict[str, Any]]:
+    """Join image rows with annotations and shape listing entries in one pass.
+
+    - annotations 为 None 时使用行内已有的 ``annotation``（聚合结果）；
+    - 否则先按 image_id 建哈希索引，再逐行 O(1) 查找；
+    - include_annotated=False 时跳过已标注图片。
+    """
+    index = index_annotations(annotations) if annotations is not None else None
+    result: List[Dict[str, Any]] = []
+    for img in images:
+        image_id = img.get('image_id')
+        ann = index.get(image_id) if index is not None else img.get('annotation')
+        if ann and not include_annotated:
+            continue
+        image_path = img.get('image_path', '')
+        result.append({
+            "image_id": image_id,
+            "filename": filename_from_path(image_path),
+            "image_path": image_path,
+            "annotation": enrich_annotation(ann, labels_dict)
+        })
+    return result
+
+
+__all__ = ['filename_from_path', 'index_annotations', 'enrich_annotation', 'join_images']
@@ -5,8 +5,9 @@ Mirrors existing endpoint behaviors WITHOUT changing response shapes.
 Endpoints covered:
   - images_with_annotations -> list_images_with_annotations
   - prev_image -> prev_image
-  - next_image -> next_image (random unannotated)
+  - next_image -> next_image (stable shuffled order + persistent cursor)
   - annotate -> save_annotation (upsert)
+  - annotations/batch -> save_annotations_bulk (single bulk_write)
   - update_annotation -> update_annotation_fields
 
 Notes:
@@ -15,13 +16,20 @@ Notes:
   * Keeps in-memory fallback lists for parity, though real DB should be primary.
 """
 from __future__ import annotations
-import random
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
 from app.core.db import get_db, USE_DATABASE
 from app.services.dataset_service import dataset_service  # for stats cache invalidation
-from db_utils import get_next_annotation_id  # type: ignore
+from app.repositories import image_order_repository, image_listing_repository, annotated_bitmap_repository, progress_repository
+from app.services.annotation_join import join_images, filename_from_path
+from app.services.label_catalog import label_catalog
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from db_utils import sequence_allocator  # type: ignore
+
+# 每次新增 / 修改由服务端写入 changed_at（$currentDate），作为增量导出的变更标记
+CHANGE_MARK = {'changed_at': True}
 
 
 class AnnotationService:
@@ -42,7 +50,19 @@ class AnnotationService:
         return ds_id
 
     def _filename_from_path(self, path: str) -> str:
-        return path.split('/')[-1] if path else ''
+        return filename_from_path(path)
+
+    def _normalize_labels(self, label_id, label_ids) -> Tuple[Optional[int], List[int]]:
+        """规范化标签集合，返回 (primary_label_id, label_ids)；缺少标签时抛出 RuntimeError。"""
+        if label_ids and len(label_ids) > 0:
+            normalized_ids = [int(x) for x in label_ids if x is not None]
+            primary_label_id = normalized_ids[0] if normalized_ids else None
+        else:
+            primary_label_id = int(label_id) if label_id is not None else None
+            normalized_ids = [primary_label_id] if primary_label_id is not None else []
+        if not normalized_ids:
+            raise RuntimeError("缺少标签: 至少需要一个标签")
+        return primary_label_id, normalized_ids
 
     # ------------- Listing with annotations -------------
     def list_images_with_annotations(
@@ -67,60 +87,37 @@ class AnnotationService:
 
         说明：
         - 未标注子集会根据“(dataset_id, expert_id)”生成稳定随机顺序；
-        - 当 include_all=True 时，返回“未标注(随机) + 已标注(后)”。
+        - 当 include_all=True 时，返回“未标注(随机) + 已标注(后)”，两段均按该稳定顺序排列；
+        - join / 过滤 / 排序 / 分页均在 MongoDB 聚合中完成，代价只与页大小相关。
         """
         self.ensure_db()
         ds_id = self._normalize_dataset_id(dataset_id)
-        links = list(self.db.image_datasets.find({"dataset_id": ds_id}, {"_id": 0, "image_id": 1}))
-        if not links:
-            return []
-        image_ids = [l['image_id'] for l in links]
-        imgs = list(self.db.images.find({"image_id": {"$in": image_ids}}, {"_id": 0}))
-        annotations = list(self.db.annotations.find({'dataset_id': ds_id, 'expert_id': expert_id}, {'_id': 0}))
-        # 标签按数据集过滤，若该数据集没有专属标签，则回退到全局标签（dataset_id 缺失或为 None）
-        labels = list(self.db.labels.find({"dataset_id": ds_id}, {"_id": 0, "label_id": 1, "label_name": 1}))
-        if not labels:
-            labels = list(self.db.labels.find({"dataset_id": {"$exists": False}}, {"_id": 0, "label_id": 1, "label_name": 1})) or \
-                     list(self.db.labels.find({"dataset_id": None}, {"_id": 0, "label_id": 1, "label_name": 1}))
-        labels_dict = {l['label_id']: l.get('label_name', '') for l in labels}
-        result: List[Dict[str, Any]] = []
-        for img in imgs:
-            ann = next((a for a in annotations if a.get('image_id') == img.get('image_id')), None)
-            if ann and ann.get('label_id'):
-                ann['label_name'] = labels_dict.get(ann['label_id'], '')
-                # 兼容前端沿用的字段名 'label'
-                ann['label'] = ann.get('label_id')
-            entry = {
-                "image_id": img.get('image_id'),
-                "filename": self._filename_from_path(img.get('image_path', '')),
-                "image_path": img.get('image_path', ''),
-                "annotation": ann
-            }
-            if include_all or not ann:
-                result.append(entry)
-        # 使用“用户+数据集”的稳定随机顺序重排未标注项
+        start = max(int(page) - 1, 0) * int(page_size)
+        limit = int(page_size)
         if expert_id:
-            try:
-                import hashlib
-                seed_src = f"{ds_id}:{expert_id}"
-                seed_int = int(hashlib.md5(seed_src.encode('utf-8')).hexdigest(), 16) % (2**31)
-                rng = random.Random(seed_int)
-                untagged = [r for r in result if not r.get('annotation')]
-                tagged = [r for r in result if r.get('annotation')]
-                if untagged:
-                    # 关键修正：先对“全部图片ID”进行一次稳定随机，再按该全局顺序对子集排序
-                    all_ids = [img.get('image_id') for img in imgs]
-                    rng.shuffle(all_ids)
-                    order_index = {img_id: i for i, img_id in enumerate(all_ids)}
-                    untagged.sort(key=lambda r: order_index.get(r['image_id'], 0))
-                    # include_all=False 时只返回未标注；True 时先未标注后已标注
-                    result = untagged if not include_all else (untagged + tagged)
-            except Exception:
-                # 失败则保持原顺序
-                pass
-        start = (page - 1) * page_size
-        end = start + page_size
-        return result[start:end]
+            # 稳定随机顺序来自 image_orders（与 next_image 共用，缺失时惰性构建）
+            state = self.db.image_orders.find_one({'dataset_id': ds_id, 'expert_id': expert_id}, {'_id': 0, 'size': 1}) \
+                or image_order_repository.build(ds_id, expert_id)
+            if not state:
+                return []
+            if not include_all:
+                rows = image_listing_repository.page_by_order(ds_id, expert_id, False, start, limit)
+            else:
+                untagged_total = max(state.get('size', 0) - image_listing_repository.annotated_count(ds_id, expert_id), 0)
+                if start < untagged_total:
+                    rows = image_listing_repository.page_by_order(ds_id, expert_id, False, start, limit)
+                    if len(rows) < limit:
+                        rows += image_listing_repository.page_by_order(ds_id, expert_id, True, 0, limit - len(rows))
+                else:
+                    rows = image_listing_repository.page_by_order(ds_id, expert_id, True, start - untagged_total, limit)
+        else:
+            rows = image_listing_repository.page_by_dataset(
+                ds_id, expert_id, start, limit, annotated=None if include_all else False
+            )
+        if not rows:
+            return []
+        # 标签按数据集过滤，若该数据集没有专属标签，则回退到全局标签（版本化目录缓存）
+        return join_images(rows, label_catalog.label_map(ds_id))
 
     # ------------- Previous image -------------
     def prev_image(
@@ -143,14 +140,15 @@ class AnnotationService:
         ds_id = self._normalize_dataset_id(dataset_id)
 
         if by == 'last_annotated' and expert_id:
-            # 从 annotations 中按 record_id(desc)/datetime(desc) 找最近一次
+            # 从 annotations 中按 datetime(desc)/record_id(desc) 找最近一次
+            # （record_id 由分段分配器发放，跨 worker 不保证按时间单调，故以 datetime 为主序）
             try:
                 cursor = self.db.annotations.find(
                     {'dataset_id': ds_id, 'expert_id': expert_id},
                     {'_id': 0, 'image_id': 1, 'record_id': 1, 'datetime': 1}
                 ).sort([
-                    ('record_id', -1),
-                    ('datetime', -1)
+                    ('datetime', -1),
+                    ('record_id', -1)
                 ])
                 anns = list(cursor)
             except Exception:
@@ -159,7 +157,7 @@ class AnnotationService:
                     {'_id': 0, 'image_id': 1, 'record_id': 1, 'datetime': 1}
                 ))
                 # fallback python 排序
-                anns.sort(key=lambda a: (a.get('record_id') or 0, a.get('datetime') or ''), reverse=True)
+                anns.sort(key=lambda a: (a.get('datetime') or '', a.get('record_id') or 0), reverse=True)
 
             if not anns:
                 return {"msg": "no previous image"}
@@ -209,50 +207,33 @@ class AnnotationService:
     def next_image(self, dataset_id: int, expert_id: str) -> Dict[str, Any]:
         """获取下一张未标注图片（稳定随机顺序）。
 
-        策略：以 (dataset_id, expert_id) 作为种子，对数据集图片 ID 进行伪随机打乱，
-        返回顺序中第一个尚未被该用户标注的图片；若全部标注完成返回 {msg: 'done'}。
+        策略：以 (dataset_id, expert_id) 作为种子的打乱顺序预先存入 image_orders，
+        并维护持久化 cursor（保存标注时前移）；此处仅需一次索引查找取 order[cursor]。
+        顺序文档不存在时（首次访问 / 上传后失效）惰性重建；若全部标注完成返回 {msg: 'done'}。
         """
         self.ensure_db()
         ds_id = self._normalize_dataset_id(dataset_id)
-        links = list(self.db.image_datasets.find({"dataset_id": ds_id}, {"_id": 0, "image_id": 1}))
-        if not links:
-            imgs = [img for img in self.IMAGES if img.get('dataset_id') == ds_id]
-        else:
-            image_ids = [l['image_id'] for l in links]
-            imgs = list(self.db.images.find({"image_id": {"$in": image_ids}}, {"_id": 0}))
-        for img in imgs:
-            if 'image_id' not in img:
-                # legacy normalization (should already exist)
-                img['image_id'] = img.get('image_id')
-        annotated_imgs = list(self.db.annotations.find({'dataset_id': ds_id, 'expert_id': expert_id}, {'_id': 0, 'image_id': 1}))
-        if not annotated_imgs:
-            annotated_imgs = [
-                {'image_id': a.get('image_id')}
-                for a in self.ANNOTATIONS
-                if a.get('dataset_id') == ds_id and a.get('expert_id') == expert_id
-            ]
-        done_ids = {a.get('image_id') for a in annotated_imgs}
+        current = image_order_repository.current(ds_id, expert_id)
+        if current is None and image_order_repository.build(ds_id, expert_id):
+            current = image_order_repository.current(ds_id, expert_id)
+        if current is not None:
+            if current.get('image_id') is None:
+                return {"msg": "done"}
+            return {
+                "image_id": current.get('image_id'),
+                "filename": self._filename_from_path(current.get('image_path', ''))
+            }
+        # 数据集无关联图片：回退内存数据（legacy compatibility）
+        imgs = [img for img in self.IMAGES if img.get('dataset_id') == ds_id]
+        done_ids = {
+            a.get('image_id') for a in self.ANNOTATIONS
+            if a.get('dataset_id') == ds_id and a.get('expert_id') == expert_id
+        }
         untagged = [img for img in imgs if img.get('image_id') not in done_ids]
         if untagged:
-            # 使用“用户+数据集”的稳定随机顺序，返回第一个未标注项
-            try:
-                import hashlib
-                seed_src = f"{ds_id}:{expert_id}"
-                seed_int = int(hashlib.md5(seed_src.encode('utf-8')).hexdigest(), 16) % (2**31)
-                rng = random.Random(seed_int)
-                id_list = [img.get('image_id') for img in imgs]
-                rng.shuffle(id_list)
-                # 找到顺序中第一个尚未标注的 image_id
-                pick_id = next((iid for iid in id_list if iid not in done_ids), None)
-                if pick_id is not None:
-                    selected = next((img for img in imgs if img.get('image_id') == pick_id), untagged[0])
-                else:
-                    selected = untagged[0]
-            except Exception:
-                selected = random.choice(untagged)
             return {
-                "image_id": selected.get('image_id'),
-                "filename": selected.get('filename') or self._filename_from_path(selected.get('image_path', ''))
+                "image_id": untagged[0].get('image_id'),
+                "filename": untagged[0].get('filename') or self._filename_from_path(untagged[0].get('image_path', ''))
             }
         return {"msg": "done"}
 
@@ -271,22 +252,13 @@ class AnnotationService:
         兼容策略：
         - 若提供 label_ids(list) 且非空 -> 视为多标签；首个元素作为 label_id 兼容旧字段。
         - 若仅提供 label_id -> 视为单标签，同时写入 label_ids=[label_id] 方便统一处理。
-        - Upsert 行为保持不变。
+        - Upsert 行为保持不变（单次 update_one(upsert=True)）。
         """
         self.ensure_db()
         ds_id = self._normalize_dataset_id(dataset_id)
-        # 规范化标签集合
-        if label_ids and len(label_ids) > 0:
-            normalized_ids = [int(x) for x in label_ids if x is not None]
-            primary_label_id = normalized_ids[0] if normalized_ids else None
-        else:
-            primary_label_id = int(label_id) if label_id is not None else None
-            normalized_ids = [primary_label_id] if primary_label_id is not None else []
-
-        if not normalized_ids:
-            raise RuntimeError("缺少标签: 至少需要一个标签")
+        primary_label_id, normalized_ids = self._normalize_labels(label_id, label_ids)
 
-        existing = self.db.annotations.find_one({'dataset_id': ds_id, 'image_id': image_id, 'expert_id': expert_id})
+        key = {'dataset_id': ds_id, 'image_id': image_id, 'expert_id': expert_id}
         annotation_data = {
             'dataset_id': ds_id,
             'image_id': image_id,
@@ -296,16 +268,27 @@ class AnnotationService:
             'datetime': datetime.now().isoformat(),
             'tip': tip
         }
-        if existing:
-            annotation_data['record_id'] = existing.get('record_id')
-            self.db.annotations.update_one({'dataset_id': ds_id, 'image_id': image_id, 'expert_id': expert_id}, {'$set': annotation_data})
-        else:
-            next_record_id = get_next_annotation_id(self.db)
-            annotation_data['record_id'] = next_record_id
-            self.db.annotations.insert_one(annotation_data)
+        # 单次往返原子 upsert：record_id 仅在插入时写入（更新时预分配的 ID 作废，序列允许空洞）
+        # 唯一索引 ann_ds_expert_img_unique 保证并发保存不会产生重复记录
+        new_record_id = sequence_allocator.next_value(self.db, "annotations_record_id")
+        update = {'$set': annotation_data, '$setOnInsert': {'record_id': new_record_id}, '$currentDate': CHANGE_MARK}
+        try:
+            result = self.db.annotations.update_one(key, update, upsert=True)
+        except DuplicateKeyError:
+            # 并发插入竞争失败：对方已插入，改为普通更新
+            result = self.db.annotations.update_one(key, {'$set': annotation_data, '$currentDate': CHANGE_MARK})
+        if result.upserted_id is not None:
+            annotation_data['record_id'] = new_record_id
+            progress_repository.inc_annotated(ds_id, expert_id, 1)
         # memory sync（保留旧结构兼容）
         self.ANNOTATIONS[:] = [a for a in self.ANNOTATIONS if not (a.get('dataset_id') == ds_id and a.get('image_id') == image_id and a.get('expert_id') == expert_id)]
         memory_copy = annotation_data.copy(); memory_copy['label'] = primary_label_id; self.ANNOTATIONS.append(memory_copy)
+        # 位图置位并推进该专家的顺序 cursor（失败不影响保存，下次重建时会重新计算）
+        try:
+            annotated_bitmap_repository.mark(ds_id, expert_id, [image_id])
+            image_order_repository.advance(ds_id, expert_id, image_id)
+        except Exception:  # pragma: no cover - best effort
+            pass
         # invalidate statistics cache for this (dataset, expert)
         try:
             dataset_service.invalidate_stats(ds_id, expert_id)
@@ -313,6 +296,119 @@ class AnnotationService:
             pass
         return {"msg": "saved", "expert_id": expert_id, "label_ids": normalized_ids}
 
+    # ------------- Bulk annotate -------------
+    MAX_BULK_ITEMS = 1000
+
+    def save_annotations_bulk(
+        self,
+        dataset_id: int,
+        expert_id: str,
+        items: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """批量保存/更新标注（键盘连续标注场景）。
+
+        每项：{image_id, label?, label_id?, label_ids?, tip?}，标签规则同 save_annotation；
+        同一批次内重复的 image_id 以最后一项为准。
+
+        往返次数与批量大小无关：
+        1) 每项预领一个 record_id（进程内分段分配器，至多一次 sequences 更新；更新项用不到的值成为空洞）；
+        2) 一次 unordered bulk_write，每项都是带 $setOnInsert record_id 的 upsert；
+        3) created / record_id 以写入结果为准：upserted_ids 中的项为新增，其余命中的项再一次 $in 读回 record_id。
+        不预先查询是否存在，避免读写之间的并发插入 / 清除导致结果与实际写入不符。
+
+        返回：{msg, saved, failed, results: [{image_id, msg, record_id?, created?, error?}]}
+        """
+        self.ensure_db()
+        if not items:
+            raise ValueError("标注列表不能为空")
+        if len(items) > self.MAX_BULK_ITEMS:
+            raise ValueError(f"单次最多提交 {self.MAX_BULK_ITEMS} 条标注")
+        ds_id = self._normalize_dataset_id(dataset_id)
+        now = datetime.now().isoformat()
+
+        results: List[Dict[str, Any]] = []
+        pending: Dict[Any, Dict[str, Any]] = {}  # image_id -> annotation_data（后者覆盖前者）
+        for item in items:
+            image_id = (item or {}).get('image_id')
+            try:
+                if image_id is None:
+                    raise RuntimeError("缺少 image_id")
+                primary, normalized = self._normalize_labels(
+                    item.get('label_id', item.get('label')), item.get('label_ids')
+                )
+            except (RuntimeError, TypeError, ValueError) as e:
+                results.append({"image_id": image_id, "msg": "error", "error": str(e)})
+                continue
+            pending[image_id] = {
+                'dataset_id': ds_id,
+                'image_id': image_id,
+                'expert_id': expert_id,
+                'label_id': primary,
+                'label_ids': normalized,
+                'datetime': now,
+                'tip': item.get('tip', '')
+            }
+
+        if pending:
+            record_ids = sequence_allocator.take(self.db, "annotations_record_id", len(pending))
+            ops = [
+                UpdateOne({'dataset_id': ds_id, 'image_id': image_id, 'expert_id': expert_id},
+                          {'$set': data, '$setOnInsert': {'record_id': record_id}, '$currentDate': CHANGE_MARK},
+                          upsert=True)
+                for (image_id, data), record_id in zip(pending.items(), record_ids)
+            ]
+            failed_index: Dict[int, str] = {}
+            try:
+                upserted = set(self.db.annotations.bulk_write(ops, ordered=False).upserted_ids)
+            except BulkWriteError as bwe:
+                failed_index = {e.get('index'): e.get('errmsg', '') for e in bwe.details.get('writeErrors', [])}
+                upserted = {u.get('index') for u in bwe.details.get('upserted', [])}
+            progress_repository.inc_annotated(ds_id, expert_id, len(upserted))
+            matched = [iid for i, iid in enumerate(pending) if i not in upserted and i not in failed_index]
+            stored = {
+                a.get('image_id'): a.get('record_id') for a in self.db.annotations.find(
+                    {'dataset_id': ds_id, 'expert_id': expert_id, 'image_id': {'$in': matched}},
+                    {'_id': 0, 'image_id': 1, 'record_id': 1}
+                )
+            } if matched else {}
+            for i, (image_id, record_id) in enumerate(zip(pending, record_ids)):
+                if i in failed_index:
+                    results.append({"image_id": image_id, "msg": "error", "error": failed_index[i]})
+                elif i in upserted:
+                    results.append({"image_id": image_id, "msg": "saved", "record_id": record_id, "created": True})
+                else:
+                    results.append({"image_id": image_id, "msg": "saved", "record_id": stored.get(image_id), "created": False})
+
+        saved_ids = {r['image_id'] for r in results if r.get('msg') == 'saved'}
+        if saved_ids:
+            # memory sync（保留旧结构兼容）
+            self.ANNOTATIONS[:] = [
+                a for a in self.ANNOTATIONS
+                if not (a.get('dataset_id') == ds_id and a.get('expert_id') == expert_id and a.get('image_id') in saved_ids)
+            ]
+            for image_id in saved_ids:
+                memory_copy = pending[image_id].copy(); memory_copy['label'] = memory_copy['label_id']; self.ANNOTATIONS.append(memory_copy)
+            # 只有 cursor 指向的图片在本批次中时才需要推进（advance 会顺带跳过本批次其余已标注图片）
+            try:
+                annotated_bitmap_repository.mark(ds_id, expert_id, list(saved_ids))
+                current = image_order_repository.current(ds_id, expert_id)
+                if current and current.get('image_id') in saved_ids:
+                    image_order_repository.advance(ds_id, expert_id, current['image_id'])
+            except Exception:  # pragma: no cover - best effort
+                pass
+            try:
+                dataset_service.invalidate_stats(ds_id, expert_id)
+            except Exception:  # pragma: no cover - best effort
+                pass
+        failed = sum(1 for r in results if r.get('msg') == 'error')
+        return {
+            "msg": "saved",
+            "expert_id": expert_id,
+            "saved": len(results) - failed,
+            "failed": failed,
+            "results": results
+        }
+
     # ------------- Update annotation fields -------------
     def update_annotation_fields(
         self,
@@ -345,7 +441,8 @@ class AnnotationService:
                 'tip': tip,
                 'datetime': datetime.now().isoformat()
             }
-        result = self.db.annotations.update_one({'dataset_id': ds_id, 'image_id': image_id, 'expert_id': expert_id}, {'$set': update_fields})
+        result = self.db.annotations.update_one({'dataset_id': ds_id, 'image_id': image_id, 'expert_id': expert_id},
+                                                {'$set': update_fields, '$currentDate': CHANGE_MARK})
         for ann in self.ANNOTATIONS:
             if ann.get('dataset_id') == ds_id and ann.get('image_id') == image_id and ann.get('expert_id') == expert_id:
                 ann.update(update_fields)
@@ -0,0 +1,138 @@
+"""Typed columnar (Parquet / Arrow IPC) writers for the export service.
+
+Each export table has a fixed Arrow schema, so ids stay int64, ``label_ids``
+stays list<int64> and ``datetime`` / ``created_at`` are real timestamps
+instead of whatever pandas infers from mixed documents. Rows arrive from a Mongo
+cursor and are written in record batches of ``batch_rows``, compressed with
+zstd, so memory is bounded by the batch size rather than the table size.
+
+pyarrow is imported lazily: the rest of the app (and the xlsx / csv exports)
+work without it installed.
+"""
+from __future__ import annotations
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+COLUMNAR_FORMATS = {
+    'parquet': 'parquet',
+    'arrow': 'arrow',
+}
+DEFAULT_BATCH_ROWS = 65536
+
+
+def _pa():
+    try:
+        import pyarrow  # type: ignore
+        import pyarrow.parquet  # noqa: F401  # type: ignore
+        import pyarrow.ipc  # noqa: F401  # type: ignore
+    except ImportError as e:  # pragma: no cover - depends on deployment
+        raise RuntimeError("Parquet/Arrow 导出需要安装 pyarrow") from e
+    return pyarrow
+
+
+def table_schemas() -> Dict[str, Any]:
+    pa = _pa()
+    ts = pa.timestamp('us')
+    return {
+        'annotations': pa.schema([
+            ('dataset_id', pa.int64()), ('record_id', pa.int64()), ('image_id', pa.int64()),
+            ('expert_id', pa.string()), ('label_id', pa.int64()), ('label_ids', pa.list_(pa.int64())),
+            ('label_name', pa.string()), ('tip', pa.string()), ('datetime', ts),
+        ]),
+        'images': pa.schema([('image_id', pa.int64()), ('image_path', pa.string())]),
+        'labels': pa.schema([
+            ('label_id', pa.int64()), ('label_name', pa.string()), ('category', pa.string()), ('dataset_id', pa.int64()),
+        ]),
+        'datasets': pa.schema([
+            ('id', pa.int64()), ('name', pa.string()), ('description', pa.string()), ('created_at', ts),
+            ('image_count', pa.int64()), ('status', pa.string()), ('multi_select', pa.bool_()),
+        ]),
+    }
+
+
+def _to_int(v: Any) -> Optional[int]:
+    if v is None or isinstance(v, bool):
+        return None
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_datetime(v: Any) -> Optional[datetime]:
+    if isinstance(v, datetime):
+        return v
+    if isinstance(v, str) and v:
+        try:
+            return datetime.fromisoformat(v)
+        except ValueError:
+            return None
+    return None
+
+
+def _to_str(v: Any) -> Optional[str]:
+    return None if v is None else str(v)
+
+
+def _coercer(field_type) -> Any:
+    pa = _pa()
+    if pa.types.is_int64(field_type):
+        return _to_int
+    if pa.types.is_timestamp(field_type):
+        return _to_datetime
+    if pa.types.is_boolean(field_type):
+        return lambda v: None if v is None else bool(v)
+    if pa.types.is_list(field_type):
+        return lambda v: [i for i in (_to_int(x) for x in v) if i is not None] if isinstance(v, list) else None
+    return _to_str
+
+
+def _column(values: List[Any], field_type, coerce) -> Any:
+    """整列转换：先走 Arrow 原生转换（ISO 字符串时间戳经 cast），类型不一致时再逐值规整。"""
+    pa = _pa()
+    try:
+        if pa.types.is_timestamp(field_type) and any(isinstance(v, str) for v in values):
+            return pa.array(values, type=pa.string()).cast(field_type)
+        return pa.array(values, type=field_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+        return pa.array([coerce(v) for v in values], type=field_type)
+
+
+def write_table(path: str, schema, rows: Iterable[Dict[str, Any]], fmt: str,
+                batch_rows: int = DEFAULT_BATCH_ROWS) -> int:
+    """按 schema 把行写成 Parquet / Arrow IPC 文件（逐批 RecordBatch，zstd 压缩），返回行数。"""
+    pa = _pa()
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"不支持的列式格式: {fmt}")
+    names = schema.names
+    types = [schema.field(n).type for n in names]
+    coercers = [_coercer(t) for t in types]
+    if fmt == 'parquet':
+        writer = pa.parquet.ParquetWriter(path, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    total = 0
+    columns: List[List[Any]] = [[] for _ in names]
+
+    def flush():
+        if columns[0]:
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [_column(col, types[i], coercers[i]) for i, col in enumerate(columns)], schema=schema
+            ))
+            for col in columns:
+                col.clear()
+
+    try:
+        for row in rows:
+            for i, name in enumerate(names):
+                columns[i].append(row.get(name))
+            total += 1
+            if len(columns[0]) >= batch_rows:
+                flush()
+        flush()
+    finally:
+        writer.close()
+    return total
+
+
+__all__ = ['COLUMNAR_FORMATS', 'DEFAULT_BATCH_ROWS', 'table_schemas', 'write_table']
@@ -1,12 +1,14 @@
 """Dataset service layer (Phase 2 -> Phase 3) consolidating dataset-related operations.
 
-Now delegates raw persistence to repository & adds lightweight in-memory cache for statistics.
+Now delegates raw persistence to repository & caches statistics in the cross-worker
+shared cache (app.core.shared_cache) so invalidation is visible to every worker.
 """
 from __future__ import annotations
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional
 from app.core.db import get_db, USE_DATABASE
-from app.repositories import dataset_repository
+from app.core.cache import LRUCache, SingleFlight
+from app.core.shared_cache import shared_cache
+from app.repositories import dataset_repository, image_order_repository, annotated_bitmap_repository, progress_repository
 from db_utils import get_next_sequence_value  # type: ignore  # retained for backward compat (create may still use if repo evolves)
 
 class DatasetService:
@@ -21,73 +23,98 @@ class DatasetService:
             raise RuntimeError("数据库连接不可用")
 
     # --- Caches ---
-    _stats_cache: Dict[Tuple[int, Optional[str]], Dict[str, Any]] = {}
-    _stats_cache_expiry: Dict[Tuple[int, Optional[str]], datetime] = {}
-    _STATS_TTL = timedelta(seconds=15)
+    # 键: "<dataset_id>:<expert_id>"，所有 worker 共享同一份缓存与失效
+    _stats_cache = shared_cache('dataset_stats', ttl=15)
+    # 同一 worker 内统计未命中的并发请求只读一次库
+    _stats_flight = SingleFlight()
+    # 数据集文档 / 列表的进程内缓存；其它 worker 的写入最多滞后 ttl 秒
+    _dataset_cache = LRUCache('datasets', max_entries=256, max_bytes=2 * 1024 * 1024, ttl=10)
+
+    @staticmethod
+    def _stats_key(dataset_id: int, expert_id: Optional[str]) -> str:
+        return f"{dataset_id}:{expert_id or ''}"
 
     def _cache_get_stats(self, dataset_id: int, expert_id: Optional[str]):
-        key = (dataset_id, expert_id)
-        exp = self._stats_cache_expiry.get(key)
-        if exp and exp > datetime.now():
-            return self._stats_cache.get(key)
-        self._stats_cache.pop(key, None)
-        self._stats_cache_expiry.pop(key, None)
-        return None
+        return self._stats_cache.get(self._stats_key(dataset_id, expert_id))
 
     def _cache_set_stats(self, dataset_id: int, expert_id: Optional[str], value: Dict[str, Any]):
-        key = (dataset_id, expert_id)
-        self._stats_cache[key] = value
-        self._stats_cache_expiry[key] = datetime.now() + self._STATS_TTL
+        self._stats_cache.set(self._stats_key(dataset_id, expert_id), value)
 
     def invalidate_stats(self, dataset_id: int, expert_id: Optional[str] = None):
-        keys = [k for k in list(self._stats_cache.keys()) if k[0] == dataset_id and (expert_id is None or k[1] == expert_id)]
-        for k in keys:
-            self._stats_cache.pop(k, None)
-            self._stats_cache_expiry.pop(k, None)
+        if expert_id is None:
+            self._stats_cache.delete_prefix(f"{dataset_id}:")
+        else:
+            self._stats_cache.delete(self._stats_key(dataset_id, expert_id))
+
+    def invalidate_dataset(self, dataset_id: Optional[int] = None):
+        """数据集文档变化（创建 / 删除 / image_count / multi_select）后丢弃缓存。"""
+        self._dataset_cache.invalidate('__all__')
+        if dataset_id is not None:
+            self._dataset_cache.invalidate(('dataset', dataset_id))
 
     def list(self) -> List[Dict[str, Any]]:
         self.ensure_db()
-        data = dataset_repository.list()
-        for ds in data:
-            ds.setdefault('multi_select', False)
-        return data
+
+        def load():
+            data = dataset_repository.list()
+            for ds in data:
+                ds.setdefault('multi_select', False)
+            return data
+
+        return [dict(ds) for ds in self._dataset_cache.get_or_load('__all__', load)]
+
+    def get(self, dataset_id: int) -> Optional[Dict[str, Any]]:
+        self.ensure_db()
+        doc = self._dataset_cache.get_or_load(('dataset', dataset_id), lambda: dataset_repository.find_one(dataset_id))
+        if doc is None:
+            # 不缓存“不存在”，新建后立即可见
+            self._dataset_cache.invalidate(('dataset', dataset_id))
+            return None
+        return dict(doc)
 
     def statistics(self, dataset_id: int, expert_id: Optional[str]) -> Dict[str, int]:
         self.ensure_db()
         cached = self._cache_get_stats(dataset_id, expert_id)
         if cached:
             return cached  # type: ignore
-        # repository direct statistics until migrated fully
-        total_count = self.db.image_datasets.count_documents({"dataset_id": dataset_id})
-        annotated_count = self.db.annotations.count_documents({
-            "dataset_id": dataset_id,
-            "expert_id": expert_id
-        }) if expert_id else 0
-        result = {"total_count": total_count, "annotated_count": annotated_count}
-        self._cache_set_stats(dataset_id, expert_id, result)
-        return result
+
+        def load():
+            # 物化计数：一次索引读取 dataset_progress（写路径以 $inc 增量维护）
+            result = progress_repository.get(dataset_id, expert_id)
+            self._cache_set_stats(dataset_id, expert_id, result)
+            return result
+
+        return self._stats_flight.do(self._stats_key(dataset_id, expert_id), load)
 
     def create(self, name: str, description: str = '', multi_select: bool = False) -> int:
         self.ensure_db()
         dataset_id = dataset_repository.create(name, description, multi_select)
         self.invalidate_stats(dataset_id)
+        self.invalidate_dataset(dataset_id)
         return dataset_id
 
     def update_multi_select(self, dataset_id: int, value: bool) -> bool:
         self.ensure_db()
         ok = dataset_repository.update_multi_select(dataset_id, value)
+        self.invalidate_dataset(dataset_id)
         return ok
 
     def delete(self, dataset_id: int) -> int:
         self.ensure_db()
         count = dataset_repository.delete(dataset_id)
+        image_order_repository.invalidate(dataset_id)
+        annotated_bitmap_repository.clear(dataset_id)
+        progress_repository.drop(dataset_id)
         self.invalidate_stats(dataset_id)
+        self.invalidate_dataset(dataset_id)
         return count
 
     def recount_images(self, dataset_id: int) -> int:
         self.ensure_db()
         actual_count = dataset_repository.recount_images(dataset_id)
+        progress_repository.set_total(dataset_id, actual_count)
         self.invalidate_stats(dataset_id)
+        self.invalidate_dataset(dataset_id)
         return actual_count
 
     def clear_annotations(self, dataset_id: int) -> int:
@@ -95,10 +122,24 @@ class DatasetService:
         self.ensure_db()
         ds_id = int(dataset_id)
         result = self.db.annotations.delete_many({'dataset_id': ds_id})
+        # 所有专家的顺序 cursor 归零（顺序本身保持不变）
+        image_order_repository.reset_cursors(ds_id)
+        annotated_bitmap_repository.clear(ds_id)
+        progress_repository.clear_annotated(ds_id)
         # 使统计缓存失效（所有专家）
         self.invalidate_stats(ds_id, None)
         return result.deleted_count
 
+    def reconcile_progress(self, dataset_id: Optional[int] = None) -> int:
+        """由 image_datasets / annotations 重算物化进度计数；dataset_id 为空时处理全部数据集。"""
+        self.ensure_db()
+        written = progress_repository.reconcile(dataset_id)
+        if dataset_id is None:
+            self._stats_cache.clear()
+        else:
+            self.invalidate_stats(dataset_id)
+        return written
+
 dataset_service = DatasetService()
 
 __all__ = ["dataset_service", "DatasetService"]
@@ -0,0 +1,224 @@
+"""Asynchronous export jobs with an on-disk artifact cache.
+
+Large exports no longer run inside the request: ``POST /api/export/jobs``
+records a job and hands it to a small background pool, clients poll the job
+and download the finished file. Jobs live in Mongo so any worker can answer
+the poll:
+
+    export_jobs: { _id: <job_id>, cache_key, dataset_id, expert_id, format,
+                   status: queued|running|done|failed, error, size, created_at,
+                   started_at, finished_at, active_key? }
+
+Artifacts are cached on disk under ``EXPORT_CACHE_DIR`` keyed by
+(dataset_id, expert_id, format, data_version), where the data version is the
+export service's fingerprint of the underlying data. A request whose key is
+already on disk finishes immediately; a request whose key is being built joins
+the running job. Queued and running jobs carry ``active_key = cache_key`` under
+a sparse unique index, so concurrent submits across workers claim the build
+atomically: the loser of the insert gets the winner's job. Files are written to
+a temp name and ``os.replace``d into place, so readers never see partial
+artifacts. The cache is swept by age
+(``EXPORT_CACHE_TTL``) and total size (``EXPORT_CACHE_MAX_BYTES``).
+
+    EXPORT_CACHE_DIR        artifact directory (default <tmp>/medc_export_cache)
+    EXPORT_JOB_WORKERS      background export threads per process (default 2)
+    EXPORT_CACHE_TTL        artifact lifetime in seconds (default 86400)
+    EXPORT_CACHE_MAX_BYTES  artifact budget in bytes (default 5 GiB)
+    EXPORT_JOB_TIMEOUT      running job considered dead after N seconds (default 3600)
+"""
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.core.db import get_db, USE_DATABASE
+from app.services.export_service import export_service, EXPORT_FORMATS
+
+CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'medc_export_cache')
+JOB_WORKERS = max(1, int(os.environ.get('EXPORT_JOB_WORKERS', '2')))
+CACHE_TTL = int(os.environ.get('EXPORT_CACHE_TTL', str(24 * 3600)))
+CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', str(5 * 1024 ** 3)))
+JOB_TIMEOUT = int(os.environ.get('EXPORT_JOB_TIMEOUT', '3600'))
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class ExportJobService:
+    def __init__(self, cache_dir: str = CACHE_DIR, workers: int = JOB_WORKERS):
+        self.db = get_db()
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        if self.db is None or not USE_DATABASE:
+            self.db = get_db()
+        if not USE_DATABASE or self.db is None:
+            raise RuntimeError("数据库连接不可用")
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # 惰性创建：fork 出的 worker 各自持有线程池
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export-job')
+            return self._pool
+
+    # --- Cache ---
+    @staticmethod
+    def cache_key(dataset_id: Optional[int], expert_id: Optional[str], fmt: str, data_version: str) -> str:
+        raw = f"{dataset_id}|{expert_id or ''}|{fmt}|{data_version}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def artifact_path(self, cache_key: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, f"{cache_key}.{EXPORT_FORMATS[fmt][0]}")
+
+    def sweep(self) -> int:
+        """删除过期产物，并按最久未访问淘汰到体积预算以内；返回删除文件数。"""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            st = entry.stat()
+            files.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path))
+        removed = 0
+        total = sum(f[1] for f in files)
+        for used, size, path in sorted(files):
+            if now - used <= CACHE_TTL and total <= CACHE_MAX_BYTES:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+                total -= size
+            except OSError:
+                pass
+        return removed
+
+    # --- Jobs ---
+    def submit(self, dataset_id: Optional[int], expert_id: Optional[str], fmt: str) -> Dict[str, Any]:
+        """创建（或复用）导出任务，返回任务文档。"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        self._ensure()
+        expert = export_service._resolve_expert(expert_id)
+        key = self.cache_key(dataset_id, expert, fmt, export_service.data_version(dataset_id, expert))
+        now = datetime.utcnow()
+
+        path = self.artifact_path(key, fmt)
+        if os.path.exists(path):
+            os.utime(path)
+            job = self._new_job(key, dataset_id, expert_id, fmt, now)
+            job.update({'status': 'done', 'cached': True, 'size': os.path.getsize(path), 'finished_at': now})
+            self.db.export_jobs.insert_one(job)
+            return job
+
+        job = self._new_job(key, dataset_id, expert_id, fmt, now)
+        job['active_key'] = key
+        claimed = self._claim(job)
+        if claimed is job:
+            self._executor().submit(self._run, job['_id'])
+        return claimed
+
+    def _claim(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """以 active_key 唯一索引原子占位；同键已有进行中的任务时返回该任务（超时的先判失败再重试）。"""
+        while True:
+            active = self.db.export_jobs.find_one({'active_key': job['active_key']})
+            if active is not None:
+                if active['created_at'] > job['created_at'] - timedelta(seconds=JOB_TIMEOUT):
+                    return active
+                self._expire(active['_id'])
+                continue
+            try:
+                self.db.export_jobs.insert_one(job)
+                return job
+            except DuplicateKeyError:
+                continue  # 并发提交抢先占位，重读其任务
+
+    def _expire(self, job_id: str) -> None:
+        self.db.export_jobs.update_one(
+            {'_id': job_id, 'status': {'$in': list(ACTIVE_STATUSES)}},
+            {'$set': {'status': 'failed', 'error': '导出任务超时'}, '$unset': {'active_key': ''}}
+        )
+
+    @staticmethod
+    def _new_job(key, dataset_id, expert_id, fmt, now) -> Dict[str, Any]:
+        return {
+            '_id': uuid.uuid4().hex, 'cache_key': key, 'dataset_id': dataset_id, 'expert_id': expert_id,
+            'format': fmt, 'status': 'queued', 'cached': False, 'error': None, 'size': None,
+            'created_at': now, 'started_at': None, 'finished_at': None,
+        }
+
+    def _run(self, job_id: str) -> None:
+        job = self.db.export_jobs.find_one_and_update(
+            {'_id': job_id, 'status': 'queued'},
+            {'$set': {'status': 'running', 'started_at': datetime.utcnow()}}
+        )
+        if not job:
+            return
+        fmt = job['format']
+        path = self.artifact_path(job['cache_key'], fmt)
+        try:
+            if not os.path.exists(path):
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(prefix='.build_', dir=self.cache_dir)
+                os.close(fd)
+                try:
+                    export_service.write_artifact(job['dataset_id'], job['expert_id'], fmt, tmp)
+                    os.replace(tmp, path)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+            update = {'status': 'done', 'size': os.path.getsize(path)}
+        except Exception as e:
+            logging.error(f"导出任务 {job_id} 失败: {e}")
+            update = {'status': 'failed', 'error': str(e)}
+        update['finished_at'] = datetime.utcnow()
+        self.db.export_jobs.update_one({'_id': job_id}, {'$set': update, '$unset': {'active_key': ''}})
+        try:
+            self.sweep()
+        except OSError as e:  # pragma: no cover
+            logging.warning(f"导出缓存清理失败: {e}")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务；运行超时的任务（worker 已退出）报告为失败。"""
+        self._ensure()
+        job = self.db.export_jobs.find_one({'_id': job_id})
+        if job and job['status'] in ACTIVE_STATUSES and \
+                job['created_at'] < datetime.utcnow() - timedelta(seconds=JOB_TIMEOUT):
+            job['status'], job['error'] = 'failed', '导出任务超时'
+            self._expire(job_id)
+        return job
+
+    def artifact(self, job: Dict[str, Any]) -> Optional[str]:
+        """已完成任务的产物路径；被清理后返回 None。"""
+        path = self.artifact_path(job['cache_key'], job['format'])
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    @staticmethod
+    def public(job: Dict[str, Any]) -> Dict[str, Any]:
+        out = {k: job.get(k) for k in ('dataset_id', 'expert_id', 'format', 'status', 'cached', 'error', 'size')}
+        out['job_id'] = job['_id']
+        for k in ('created_at', 'started_at', 'finished_at'):
+            out[k] = job[k].isoformat() if isinstance(job.get(k), datetime) else job.get(k)
+        return out
+
+
+export_job_service = ExportJobService()
+
+__all__ = ['export_job_service', 'ExportJobService']
@@ -1,14 +1,104 @@
-"""Export service layer: builds Excel workbook in-memory (Phase 2)."""
+"""Export service layer: writes the Excel workbook with openpyxl write-only mode
+to a temp file, streams CSV / NDJSON annotation exports and writes typed
+Parquet / Arrow IPC tables (see columnar_export). All paths read batched cursors,
+so memory does not grow with dataset size."""
 from __future__ import annotations
-from datetime import datetime
-from io import BytesIO
-from typing import Optional
-import pandas as pd
+import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, StringIO
+from typing import Optional, Dict, Any, Iterator, List
+
+from pymongo import ReturnDocument
 
 from app.core.db import get_db, USE_DATABASE
+from app.services.label_catalog import label_catalog
+from app.services.columnar_export import COLUMNAR_FORMATS, table_schemas, write_table
+from app.services.manifest_export import (
+    MANIFEST_COLUMNS, assign_folds, resolve_image_path, resolve_mask_path, stratum_label
+)
+
+
+ANNOTATION_COLUMNS = ['dataset_id', 'record_id', 'image_id', 'expert_id', 'label_id', 'label_ids', 'label_name', 'tip', 'datetime']
+IMAGE_COLUMNS = ['image_id', 'image_path']
+LABEL_COLUMNS = ['label_id', 'label_name', 'category']
+DATASET_COLUMNS = ['id', 'name', 'description', 'created_at', 'image_count', 'status']
+STREAM_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# 所有导出格式：format -> (文件扩展名, mimetype)
+EXPORT_FORMATS = {
+    'xlsx': ('xlsx', XLSX_MIMETYPE),
+    'csv': ('csv', STREAM_FORMATS['csv']),
+    'ndjson': ('ndjson', STREAM_FORMATS['ndjson']),
+    'parquet': ('parquet.zip', 'application/zip'),
+    'arrow': ('arrow.zip', 'application/zip'),
+}
+# 增量导出的安全滞后：只导出 changed_at 早于服务端当前时间该秒数的变更，
+# 覆盖“已取得时间戳但尚未提交”的写入窗口
+DELTA_LAG_SECONDS = float(os.getenv('EXPORT_DELTA_LAG', '5'))
+
+
+def _cell(value: Any) -> Any:
+    # 列表等非标量与 pandas.to_excel 历史输出一致：写为字符串
+    if isinstance(value, (list, dict, tuple)):
+        return str(value)
+    return value
+
+
+def normalize_annotation(item: Dict[str, Any], labels_dict: Dict[Any, str]) -> Dict[str, Any]:
+    """导出行规范化：旧字段 label -> label_id；多标签生成逗号分隔的 label_name。原地修改并返回。"""
+    if 'label' in item and 'label_id' not in item:
+        item['label_id'] = item['label']
+    item.pop('label', None)
+    # 多标签支持：若存在 label_ids，生成逗号分隔的名称；否则保持单标签
+    if 'label_ids' in item and isinstance(item['label_ids'], list) and item['label_ids']:
+        names = [labels_dict.get(lid, '') for lid in item['label_ids']]
+        item['label_name'] = ','.join([n for n in names if n])
+        # 为兼容旧字段，label_id 保留首个
+        if 'label_id' not in item and item['label_ids']:
+            item['label_id'] = item['label_ids'][0]
+    else:
+        item['label_name'] = labels_dict.get(item.get('label_id'), '')
+    return item
+
+EXPORT_PARALLELISM = max(1, int(os.environ.get('EXPORT_PARALLELISM') or min(4, os.cpu_count() or 1)))
+_ZIP_CHUNK = 1024 * 1024
+
+
+class _ZipStream:
+    """不可 seek 的 zip 输出目标：ZipFile 写入的字节暂存于此，由生成器取走后发送。"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+    def __bool__(self) -> bool:
+        return bool(self._parts)
 
 
 class ExportService:
+    # 流式导出每批从游标读取 / 输出的行数
+    STREAM_BATCH = 1000
+
     def __init__(self):
         self.db = get_db()
 
@@ -16,118 +106,421 @@ class ExportService:
         if not USE_DATABASE or self.db is None:
             raise RuntimeError("数据库连接不可用")
 
-    def build_workbook(self, dataset_id: Optional[int], expert_id: Optional[str]) -> BytesIO:
-        """Construct an Excel workbook identical to previous logic; returns BytesIO ready for download."""
-        self.ensure_db()
-        output = BytesIO()
-        processed_ds_id = dataset_id
-        user_identifier = expert_id if expert_id else None
+    @staticmethod
+    def _resolve_expert(expert_id: Optional[str]) -> Optional[str]:
         # 管理员导出（expert_id=admin）需要聚合所有用户
-        if user_identifier and isinstance(user_identifier, str) and user_identifier.lower() == 'admin':
-            user_identifier = None
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # annotations sheet
-            try:
-                query = {}
-                if processed_ds_id is not None:
-                    query['dataset_id'] = processed_ds_id
-                # 管理员或未传入 expert_id 时，导出该数据集的所有用户标注
-                if user_identifier is not None:
-                    query['expert_id'] = user_identifier
-                annotations_data = list(self.db.annotations.find(query, {"_id": 0}))
-                if annotations_data:
-                    for item in annotations_data:
-                        if 'label' in item and 'label_id' not in item:
-                            item['label_id'] = item['label']
-                        item.pop('label', None)
-                    # 标签按数据集过滤（无则回退全局）
-                    label_query = {"dataset_id": processed_ds_id} if processed_ds_id is not None else {}
-                    labels_list = list(self.db.labels.find(label_query, {"_id": 0}))
-                    if processed_ds_id is not None and not labels_list:
-                        labels_list = list(self.db.labels.find({"dataset_id": {"$exists": False}}, {"_id": 0})) or \
-                                      list(self.db.labels.find({"dataset_id": None}, {"_id": 0}))
-                    labels_dict = {l.get('label_id'): l.get('label_name', '') for l in labels_list}
-                    for item in annotations_data:
-                        # 多标签支持：若存在 label_ids，生成逗号分隔的名称；否则保持单标签
-                        if 'label_ids' in item and isinstance(item['label_ids'], list) and item['label_ids']:
-                            names = [labels_dict.get(lid, '') for lid in item['label_ids']]
-                            item['label_name'] = ','.join([n for n in names if n])
-                            # 为兼容旧字段，label_id 保留首个
-                            if 'label_id' not in item and item['label_ids']:
-                                item['label_id'] = item['label_ids'][0]
-                        else:
-                            item['label_name'] = labels_dict.get(item.get('label_id'), '')
-                    adf = pd.DataFrame(annotations_data)
-                    # 增加 label_ids 字段（多标签模式下的原始列表），导出时保持逗号分隔在 label_name 中
-                    if 'label_ids' in adf.columns:
-                        # 若需要可保留原列表列；当前只展示方便溯源
-                        pass
-                    col_order = ['dataset_id','record_id','image_id','expert_id','label_id','label_ids','label_name','tip','datetime']
-                    adf = adf.reindex(columns=[c for c in col_order if c in adf.columns])
-                    if 'dataset_id' in adf.columns:
-                        adf = adf.sort_values(['dataset_id','record_id'])
-                    sheet = f"数据集{processed_ds_id}标注" if processed_ds_id else '标注数据'
-                    adf.to_excel(writer, sheet_name=sheet, index=False)
-                else:
-                    empty = pd.DataFrame(columns=['dataset_id','record_id','image_id','expert_id','label_id','label_name','tip','datetime'])
-                    sheet = f"数据集{processed_ds_id}标注" if processed_ds_id else '标注数据'
-                    empty.to_excel(writer, sheet_name=sheet, index=False)
-            except Exception as e:  # pragma: no cover - captured into sheet
-                pd.DataFrame([{'error': str(e)}]).to_excel(writer, sheet_name='标注数据错误', index=False)
-            # images sheet
-            try:
-                img_query = {}
-                if processed_ds_id is not None:
-                    links = list(self.db.image_datasets.find({"dataset_id": processed_ds_id}, {"_id": 0, "image_id": 1}))
-                    if links:
-                        img_query['image_id'] = {"$in": [l['image_id'] for l in links]}
-                images_data = list(self.db.images.find(img_query, {"_id": 0}))
-                idf = pd.DataFrame(images_data) if images_data else pd.DataFrame(columns=['image_id','image_path'])
-                idf = idf.reindex(columns=[c for c in ['image_id','image_path'] if c in idf.columns])
-                sheet = f"数据集{processed_ds_id}图片" if processed_ds_id else '图片数据'
-                idf.to_excel(writer, sheet_name=sheet, index=False)
-            except Exception as e:  # pragma: no cover
-                pd.DataFrame([{'error': str(e)}]).to_excel(writer, sheet_name='图片数据错误', index=False)
-            # labels sheet
-            try:
-                # 标签工作表也按数据集过滤，保持导出内容相干
-                if processed_ds_id is not None:
-                    labels_data = list(self.db.labels.find({"dataset_id": processed_ds_id}, {"_id": 0}))
-                    if not labels_data:
-                        labels_data = list(self.db.labels.find({"dataset_id": {"$exists": False}}, {"_id": 0})) or \
-                                      list(self.db.labels.find({"dataset_id": None}, {"_id": 0}))
-                else:
-                    labels_data = list(self.db.labels.find({}, {"_id": 0}))
-                ldf = pd.DataFrame(labels_data) if labels_data else pd.DataFrame(columns=['label_id','label_name','category'])
-                if not ldf.empty and 'label_id' in ldf.columns:
-                    ldf = ldf.sort_values('label_id')
-                ldf = ldf.reindex(columns=[c for c in ['label_id','label_name','category'] if c in ldf.columns])
-                sheet = f"数据集{processed_ds_id}标签" if processed_ds_id else '标签数据'
-                ldf.to_excel(writer, sheet_name=sheet, index=False)
-            except Exception as e:  # pragma: no cover
-                pd.DataFrame([{'error': str(e)}]).to_excel(writer, sheet_name='标签数据错误', index=False)
-            # datasets sheet
+        if expert_id and isinstance(expert_id, str) and expert_id.lower() == 'admin':
+            return None
+        return expert_id or None
+
+    @staticmethod
+    def _annotation_query(dataset_id: Optional[int], expert_id: Optional[str]) -> Dict[str, Any]:
+        query: Dict[str, Any] = {}
+        if dataset_id is not None:
+            query['dataset_id'] = dataset_id
+        # 管理员或未传入 expert_id 时，导出该数据集的所有用户标注
+        if expert_id is not None:
+            query['expert_id'] = expert_id
+        return query
+
+    def iter_annotations(self, dataset_id: Optional[int], expert_id: Optional[str]) -> Iterator[Dict[str, Any]]:
+        """按 (dataset_id, record_id) 顺序逐条产出规范化后的标注（批量游标，不整体载入内存）。"""
+        self.ensure_db()
+        expert = self._resolve_expert(expert_id)
+        labels_dict = label_catalog.label_map(dataset_id)
+        cursor = self.db.annotations.find(
+            self._annotation_query(dataset_id, expert), {"_id": 0}
+        ).sort([("dataset_id", 1), ("record_id", 1)]).batch_size(self.STREAM_BATCH).allow_disk_use(True)
+        for item in cursor:
+            yield normalize_annotation(item, labels_dict)
+
+    @staticmethod
+    def normalize_since(value: Any) -> Optional[datetime]:
+        """把 since 参数规整为与 annotations.changed_at 相同的 naive UTC 时间（毫秒精度）；无时区按 UTC。"""
+        if value is None or value == '':
+            return None
+        if not isinstance(value, datetime):
             try:
-                ds_query = { 'id': processed_ds_id } if processed_ds_id is not None else {}
-                ds_data = list(self.db.datasets.find(ds_query, {"_id": 0}))
-                ddf = pd.DataFrame(ds_data) if ds_data else pd.DataFrame(columns=['id','name','description','created_at','image_count','status'])
-                ddf = ddf.reindex(columns=[c for c in ['id','name','description','created_at','image_count','status'] if c in ddf.columns])
-                ddf.to_excel(writer, sheet_name='数据集信息', index=False)
-            except Exception as e:  # pragma: no cover
-                pd.DataFrame([{'error': str(e)}]).to_excel(writer, sheet_name='数据集信息错误', index=False)
-        output.seek(0)
-        return output
-
-    def build_filename(self, dataset_id: Optional[int], expert_id: Optional[str]) -> str:
+                value = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+            except ValueError:
+                raise ValueError(f"since 不是有效的 ISO 时间: {value}")
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+    @staticmethod
+    def format_since(value: Optional[datetime]) -> Optional[str]:
+        return None if value is None else value.isoformat(timespec='milliseconds') + 'Z'
+
+    def server_now(self) -> datetime:
+        """MongoDB 服务端当前时间（与写入 changed_at 的 $currentDate 同一时钟，不受各 worker 时钟偏差影响）。"""
+        doc = self.db.system_info.find_one_and_update(
+            {'key': 'server_clock'}, {'$currentDate': {'value': True}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc['value']
+
+    def annotation_delta(self, dataset_id: Optional[int], expert_id: Optional[str],
+                         since: Any = None, since_record_id: Optional[int] = None,
+                         lag: Optional[float] = None):
+        """增量导出：返回 (新水位, 标注迭代器)。
+
+        变更标记是 annotations.changed_at：每次新增 / 修改由服务端 $currentDate 写入，
+        不依赖应用时钟（datetime 在写入提交前由各 worker 生成）或 record_id（按 worker 分段发放，不随时间单调）。
+        按 (changed_at, record_id) 键集分页，since_record_id 为同一毫秒内的续点。
+        导出范围封顶到 “服务端当前时间 - lag 秒” 以内的最大键，作为新水位返回：
+        已取得时间戳但尚未提交的写入落在滞后窗口里，留给下一次增量，因此不会漏行。
+        水位为 {since, since_record_id}；无增量时原样返回传入的水位。
+        """
+        self.ensure_db()
+        since = self.normalize_since(since)
+        if since is None:
+            raise ValueError("增量导出需要 since（首次全量可传 1970-01-01T00:00:00Z）")
+        expert = self._resolve_expert(expert_id)
+        base = self._annotation_query(dataset_id, expert)
+        sort = [("changed_at", 1), ("record_id", 1)]
+        lower: Dict[str, Any] = {'changed_at': {'$gt': since}}
+        if since_record_id is not None:
+            lower = {'$or': [lower, {'changed_at': since, 'record_id': {'$gt': since_record_id}}]}
+        cap = self.server_now() - timedelta(seconds=DELTA_LAG_SECONDS if lag is None else lag)
+
+        last = self.db.annotations.find_one(
+            {'$and': [base, lower, {'changed_at': {'$lte': cap}}]}, {'_id': 0, 'changed_at': 1, 'record_id': 1},
+            sort=[(k, -1) for k, _ in sort]
+        )
+        if last is None:
+            return {'since': self.format_since(since), 'since_record_id': since_record_id}, iter(())
+        watermark = {'since': self.format_since(last['changed_at']), 'since_record_id': last.get('record_id')}
+        upper = {'$or': [{'changed_at': {'$lt': last['changed_at']}},
+                         {'changed_at': last['changed_at'], 'record_id': {'$lte': last.get('record_id')}}]}
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            labels_dict = label_catalog.label_map(dataset_id)
+            cursor = self.db.annotations.find(
+                {'$and': [base, lower, upper]}, {"_id": 0}
+            ).sort(sort).batch_size(self.STREAM_BATCH)
+            for item in cursor:
+                yield normalize_annotation(item, labels_dict)
+
+        return watermark, rows()
+
+    def iter_images(self, dataset_id: Optional[int]) -> Iterator[Dict[str, Any]]:
+        """数据集图片 {image_id, image_path}，按 image_id 升序，批量游标（不构造巨大的 $in）。"""
+        self.ensure_db()
+        if dataset_id is None:
+            cursor = self.db.images.find(
+                {}, {"_id": 0, "image_id": 1, "image_path": 1}
+            ).sort("image_id", 1).batch_size(self.STREAM_BATCH)
+        else:
+            cursor = self.db.image_datasets.aggregate([
+                {'$match': {'dataset_id': dataset_id}},
+                {'$sort': {'image_id': 1}},
+                {'$lookup': {'from': 'images', 'localField': 'image_id', 'foreignField': 'image_id', 'as': 'img'}},
+                {'$unwind': '$img'},
+                {'$project': {'_id': 0, 'image_id': '$img.image_id', 'image_path': '$img.image_path'}},
+            ], allowDiskUse=True, batchSize=self.STREAM_BATCH)
+        yield from cursor
+
+    def iter_datasets(self, dataset_id: Optional[int]) -> Iterator[Dict[str, Any]]:
+        self.ensure_db()
+        ds_query = {'id': dataset_id} if dataset_id is not None else {}
+        yield from self.db.datasets.find(ds_query, {"_id": 0}).sort("id", 1)
+
+    def build_columnar(self, dataset_id: Optional[int], expert_id: Optional[str], fmt: str, out_dir: str) -> Dict[str, Dict[str, Any]]:
+        """每张表写一个 Parquet / Arrow IPC 文件（annotations, images, labels, datasets）。
+
+        返回 {table: {path, rows}}。
+        """
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        self.ensure_db()
+        schemas = table_schemas()
+        sources = {
+            'annotations': self.iter_annotations(dataset_id, expert_id),
+            'images': self.iter_images(dataset_id),
+            'labels': iter(label_catalog.labels(dataset_id)),
+            'datasets': self.iter_datasets(dataset_id),
+        }
+        result: Dict[str, Dict[str, Any]] = {}
+        for table, rows in sources.items():
+            path = os.path.join(out_dir, f"{table}.{COLUMNAR_FORMATS[fmt]}")
+            result[table] = {'path': path, 'rows': write_table(path, schemas[table], rows, fmt)}
+        return result
+
+    def write_columnar_archive(self, dataset_id: Optional[int], expert_id: Optional[str], fmt: str, zip_path: str) -> None:
+        """生成列式文件并打包为 zip_path（文件已 zstd 压缩，zip 仅存储）。"""
+        work_dir = tempfile.mkdtemp(prefix='medc_export_')
+        try:
+            tables = self.build_columnar(dataset_id, expert_id, fmt, work_dir)
+            with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED) as zf:
+                for info in tables.values():
+                    zf.write(info['path'], arcname=os.path.basename(info['path']))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def build_columnar_archive(self, dataset_id: Optional[int], expert_id: Optional[str], fmt: str) -> str:
+        """写入临时 zip 并返回路径；调用方负责在发送后删除该文件。"""
+        fd, zip_path = tempfile.mkstemp(prefix='medc_export_', suffix='.zip')
+        os.close(fd)
+        try:
+            self.write_columnar_archive(dataset_id, expert_id, fmt, zip_path)
+        except Exception:
+            os.remove(zip_path)
+            raise
+        return zip_path
+
+    def _dataset_files(self, dataset_id: int, expert_id: Optional[str], fmt: str, out_dir: str) -> List[tuple]:
+        """在 out_dir 中写出单个数据集的导出文件，返回 [(zip 内路径, 本地路径)]。"""
+        os.makedirs(out_dir, exist_ok=True)
+        if fmt in COLUMNAR_FORMATS:
+            tables = self.build_columnar(dataset_id, expert_id, fmt, out_dir)
+            return [(f"dataset_{dataset_id}/{os.path.basename(t['path'])}", t['path']) for t in tables.values()]
+        name = f"dataset_{dataset_id}.{EXPORT_FORMATS[fmt][0]}"
+        path = os.path.join(out_dir, name)
+        self.write_artifact(dataset_id, expert_id, fmt, path)
+        return [(name, path)]
+
+    def stream_datasets_zip(self, expert_id: Optional[str], fmt: str,
+                            dataset_ids: Optional[List[int]] = None, workers: int = EXPORT_PARALLELISM) -> Iterator[bytes]:
+        """多数据集导出：线程池并行生成每个数据集的文件，按完成顺序写入流式 zip。
+
+        同时在途的数据集不超过 workers 个（并发与临时磁盘占用都有上界），文件写入 zip 后立即删除。
+        单个数据集失败时写入 dataset_<id>_error.txt，不影响其它数据集。
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        self.ensure_db()
+        if dataset_ids is None:
+            dataset_ids = [d['id'] for d in self.db.datasets.find({}, {'_id': 0, 'id': 1}).sort('id', 1) if d.get('id') is not None]
+        # 已压缩格式（xlsx / zstd 列式文件）只存储，文本格式再压缩
+        compression = zipfile.ZIP_DEFLATED if fmt in STREAM_FORMATS else zipfile.ZIP_STORED
+        work_dir = tempfile.mkdtemp(prefix='medc_export_multi_')
+        out = _ZipStream()
+        pending = iter(dataset_ids)
+        running = {}
+        pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='export-ds')
+
+        def submit_next() -> None:
+            ds = next(pending, None)
+            if ds is not None:
+                out_dir = os.path.join(work_dir, str(ds))
+                running[pool.submit(self._dataset_files, ds, expert_id, fmt, out_dir)] = (ds, out_dir)
+
+        try:
+            for _ in range(max(1, workers)):
+                submit_next()
+            with zipfile.ZipFile(out, 'w', compression=compression, compresslevel=1 if compression else None) as zf:
+                while running:
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        ds, out_dir = running.pop(future)
+                        submit_next()
+                        try:
+                            files = future.result()
+                        except Exception as e:
+                            zf.writestr(f"dataset_{ds}_error.txt", str(e))
+                            files = []
+                        for arcname, path in files:
+                            with open(path, 'rb') as src, zf.open(arcname, 'w', force_zip64=True) as dst:
+                                for chunk in iter(lambda: src.read(_ZIP_CHUNK), b''):
+                                    dst.write(chunk)
+                                    if out:
+                                        yield out.take()
+                        shutil.rmtree(out_dir, ignore_errors=True)
+                        if out:
+                            yield out.take()
+            if out:
+                yield out.take()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def write_artifact(self, dataset_id: Optional[int], expert_id: Optional[str], fmt: str, path: str) -> None:
+        """按格式把完整导出写入 path（导出任务 / 产物缓存使用）。"""
+        if fmt == 'xlsx':
+            self.write_workbook(dataset_id, expert_id, path)
+        elif fmt in STREAM_FORMATS:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                for chunk in self.stream_annotations(dataset_id, expert_id, fmt):
+                    f.write(chunk)
+        elif fmt in COLUMNAR_FORMATS:
+            self.write_columnar_archive(dataset_id, expert_id, fmt, path)
+        else:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+
+    def data_version(self, dataset_id: Optional[int], expert_id: Optional[str]) -> str:
+        """导出输入的指纹：数据不变则不变，用于导出产物缓存键。
+
+        由若干索引查询组成：标注数 + 最新 changed_at + 最大 record_id（所有标注写入都会刷新服务端
+        赋值的 changed_at，不受 worker 时钟偏差影响；应用写入的 datetime 不可靠，见 annotation_delta），
+        图片关联数、标签目录版本和数据集文档。
+        """
+        self.ensure_db()
+        expert = self._resolve_expert(expert_id)
+        query = self._annotation_query(dataset_id, expert)
+        latest = self.db.annotations.find_one(query, {'_id': 0, 'changed_at': 1}, sort=[('changed_at', -1)])
+        top = self.db.annotations.find_one(query, {'_id': 0, 'record_id': 1}, sort=[('record_id', -1)])
+        links = {'dataset_id': dataset_id} if dataset_id is not None else {}
+        parts = [
+            self.db.annotations.count_documents(query),
+            (latest or {}).get('changed_at'),
+            (top or {}).get('record_id'),
+            self.db.image_datasets.count_documents(links),
+            label_catalog.version(dataset_id),
+            list(self.iter_datasets(dataset_id)),
+        ]
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def stream_annotations(self, dataset_id: Optional[int], expert_id: Optional[str], fmt: str) -> Iterator[str]:
+        """以 csv / ndjson 文本块流式输出标注，每 STREAM_BATCH 行产出一次。"""
+        if fmt not in STREAM_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        return self.render_stream(self.iter_annotations(dataset_id, expert_id), fmt)
+
+    def render_stream(self, rows: Iterator[Dict[str, Any]], fmt: str) -> Iterator[str]:
+        """把规范化后的标注行编码为 csv / ndjson 文本块。"""
+        buf = StringIO()
+        if fmt == 'csv':
+            writer = csv.writer(buf)
+            # BOM 便于 Excel 正确识别 UTF-8 中文
+            buf.write('\ufeff')
+            writer.writerow(ANNOTATION_COLUMNS)
+        n = 0
+        for item in rows:
+            if fmt == 'csv':
+                writer.writerow([
+                    ','.join(str(x) for x in v) if isinstance(v, list) else ('' if v is None else v)
+                    for v in (item.get(c) for c in ANNOTATION_COLUMNS)
+                ])
+            else:
+                buf.write(json.dumps({c: item.get(c) for c in ANNOTATION_COLUMNS}, ensure_ascii=False, default=str))
+                buf.write('\n')
+            n += 1
+            if n % self.STREAM_BATCH == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    def manifest_folds(self, dataset_id: Optional[int], expert_id: Optional[str], k: int, seed: int = 42) -> Dict[Any, int]:
+        """按标注标签分层的确定性 k 折划分：image_id -> fold。"""
+        self.ensure_db()
+        expert = self._resolve_expert(expert_id)
+        labels: Dict[Any, List[Any]] = {}
+        cursor = self.db.annotations.find(
+            self._annotation_query(dataset_id, expert), {'_id': 0, 'image_id': 1, 'label_id': 1, 'label_ids': 1}
+        ).batch_size(self.STREAM_BATCH)
+        for a in cursor:
+            label = a.get('label_id')
+            if label is None and a.get('label_ids'):
+                label = min(a['label_ids'])
+            labels.setdefault(a.get('image_id'), []).append(label)
+        strata = {img['image_id']: stratum_label(labels.get(img['image_id'], ())) for img in self.iter_images(dataset_id)}
+        return assign_folds(strata, k, seed)
+
+    def stream_manifest(self, dataset_id: Optional[int], expert_id: Optional[str],
+                        folds: Optional[int] = None, seed: int = 42) -> Iterator[str]:
+        """训练清单 csv：id,image_path,mask_path[,fold]，按 image_id 顺序从游标逐批输出。"""
+        fold_map = self.manifest_folds(dataset_id, expert_id, folds, seed) if folds else None
+        columns = MANIFEST_COLUMNS + (['fold'] if fold_map is not None else [])
+        buf = StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        n = 0
+        for img in self.iter_images(dataset_id):
+            row = [img.get('image_id'), resolve_image_path(img.get('image_path')), resolve_mask_path(img.get('image_path'))]
+            if fold_map is not None:
+                row.append(fold_map.get(img.get('image_id'), ''))
+            writer.writerow(row)
+            n += 1
+            if n % self.STREAM_BATCH == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    def _write_sheet(self, wb, title: str, columns, rows: Iterator[Dict[str, Any]]) -> None:
+        """write-only 工作表：表头 + 逐行追加（行写出后即释放，不保留对象模型）。"""
+        ws = wb.create_sheet(title=title)
+        ws.append(list(columns))
+        for row in rows:
+            ws.append([_cell(row.get(c)) for c in columns])
+
+    def _write_error_sheet(self, wb, title: str, error: Exception) -> None:
+        ws = wb.create_sheet(title=title)
+        ws.append(['error'])
+        ws.append([str(error)])
+
+    def write_workbook(self, dataset_id: Optional[int], expert_id: Optional[str], path: str) -> None:
+        """以 openpyxl write-only 模式将四个工作表逐行写入 path，行直接来自批量游标。
+
+        工作表名称与列顺序与历史 build_workbook 一致；峰值内存与数据规模无关。
+        """
+        from openpyxl import Workbook
+        self.ensure_db()
+        processed_ds_id = dataset_id
+        user_identifier = self._resolve_expert(expert_id)
+        wb = Workbook(write_only=True)
+        # annotations sheet（按 dataset_id, record_id 排序；仅当存在多标签数据时输出 label_ids 列）
+        sheet = f"数据集{processed_ds_id}标注" if processed_ds_id else '标注数据'
+        try:
+            query = self._annotation_query(processed_ds_id, user_identifier)
+            has_multi = self.db.annotations.find_one({**query, 'label_ids': {'$exists': True}}, {'_id': 1}) is not None
+            columns = [c for c in ANNOTATION_COLUMNS if has_multi or c != 'label_ids']
+            self._write_sheet(wb, sheet, columns, self.iter_annotations(processed_ds_id, expert_id))
+        except Exception as e:  # pragma: no cover - captured into sheet
+            self._write_error_sheet(wb, '标注数据错误', e)
+        # images sheet
+        try:
+            sheet = f"数据集{processed_ds_id}图片" if processed_ds_id else '图片数据'
+            self._write_sheet(wb, sheet, IMAGE_COLUMNS, self.iter_images(processed_ds_id))
+        except Exception as e:  # pragma: no cover
+            self._write_error_sheet(wb, '图片数据错误', e)
+        # labels sheet：也按数据集过滤，保持导出内容相干（dataset_id 为空时导出全部标签）
+        try:
+            sheet = f"数据集{processed_ds_id}标签" if processed_ds_id else '标签数据'
+            self._write_sheet(wb, sheet, LABEL_COLUMNS, iter(label_catalog.labels(processed_ds_id)))
+        except Exception as e:  # pragma: no cover
+            self._write_error_sheet(wb, '标签数据错误', e)
+        # datasets sheet
+        try:
+            self._write_sheet(wb, '数据集信息', DATASET_COLUMNS, self.iter_datasets(processed_ds_id))
+        except Exception as e:  # pragma: no cover
+            self._write_error_sheet(wb, '数据集信息错误', e)
+        wb.save(path)
+
+    def build_workbook_file(self, dataset_id: Optional[int], expert_id: Optional[str]) -> str:
+        """写入临时 xlsx 文件并返回路径；调用方负责发送后删除。"""
+        fd, path = tempfile.mkstemp(prefix='medc_export_', suffix='.xlsx')
+        os.close(fd)
+        try:
+            self.write_workbook(dataset_id, expert_id, path)
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+
+    def build_workbook(self, dataset_id: Optional[int], expert_id: Optional[str]) -> BytesIO:
+        """兼容接口：返回内存中的 xlsx（大数据集请使用 build_workbook_file）。"""
+        path = self.build_workbook_file(dataset_id, expert_id)
+        try:
+            with open(path, 'rb') as f:
+                return BytesIO(f.read())
+        finally:
+            os.remove(path)
+
+    def build_filename(self, dataset_id: Optional[int], expert_id: Optional[str], ext: str = 'xlsx') -> str:
         base = "医学图像标注数据"
         if dataset_id:
             base += f"_数据集{dataset_id}"
         if expert_id:
             base += f"_{expert_id}"
-        base += f"_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        base += f"_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
         return base
 
 
 export_service = ExportService()
 
-__all__ = ["export_service", "ExportService"]
+__all__ = ["export_service", "ExportService", "ANNOTATION_COLUMNS", "STREAM_FORMATS", "normalize_annotation", "COLUMNAR_FORMATS", "EXPORT_FORMATS", "XLSX_MIMETYPE"]
@@ -0,0 +1,58 @@
+"""Original image delivery for ``/api/images/<id>/file``.
+
+Stored files never change behind an image_id (content-addressed paths, or
+uuid-named files from before), so responses carry a strong ETag derived from
+the content hash and ``Cache-Control: public, max-age=31536000, immutable``.
+``If-None-Match`` is answered with 304 before any file is touched.
+
+By default Flask streams the file itself (``send_file`` also handles Range /
+206). When ``IMAGE_ACCEL_PREFIX`` is set, the response is an empty body with
+``X-Accel-Redirect: <prefix><relative path>`` and nginx serves the bytes from an
+``internal`` location (see frontend/nginx.conf), including Range requests.
+
+    IMAGE_ACCEL_PREFIX   e.g. /_protected_img/ ; empty = Flask sends the file
+"""
+from __future__ import annotations
+import mimetypes
+import os
+from typing import Any, Dict
+from urllib.parse import quote
+
+from flask import Request, Response, send_file
+
+from app.services.rendition_service import source_key
+
+ACCEL_PREFIX = os.environ.get('IMAGE_ACCEL_PREFIX', '')
+MAX_AGE = 365 * 24 * 3600
+
+
+def image_etag(image: Dict[str, Any]) -> str:
+    """强 ETag：内容哈希；历史图片用存储路径的哈希（文件不会被覆盖）。"""
+    return source_key(image)
+
+
+def _cache_headers(response: Response, etag: str) -> Response:
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def file_response(image: Dict[str, Any], request: Request, accel_prefix: str = ACCEL_PREFIX) -> Response:
+    """image 为 ImageService.locate 的结果（含 rel / path）；文件不存在时抛 FileNotFoundError。"""
+    etag = image_etag(image)
+    mimetype = mimetypes.guess_type(image['rel'])[0] or 'application/octet-stream'
+    if request.if_none_match.contains_weak(etag) or request.if_none_match.star_tag:
+        return _cache_headers(Response(status=304), etag)
+    if not os.path.isfile(image['path']):
+        raise FileNotFoundError(image['path'])
+    if accel_prefix:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(image['rel'])
+        return _cache_headers(response, etag)
+    response = send_file(image['path'], mimetype=mimetype, etag=etag, max_age=MAX_AGE, conditional=True)
+    return _cache_headers(response, etag)
+
+
+__all__ = ['file_response', 'image_etag', 'ACCEL_PREFIX', 'MAX_AGE']
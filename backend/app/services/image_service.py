@@ -4,20 +4,27 @@ Responsibilities:
   * Batch upload images into storage folder
   * Maintain images collection + image_datasets relation
   * Provide paginated listing with (optional) expert annotations merged
-  * Enrich annotation with label_name via labels cache
+  * Enrich annotation with label_name via the versioned label catalog
 
 NOTE: Keeps behavior & response fields identical to original image_api endpoints.
 """
 from __future__ import annotations
 import os
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Tuple
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
+from pymongo.errors import BulkWriteError
 
 from app.core.db import get_db, USE_DATABASE
-from db_utils import get_next_sequence_value  # type: ignore
-from config import UPLOAD_FOLDER  # type: ignore
+from app.repositories import image_order_repository, image_listing_repository, progress_repository
+from app.services.annotation_join import join_images
+from app.services.dataset_service import dataset_service
+from app.services.label_catalog import label_catalog
+from app.services.image_store import image_store, relative_path, STATIC_PREFIX
+from app.services.rendition_service import rendition_service, RENDER_ON_UPLOAD
+from db_utils import sequence_allocator  # type: ignore
+from config import UPLOAD_FOLDER, UPLOAD_WORKERS  # type: ignore
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -30,39 +37,155 @@ class ImageService:
         if not USE_DATABASE or self.db is None:
             raise RuntimeError("数据库连接不可用")
 
+    # ---------------- Files -----------------
+    def locate(self, image_id: int) -> Optional[Dict[str, Any]]:
+        """image_id -> {image_id, image_path, content_hash?, rel, path}；path 为 UPLOAD_FOLDER 下的绝对路径。"""
+        self.ensure_db()
+        doc = self.db.images.find_one({'image_id': image_id}, {'_id': 0, 'image_id': 1, 'image_path': 1, 'content_hash': 1})
+        if not doc or not doc.get('image_path'):
+            return None
+        doc['rel'] = relative_path(doc['image_path'])
+        doc['path'] = os.path.abspath(image_store.absolute(doc['rel']))
+        return doc
+
     # ---------------- Upload -----------------
+    INSERT_CHUNK = 1000
+
+    def _insert_chunked(self, collection, docs: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """insert_many(ordered=False) 分块写入，返回 {docs 下标: writeError}。"""
+        errors: Dict[int, Dict[str, Any]] = {}
+        for start in range(0, len(docs), self.INSERT_CHUNK):
+            try:
+                collection.insert_many(docs[start:start + self.INSERT_CHUNK], ordered=False)
+            except BulkWriteError as bwe:
+                for e in bwe.details.get('writeErrors', []):
+                    errors[start + e.get('index', 0)] = e
+        return errors
+
+    def _images_by_hash(self, hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        found: Dict[str, Dict[str, Any]] = {}
+        for start in range(0, len(hashes), self.INSERT_CHUNK):
+            for doc in self.db.images.find({'content_hash': {'$in': hashes[start:start + self.INSERT_CHUNK]}},
+                                           {'_id': 0, 'image_id': 1, 'image_path': 1, 'content_hash': 1}):
+                found[doc['content_hash']] = doc
+        return found
+
     def upload_batch(self, dataset_id: int, files: List[FileStorage]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
         """Save multiple images; return (uploaded, failed).
 
-        Each uploaded record: {image_id, filename, original_name}
+        Each uploaded record: {image_id, filename, original_name, duplicate}
         Each failed record: {filename, error}
+
+        Files are hashed while being written (image_store, bounded thread pool of
+        UPLOAD_WORKERS). Content already in ``images`` reuses its doc; new content
+        takes ids from one sequence block. images / image_datasets docs go out with
+        chunked insert_many(ordered=False), followed by a single image_count $inc.
+        ``duplicate`` marks files whose content was already in this dataset (or
+        earlier in the same batch); they add no link and no count.
         """
         self.ensure_db()
-        dataset = self.db.datasets.find_one({"id": dataset_id})
+        dataset = dataset_service.get(dataset_id)
         if not dataset:
             raise ValueError(f"数据集 {dataset_id} 不存在")
         uploaded: List[Dict[str, Any]] = []
         failed: List[Dict[str, Any]] = []
-        for file in files:
-            if not file or not file.filename:
-                continue
-            original_filename = secure_filename(file.filename)
-            filename = f"{uuid.uuid4().hex}_{original_filename}"
+        pending: List[Dict[str, Any]] = [
+            {'file': f, 'original_name': secure_filename(f.filename)} for f in files if f and f.filename
+        ]
+        if not pending:
+            return uploaded, failed
+
+        # 1) 并行写盘 + 流式哈希（请求体已由 werkzeug 解析为独立流，可并发读取）
+        with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(pending)), thread_name_prefix='upload') as pool:
+            futures = [pool.submit(image_store.save, item['file'].stream, item['original_name']) for item in pending]
+        saved: List[Dict[str, Any]] = []
+        for item, future in zip(pending, futures):
             try:
-                path = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(path)
-                image_id = get_next_sequence_value(self.db, "images_id")
-                self.db.images.insert_one({"image_id": image_id, "image_path": f"static/img/{filename}"})
-                self.db.image_datasets.insert_one({"image_id": image_id, "dataset_id": dataset_id})
-                uploaded.append({
-                    "image_id": image_id,
-                    "filename": filename,
-                    "original_name": original_filename
-                })
+                item['hash'], item['rel'], item['size'], item['new_file'] = future.result()
+                saved.append(item)
             except Exception as e:  # pragma: no cover (per-file errors)
-                failed.append({"filename": file.filename, "error": str(e)})
-        if uploaded:
-            self.db.datasets.update_one({"id": dataset_id}, {"$inc": {"image_count": len(uploaded)}})
+                item['error'] = str(e)
+
+        # 2) 按内容哈希去重：已有内容复用 images 文档，新内容一次领取 ID 区间后批量写入
+        hashes = list(dict.fromkeys(item['hash'] for item in saved))
+        docs = self._images_by_hash(hashes)
+        first = {}
+        for item in saved:
+            first.setdefault(item['hash'], item)
+        new_hashes = [h for h in hashes if h not in docs]
+        if new_hashes:
+            new_docs = [{
+                "image_id": image_id,
+                "image_path": STATIC_PREFIX + first[h]['rel'],
+                "content_hash": h,
+                "size": first[h]['size'],
+                "original_name": first[h]['original_name'],
+            } for h, image_id in zip(new_hashes, sequence_allocator.take(self.db, "images_id", len(new_hashes)))]
+            errors = self._insert_chunked(self.db.images, new_docs)
+            for i, doc in enumerate(new_docs):
+                if i not in errors:
+                    docs[doc['content_hash']] = doc
+            # 并发上传相同内容时唯一索引冲突：改用已存在的文档
+            raced = [new_docs[i]['content_hash'] for i, e in errors.items() if e.get('code') == 11000]
+            docs.update(self._images_by_hash(raced))
+            for i, e in errors.items():
+                h = new_docs[i]['content_hash']
+                if h not in docs:
+                    for item in saved:
+                        if item['hash'] == h:
+                            item['error'] = e.get('errmsg', '')
+                            if item['new_file']:
+                                # 元数据写入失败：刚写入的文件无文档引用，不留在磁盘
+                                image_store.remove(item['rel'])
+
+        # 3) 关联数据集：已关联（或本批次重复）的图片不再写入关联
+        resolved = [item for item in saved if 'error' not in item]
+        for item in resolved:
+            doc = docs[item['hash']]
+            item['image_id'] = doc['image_id']
+            if item['new_file'] and relative_path(doc['image_path']) != item['rel']:
+                # 相同内容已以其它扩展名存储：保留既有文件
+                image_store.remove(item['rel'])
+        image_ids = list(dict.fromkeys(item['image_id'] for item in resolved))
+        linked = set()
+        for start in range(0, len(image_ids), self.INSERT_CHUNK):
+            linked.update(l['image_id'] for l in self.db.image_datasets.find(
+                {'dataset_id': dataset_id, 'image_id': {'$in': image_ids[start:start + self.INSERT_CHUNK]}},
+                {'_id': 0, 'image_id': 1}
+            ))
+        to_link = [i for i in image_ids if i not in linked]
+        link_errors = self._insert_chunked(self.db.image_datasets, [
+            {"image_id": image_id, "dataset_id": dataset_id} for image_id in to_link
+        ])
+        failed_links = {to_link[i]: e.get('errmsg', '') for i, e in link_errors.items()}
+        added = len(to_link) - len(failed_links)
+
+        # 4) 报告保持输入顺序
+        seen = set(linked)
+        for item in pending:
+            if 'error' not in item and item['image_id'] in failed_links:
+                item['error'] = failed_links[item['image_id']]
+            if 'error' in item:
+                failed.append({"filename": item['file'].filename, "error": item['error']})
+                continue
+            uploaded.append({
+                "image_id": item['image_id'],
+                "filename": relative_path(docs[item['hash']]['image_path']),
+                "original_name": item['original_name'],
+                "duplicate": item['image_id'] in seen,
+            })
+            seen.add(item['image_id'])
+        if RENDER_ON_UPLOAD and uploaded:
+            rendition_service.warm(
+                {**docs[h], 'path': image_store.absolute(relative_path(docs[h]['image_path']))}
+                for h in dict.fromkeys(item['hash'] for item in pending if 'error' not in item)
+            )
+        if added:
+            self.db.datasets.update_one({"id": dataset_id}, {"$inc": {"image_count": added}})
+            progress_repository.inc_total(dataset_id, added)
+            # 图片集合变化：各专家的预计算顺序失效，下次 next_image 时重建
+            image_order_repository.invalidate(dataset_id)
+            dataset_service.invalidate_dataset(dataset_id)
         return uploaded, failed
 
     # ---------------- Listing -----------------
@@ -73,33 +196,19 @@ class ImageService:
         page: int = 1,
         page_size: int = 20
     ) -> List[Dict[str, Any]]:
+        """分页列出数据集图片（image_id 升序），可选合并某专家的标注。
+
+        先在聚合中 $skip/$limit 再 $lookup 图片与标注，内存与延迟只与页大小相关。
+        """
         self.ensure_db()
-        links = list(self.db.image_datasets.find({"dataset_id": dataset_id}, {"_id": 0, "image_id": 1}))
-        if not links:
+        start = max(int(page) - 1, 0) * int(page_size)
+        rows = image_listing_repository.page_by_dataset(
+            dataset_id, expert_id, start, int(page_size), with_annotations=bool(expert_id)
+        )
+        if not rows:
             return []
-        image_ids = [l['image_id'] for l in links]
-        imgs = list(self.db.images.find({"image_id": {"$in": image_ids}}, {"_id": 0}))
-        annotations = list(self.db.annotations.find({'dataset_id': dataset_id, 'expert_id': expert_id}, {'_id': 0})) if expert_id else []
-        # 标签按数据集过滤，若该数据集没有专属标签，则回退到全局标签
-        labels = list(self.db.labels.find({"dataset_id": dataset_id}, {"_id": 0, "label_id": 1, "label_name": 1}))
-        if not labels:
-            labels = list(self.db.labels.find({"dataset_id": {"$exists": False}}, {"_id": 0, "label_id": 1, "label_name": 1})) or \
-                     list(self.db.labels.find({"dataset_id": None}, {"_id": 0, "label_id": 1, "label_name": 1}))
-        labels_dict = {l['label_id']: l.get('label_name', '') for l in labels}
-        result: List[Dict[str, Any]] = []
-        for img in imgs:
-            ann = next((a for a in annotations if a.get('image_id') == img.get('image_id')), None)
-            if ann and ann.get('label_id'):
-                ann['label_name'] = labels_dict.get(ann['label_id'], '')
-                ann['label'] = ann.get('label_id')  # 兼容字段
-            result.append({
-                "image_id": img.get('image_id'),
-                "filename": img.get('image_path', '').split('/')[-1],
-                "image_path": img.get('image_path', ''),
-                "annotation": ann
-            })
-        start, end = (page - 1) * page_size, (page - 1) * page_size + page_size
-        return result[start:end]
+        # 标签按数据集过滤，若该数据集没有专属标签，则回退到全局标签（版本化目录缓存）
+        return join_images(rows, label_catalog.label_map(dataset_id))
 
 
 image_service = ImageService()
@@ -0,0 +1,109 @@
+"""Content-addressed image storage under UPLOAD_FOLDER.
+
+Uploads are streamed to a temp file in ``UPLOAD_FOLDER/.incoming`` while the
+SHA-256 is computed chunk by chunk, then moved into place with ``os.replace``:
+
+    UPLOAD_FOLDER/ab/cd/<sha256>.<ext>        (served as /static/img/ab/cd/...)
+
+Two-level sharding keeps every directory small however large the archive gets.
+Identical bytes land on the same path, so a re-upload costs one hash pass and
+no extra disk; the images collection keeps one doc per ``content_hash`` (unique
+index) that any number of datasets link to through image_datasets.
+
+Files uploaded before this layout keep their flat ``static/img/<uuid>_<name>``
+paths; ``relative_path`` handles both.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import tempfile
+import threading
+from typing import IO, Optional, Tuple
+
+from config import UPLOAD_FOLDER  # type: ignore
+
+STATIC_PREFIX = 'static/img/'
+HASH_CHUNK = 1024 * 1024
+_INCOMING = '.incoming'
+
+
+def relative_path(image_path: Optional[str]) -> str:
+    """images.image_path -> UPLOAD_FOLDER 下的相对路径（即前端 /static/img/ 后的部分）。"""
+    if not image_path:
+        return ''
+    path = str(image_path).replace('\\', '/')
+    if path.startswith('/'):
+        path = path[1:]
+    if path.startswith(STATIC_PREFIX):
+        return path[len(STATIC_PREFIX):]
+    return path.split('/')[-1]
+
+
+def normalize_ext(filename: str) -> str:
+    ext = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return ext if ext.isalnum() and len(ext) <= 8 else 'bin'
+
+
+class ImageStore:
+    def __init__(self, root: str = UPLOAD_FOLDER):
+        self.root = root
+        self._dirs_lock = threading.Lock()
+        self._dirs: set = set()
+
+    def _makedirs(self, path: str) -> None:
+        # 分片目录最多 65536 个，已创建的记在内存里，避免每个文件一次 mkdir 系统调用
+        if path in self._dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        with self._dirs_lock:
+            self._dirs.add(path)
+
+    @staticmethod
+    def shard_path(content_hash: str, ext: str) -> str:
+        return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.{ext}"
+
+    def absolute(self, rel_path: str) -> str:
+        return os.path.join(self.root, *rel_path.split('/'))
+
+    def save(self, stream: IO[bytes], filename: str) -> Tuple[str, str, int, bool]:
+        """流式写入并计算 SHA-256，返回 (content_hash, 相对路径, 字节数, 是否新写入)。"""
+        incoming = os.path.join(self.root, _INCOMING)
+        self._makedirs(incoming)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=incoming)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(HASH_CHUNK), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            content_hash = digest.hexdigest()
+            rel = self.shard_path(content_hash, normalize_ext(filename))
+            target = self.absolute(rel)
+            if os.path.exists(target):
+                os.remove(tmp)
+                return content_hash, rel, size, False
+            self._makedirs(os.path.dirname(target))
+            # 并发写入相同内容时 replace 覆盖为相同字节，结果一致
+            try:
+                os.replace(tmp, target)
+            except FileNotFoundError:
+                # 目录缓存过期（分片目录被外部删除）
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp, target)
+            return content_hash, rel, size, True
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def remove(self, rel_path: str) -> None:
+        path = self.absolute(rel_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+image_store = ImageStore()
+
+__all__ = ['image_store', 'ImageStore', 'relative_path', 'normalize_ext', 'STATIC_PREFIX']
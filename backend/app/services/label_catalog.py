@@ -0,0 +1,97 @@
+"""Versioned label catalog shared by the annotation, image, export and label services.
+
+A dataset's *effective* labels are its own labels; when it has none, the global
+labels apply (dataset_id field missing first, then dataset_id: null). They are
+resolved with a single ``$or`` query and cached per process under the key
+(dataset_id, label_version):
+
+    label_versions: { _id: <dataset_id> | "__all__", version }
+
+``bump`` increments the dataset's version (and the "__all__" version that guards
+the unfiltered catalog) whenever add/update changes its labels. Readers do one
+point read of the version, so a bump in any worker makes every worker reload on
+its next lookup; superseded entries simply age out of the LRU.
+
+dataset_id=None resolves to the whole labels collection (admin export / listing).
+"""
+from __future__ import annotations
+from typing import List, Dict, Any, Optional
+
+from pymongo import UpdateOne
+
+from app.core.cache import LRUCache
+from app.core.db import get_db, USE_DATABASE
+
+_ALL = '__all__'
+
+
+def effective_labels(docs: List[Dict[str, Any]], dataset_id: Optional[int]) -> List[Dict[str, Any]]:
+    """从 $or 结果中按 专属 -> 无 dataset_id 字段 -> dataset_id 为 null 的顺序取有效标签。"""
+    if dataset_id is None:
+        chosen = docs
+    else:
+        chosen = [d for d in docs if d.get('dataset_id') == dataset_id] or \
+                 [d for d in docs if 'dataset_id' not in d] or \
+                 [d for d in docs if 'dataset_id' in d and d['dataset_id'] is None]
+    return sorted(chosen, key=lambda d: d.get('label_id') or 0)
+
+
+class LabelCatalog:
+    # 键已带版本，无需短 TTL；长 TTL 只为兜底直接改库的全局标签
+    _cache = LRUCache('label_catalog', max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=600)
+
+    def __init__(self):
+        self.db = get_db()
+
+    def _ensure(self):
+        if self.db is None or not USE_DATABASE:
+            self.db = get_db()
+        if not USE_DATABASE or self.db is None:
+            raise RuntimeError("数据库连接不可用")
+
+    @staticmethod
+    def _version_key(dataset_id: Optional[int]):
+        return _ALL if dataset_id is None else dataset_id
+
+    def version(self, dataset_id: Optional[int]) -> int:
+        self._ensure()
+        doc = self.db.label_versions.find_one({'_id': self._version_key(dataset_id)}, {'version': 1})
+        return int((doc or {}).get('version', 0))
+
+    def _entry(self, dataset_id: Optional[int]) -> Dict[str, Any]:
+        key = (dataset_id, self.version(dataset_id))
+
+        def load():
+            query = {} if dataset_id is None else {'$or': [{'dataset_id': dataset_id}, {'dataset_id': None}]}
+            labels = effective_labels(list(self.db.labels.find(query, {'_id': 0})), dataset_id)
+            return {
+                'labels': labels,
+                'map': {l.get('label_id'): l.get('label_name', '') for l in labels},
+            }
+
+        return self._cache.get_or_load(key, load)
+
+    # --- Queries ---
+    def labels(self, dataset_id: Optional[int]) -> List[Dict[str, Any]]:
+        """有效标签文档（按 label_id 升序，无 _id）；返回副本，调用方可修改。"""
+        return [dict(l) for l in self._entry(dataset_id)['labels']]
+
+    def label_map(self, dataset_id: Optional[int]) -> Dict[Any, str]:
+        """label_id -> label_name。返回缓存对象，调用方只读。"""
+        return self._entry(dataset_id)['map']
+
+    # --- Mutations ---
+    def bump(self, dataset_id: Optional[int]) -> None:
+        """标签写入后递增数据集版本（同时递增全量目录版本），一次往返。"""
+        self._ensure()
+        keys = [_ALL] if dataset_id is None else [dataset_id, _ALL]
+        self.db.label_versions.bulk_write(
+            [UpdateOne({'_id': k}, {'$inc': {'version': 1}}, upsert=True) for k in keys], ordered=False
+        )
+        # 本进程立即释放旧条目（其它进程经版本号失效）
+        self._cache.invalidate_where(lambda k: k[0] is None or k[0] == dataset_id)
+
+
+label_catalog = LabelCatalog()
+
+__all__ = ['label_catalog', 'LabelCatalog', 'effective_labels']
@@ -1,7 +1,10 @@
 """Label service layer: encapsulates label CRUD and normalization logic."""
 from __future__ import annotations
 from typing import List, Dict, Any, Optional
+from pymongo import UpdateOne, DeleteMany, InsertOne
 from app.core.db import get_db, USE_DATABASE
+from app.services.label_catalog import label_catalog
+from db_utils import sequence_allocator  # type: ignore
 
 class LabelService:
     def __init__(self):
@@ -11,20 +14,23 @@ class LabelService:
         if not USE_DATABASE or self.db is None:
             raise RuntimeError("数据库连接不可用")
 
-    def _next_label_id_base(self) -> int:
-        max_label = self.db.labels.find_one(sort=[("label_id", -1)])
-        return (max_label.get('label_id', 0) + 1) if max_label else 1
+    def _allocate_label_ids(self, count: int) -> List[int]:
+        """从 sequences(labels_id) 原子预留 count 个连续标签 ID（一次 $inc，块大小等于请求数）。
+
+        序列由数据库 v7 升级按现有最大 label_id 初始化；labels.label_id 上有唯一索引兜底。
+        """
+        return sequence_allocator.take(self.db, "labels_id", count)
 
     def add_dataset_labels(self, dataset_id: int, labels: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         self.ensure_db()
-        base = self._next_label_id_base()
+        label_ids = self._allocate_label_ids(len(labels))
         # 注意：pymongo 会在原地给插入的 dict 添加 _id，导致 jsonify 报 ObjectId 不可序列化
         # 这里将用于返回的 records 与实际插入的 docs 分离，避免原地突变
         records: List[Dict[str, Any]] = []  # 用于返回（无 _id）
         docs: List[Dict[str, Any]] = []     # 实际插入（可能被 pymongo 添加 _id）
         for i, label in enumerate(labels):
             doc = {
-                "label_id": base + i,
+                "label_id": label_ids[i],
                 "label_name": label.get('name'),
                 "category": label.get('category', '病理学'),
                 "dataset_id": dataset_id
@@ -33,16 +39,13 @@ class LabelService:
             records.append(doc.copy())  # 拷贝一份用于返回，避免被 insert_many 原地添加 _id
         if docs:
             self.db.labels.insert_many(docs)
+            label_catalog.bump(dataset_id)
         return records
 
     def list(self, dataset_id: Optional[int]) -> List[Dict[str, Any]]:
         self.ensure_db()
-        if dataset_id is not None:
-            data = list(self.db.labels.find({"dataset_id": dataset_id}, {"_id": 0}))
-            if not data:  # fallback to common labels
-                data = list(self.db.labels.find({"dataset_id": {"$exists": False}}, {"_id": 0}))
-        else:
-            data = list(self.db.labels.find({}, {"_id": 0}))
+        # 数据集专属标签，无则回退通用标签；dataset_id 为空时为全部标签（版本化目录缓存）
+        data = label_catalog.labels(dataset_id)
         # normalize
         out = []
         for label in data:
@@ -56,28 +59,94 @@ class LabelService:
 
     def get_dataset_labels(self, dataset_id: int) -> List[Dict[str, Any]]:
         self.ensure_db()
-        labels = list(self.db.labels.find({"dataset_id": dataset_id}, {"_id": 0}))
-        if not labels:
-            labels = list(self.db.labels.find({"dataset_id": None}, {"_id": 0}))
-        return labels
+        return label_catalog.labels(dataset_id)
+
+    REMAP_BATCH = 1000
+
+    def update_dataset_labels(self, dataset_id: int, labels: List[Dict[str, Any]]) -> Dict[str, int]:
+        """按差异更新数据集标签：保留不变的、原地改名/改类别、只插入新增、只删除移除的。
 
-    def update_dataset_labels(self, dataset_id: int, labels: List[Dict[str, Any]]) -> int:
+        请求项按 label_id（属于本数据集时）匹配，否则按名称匹配未被占用的现有标签；
+        未匹配的请求项为新增，未被匹配的现有标签为删除。已有标注引用的 ID 因此保持不变。
+        数据集此前使用全局回退标签时，新建的同名专属标签会获得新 ID，
+        该数据集标注中的旧 ID 以批量 bulk_write 重映射。
+        """
         self.ensure_db()
-        self.db.labels.delete_many({"dataset_id": dataset_id})
-        if not labels:
-            return 0
-        base = self._next_label_id_base()
-        records = []
-        for i, label in enumerate(labels):
-            records.append({
-                "label_id": base + i,
-                "label_name": label.get('name'),
-                "category": label.get('category', '病理学'),
-                "dataset_id": dataset_id
-            })
-        if records:
-            self.db.labels.insert_many(records)
-        return len(labels)
+        current = sorted(self.db.labels.find({"dataset_id": dataset_id}, {"_id": 0}),
+                         key=lambda l: l.get('label_id') or 0)
+        by_id = {l.get('label_id'): l for l in current}
+        matched: Dict[Any, Dict[str, Any]] = {}
+        ops: List[Any] = []
+        new_items: List[Dict[str, Any]] = []
+        counts = {"kept": 0, "renamed": 0, "inserted": 0, "deleted": 0, "remapped_annotations": 0}
+        for item in labels:
+            name = item.get('name') or item.get('label_name')
+            category = item.get('category', '病理学')
+            lid = item.get('label_id')
+            old = by_id.get(lid) if lid not in matched else None
+            if old is None:
+                old = next((l for l in current if l.get('label_name') == name and l.get('label_id') not in matched), None)
+            if old is None:
+                new_items.append({"label_name": name, "category": category})
+                continue
+            matched[old.get('label_id')] = old
+            if old.get('label_name') == name and old.get('category', '病理学') == category:
+                counts["kept"] += 1
+            else:
+                ops.append(UpdateOne({"label_id": old.get('label_id'), "dataset_id": dataset_id},
+                                     {"$set": {"label_name": name, "category": category}}))
+                counts["renamed"] += 1
+        removed = [l.get('label_id') for l in current if l.get('label_id') not in matched]
+        if removed:
+            ops.append(DeleteMany({"dataset_id": dataset_id, "label_id": {"$in": removed}}))
+            counts["deleted"] = len(removed)
+        inserted: List[Dict[str, Any]] = []
+        if new_items:
+            label_ids = self._allocate_label_ids(len(new_items))
+            for label_id, item in zip(label_ids, new_items):
+                inserted.append({"label_id": label_id, "dataset_id": dataset_id, **item})
+            ops.extend(InsertOne(dict(doc)) for doc in inserted)
+            counts["inserted"] = len(inserted)
+        # 数据集此前无专属标签（使用全局回退）：旧全局 ID -> 同名新 ID
+        remap: Dict[Any, Any] = {}
+        if not current and inserted:
+            new_by_name = {doc['label_name']: doc['label_id'] for doc in inserted}
+            for fallback in label_catalog.labels(dataset_id):
+                new_id = new_by_name.get(fallback.get('label_name'))
+                if new_id is not None and fallback.get('label_id') != new_id:
+                    remap[fallback.get('label_id')] = new_id
+        if ops:
+            self.db.labels.bulk_write(ops, ordered=True)
+        if remap:
+            counts["remapped_annotations"] = self._remap_annotation_labels(dataset_id, remap)
+        label_catalog.bump(dataset_id)
+        counts["total"] = counts["kept"] + counts["renamed"] + counts["inserted"]
+        return counts
+
+    def _remap_annotation_labels(self, dataset_id: int, remap: Dict[Any, Any]) -> int:
+        """按 remap 改写该数据集标注的 label_id / label_ids，按 REMAP_BATCH 分批 bulk_write。"""
+        old_ids = list(remap.keys())
+        cursor = self.db.annotations.find(
+            {"dataset_id": dataset_id, "$or": [{"label_id": {"$in": old_ids}}, {"label_ids": {"$in": old_ids}}]},
+            {"_id": 1, "label_id": 1, "label_ids": 1}
+        ).batch_size(self.REMAP_BATCH)
+        modified = 0
+        batch: List[UpdateOne] = []
+        for ann in cursor:
+            update: Dict[str, Any] = {}
+            if ann.get('label_id') in remap:
+                update['label_id'] = remap[ann['label_id']]
+            if isinstance(ann.get('label_ids'), list) and any(x in remap for x in ann['label_ids']):
+                update['label_ids'] = [remap.get(x, x) for x in ann['label_ids']]
+            if update:
+                # changed_at 为增量导出的服务端变更标记
+                batch.append(UpdateOne({"_id": ann['_id']}, {"$set": update, "$currentDate": {"changed_at": True}}))
+            if len(batch) >= self.REMAP_BATCH:
+                modified += self.db.annotations.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            modified += self.db.annotations.bulk_write(batch, ordered=False).modified_count
+        return modified
 
 label_service = LabelService()
 
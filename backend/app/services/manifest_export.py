@@ -0,0 +1,82 @@
+"""Training manifests for the segmentation pipeline (scripts/unet_kfold_hardminer.py).
+
+The manifest has one row per dataset image:
+
+    id,image_path,mask_path[,fold]
+
+``image_path`` is the on-disk file under ``UPLOAD_FOLDER`` (the DB stores the
+``static/img/<file>`` URL path) and ``mask_path`` follows the mask naming
+convention ``MASK_FOLDER/<image stem><MASK_SUFFIX>``. The backend does not store
+masks; rows whose mask file is missing are kept and the training script drops
+them when it checks paths.
+
+Fold assignment is deterministic: images are grouped by their label (the most
+frequent label among the selected annotations, smallest id on ties; unlabeled
+images form their own group), ordered inside each group by an MD5 of
+(seed, image_id), then dealt round-robin over k folds, continuing the count
+across groups so every fold gets each label in proportion and fold sizes differ
+by at most one. The same data and seed always give the same split.
+"""
+from __future__ import annotations
+import hashlib
+import os
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.services.image_store import relative_path
+from config import UPLOAD_FOLDER  # type: ignore
+
+MANIFEST_COLUMNS = ['id', 'image_path', 'mask_path']
+MANIFEST_MIMETYPE = 'text/csv; charset=utf-8'
+MASK_FOLDER = os.getenv('MASK_FOLDER') or os.path.join(UPLOAD_FOLDER, 'masks')
+MASK_SUFFIX = os.getenv('MASK_SUFFIX', '.png')
+MAX_FOLDS = 100
+
+
+def resolve_image_path(image_path: Optional[str], upload_folder: str = UPLOAD_FOLDER) -> str:
+    """DB 中的 static/img/<file>（或内容寻址的 static/img/ab/cd/<hash>.<ext>）映射到 UPLOAD_FOLDER 下的绝对路径。"""
+    if not image_path:
+        return ''
+    return os.path.abspath(os.path.join(upload_folder, *relative_path(image_path).split('/')))
+
+
+def resolve_mask_path(image_path: Optional[str], mask_folder: str = MASK_FOLDER, suffix: str = MASK_SUFFIX) -> str:
+    if not image_path:
+        return ''
+    stem = os.path.splitext(os.path.basename(str(image_path)))[0]
+    return os.path.abspath(os.path.join(mask_folder, stem + suffix))
+
+
+def stratum_label(labels: Iterable[Any]) -> Optional[int]:
+    """图片的分层标签：出现次数最多的 label_id，次数相同取较小者；无标签为 None。"""
+    counts = Counter(l for l in labels if l is not None)
+    if not counts:
+        return None
+    return min(counts, key=lambda l: (-counts[l], l))
+
+
+def _fold_key(seed: int, image_id: Any) -> str:
+    return hashlib.md5(f"{seed}:{image_id}".encode('utf-8')).hexdigest()
+
+
+def assign_folds(strata: Dict[Any, Optional[int]], k: int, seed: int = 42) -> Dict[Any, int]:
+    """image_id -> fold（0..k-1），按标签分层、组内按种子哈希排序后轮转分配。"""
+    if k < 2:
+        raise ValueError("折数至少为 2")
+    groups: Dict[Optional[int], List[Any]] = {}
+    for image_id, label in strata.items():
+        groups.setdefault(label, []).append(image_id)
+    folds: Dict[Any, int] = {}
+    n = 0
+    # None 组放在最后；组间继续计数使各折总数相差不超过 1
+    for label in sorted(groups, key=lambda l: (l is None, l if l is not None else 0)):
+        for image_id in sorted(groups[label], key=lambda i: _fold_key(seed, i)):
+            folds[image_id] = n % k
+            n += 1
+    return folds
+
+
+__all__ = [
+    'MANIFEST_COLUMNS', 'MANIFEST_MIMETYPE', 'MASK_FOLDER', 'MASK_SUFFIX', 'MAX_FOLDS',
+    'resolve_image_path', 'resolve_mask_path', 'stratum_label', 'assign_folds',
+]
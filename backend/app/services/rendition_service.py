@@ -0,0 +1,169 @@
+"""Thumbnail / preview renditions cached on disk.
+
+``/api/images/<id>/render?size=thumb|preview`` returns a WebP (or JPEG for
+clients that do not accept WebP) no larger than 256 / 1024 px on the long
+side. Renditions are produced lazily by the image process pool and cached as
+
+    RENDITION_CACHE_DIR/<key[:2]>/<key>_<px>.<ext>
+
+where ``key`` is the image's content hash (or a hash of its stored path for
+images uploaded before content addressing). Source bytes behind a key never
+change, so cached files are never stale; concurrent requests for the same
+rendition in one process share a single render. The directory is kept under
+``RENDITION_CACHE_MAX_BYTES`` by evicting least recently used files (hits touch
+the file's mtime).
+
+    RENDITION_CACHE_DIR        default <tmp>/medc_renditions
+    RENDITION_CACHE_MAX_BYTES  default 2 GiB
+    RENDITION_TIMEOUT          seconds to wait for a render (default 60)
+    RENDITION_ON_UPLOAD        1 = queue thumb + preview right after upload
+"""
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+import imaging  # type: ignore
+from app.core import process_pool
+from app.core.cache import SingleFlight
+
+SIZES = {'thumb': 256, 'preview': 1024}
+FORMATS = {'webp': ('webp', 'image/webp'), 'jpeg': ('jpg', 'image/jpeg')}
+CACHE_DIR = os.environ.get('RENDITION_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'medc_renditions')
+CACHE_MAX_BYTES = int(os.environ.get('RENDITION_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+RENDER_TIMEOUT = float(os.environ.get('RENDITION_TIMEOUT', '60'))
+RENDER_ON_UPLOAD = os.environ.get('RENDITION_ON_UPLOAD', '0') in ('1', 'true', 'True')
+
+
+def source_key(image: Dict[str, Any]) -> str:
+    """缓存键：内容哈希；历史图片用存储路径的哈希（其文件名含 uuid，不会被覆盖）。"""
+    return image.get('content_hash') or hashlib.sha256(str(image.get('image_path', '')).encode('utf-8')).hexdigest()
+
+
+class RenditionService:
+    SWEEP_EVERY = 64
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._renders = 0
+        self._counters = {'hits': 0, 'renders': 0, 'evictions': 0}
+
+    # --- Parameters ---
+    @staticmethod
+    def parse_size(value: Optional[str]) -> int:
+        value = (value or 'thumb').lower()
+        if value in SIZES:
+            return SIZES[value]
+        if value.isdigit() and int(value) in SIZES.values():
+            return int(value)
+        raise ValueError(f"size 仅支持 {', '.join(SIZES)} 或 {', '.join(str(v) for v in SIZES.values())}")
+
+    @staticmethod
+    def negotiate(fmt: Optional[str], accept: str = '') -> str:
+        if fmt:
+            fmt = fmt.lower().replace('jpg', 'jpeg')
+            if fmt not in FORMATS:
+                raise ValueError(f"format 仅支持 {', '.join(FORMATS)}")
+            return fmt
+        return 'webp' if 'image/webp' in (accept or '') else 'jpeg'
+
+    def cache_path(self, key: str, px: int, fmt: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}_{px}.{FORMATS[fmt][0]}")
+
+    # --- Render ---
+    def render(self, image: Dict[str, Any], px: int, fmt: str) -> str:
+        """返回渲染结果的路径（命中磁盘缓存直接返回，否则在进程池中生成）。
+
+        image 需含 path（源文件绝对路径）与 content_hash / image_path。
+        """
+        path = self.cache_path(source_key(image), px, fmt)
+        if os.path.exists(path):
+            self._touch(path)
+            self._counters['hits'] += 1
+            return path
+
+        def build() -> str:
+            if os.path.exists(path):
+                return path
+            if not os.path.isfile(image['path']):
+                raise FileNotFoundError(image['path'])
+            process_pool.submit(imaging.render, image['path'], path, px, fmt).result(timeout=RENDER_TIMEOUT)
+            self._counters['renders'] += 1
+            self._after_write()
+            return path
+
+        return self._flight.do(path, build)
+
+    def warm(self, images: Iterable[Dict[str, Any]], fmt: str = 'webp') -> int:
+        """上传后预生成全部尺寸（不等待结果），返回提交的任务数。"""
+        submitted = 0
+        for image in images:
+            for px in SIZES.values():
+                path = self.cache_path(source_key(image), px, fmt)
+                if os.path.exists(path) or not os.path.isfile(image['path']):
+                    continue
+                future = process_pool.submit(imaging.render, image['path'], path, px, fmt)
+                future.add_done_callback(self._log_failure)
+                submitted += 1
+        return submitted
+
+    @staticmethod
+    def _log_failure(future) -> None:
+        if future.exception() is not None:
+            logging.warning(f"预生成缩略图失败: {future.exception()}")
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        try:
+            os.utime(path)
+        except OSError:  # pragma: no cover - 并发清理
+            pass
+
+    def _after_write(self) -> None:
+        with self._lock:
+            self._renders += 1
+            due = self._renders % self.SWEEP_EVERY == 0
+        if due:
+            self.sweep()
+
+    # --- Cache maintenance ---
+    def sweep(self) -> int:
+        """超出体积预算时按 mtime（最近访问）淘汰到预算的 90%，返回删除文件数。"""
+        files = []
+        for shard in os.scandir(self.cache_dir) if os.path.isdir(self.cache_dir) else ():
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(f[1] for f in files)
+        if total <= self.max_bytes:
+            return 0
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        self._counters['evictions'] += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, 'cache_dir': self.cache_dir, 'max_bytes': self.max_bytes}
+
+
+rendition_service = RenditionService()
+
+__all__ = ['rendition_service', 'RenditionService', 'source_key', 'SIZES', 'FORMATS', 'RENDER_ON_UPLOAD']
@@ -0,0 +1,211 @@
+"""Deep-zoom (DZI) tile pyramids for large images.
+
+Pathology slides and high-resolution radiographs are too large to load whole in
+the annotator; a deep-zoom viewer fetches only the tiles in view:
+
+    GET /api/images/<id>/tiles                      DZI descriptor (JSON)
+    GET /api/images/<id>/tiles/<level>/<x>_<y>[.webp|.jpg]
+
+Pyramids are built lazily and memoized on disk, one directory per source:
+
+    TILE_CACHE_DIR/<key[:2]>/<key>/info.json             size, tile size, overlap, window
+    TILE_CACHE_DIR/<key[:2]>/<key>/<level>/<x>_<y>.<ext>
+
+``info.json`` is written on first access (one header read, plus a full pass for
+16-bit sources to fix the stretch window shared by all tiles); each tile is
+rendered the first time it is requested, in the image process pool, reading
+only the region it covers where the format allows (see backend/imaging.py).
+``key`` is the same content key as renditions, so cached tiles are never stale.
+Whole pyramids are evicted least recently used first (every tile request
+touches ``info.json``) to keep the directory under ``TILE_CACHE_MAX_BYTES``.
+
+    TILE_CACHE_DIR         default <tmp>/medc_tiles
+    TILE_CACHE_MAX_BYTES   default 10 GiB
+    TILE_SIZE              tile edge in px without overlap (default 254)
+    TILE_TIMEOUT           seconds to wait for a describe / tile render (default 60)
+"""
+from __future__ import annotations
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import imaging  # type: ignore
+from app.core import process_pool
+from app.core.cache import SingleFlight
+from app.services.rendition_service import FORMATS, source_key
+
+CACHE_DIR = os.environ.get('TILE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'medc_tiles')
+CACHE_MAX_BYTES = int(os.environ.get('TILE_CACHE_MAX_BYTES', str(10 * 1024 ** 3)))
+TILE_SIZE = int(os.environ.get('TILE_SIZE', '254'))
+TILE_OVERLAP = 1
+TILE_TIMEOUT = float(os.environ.get('TILE_TIMEOUT', '60'))
+DZI_XMLNS = 'http://schemas.microsoft.com/deepzoom/2008'
+_TILE_NAME = re.compile(r'^(\d+)_(\d+)(?:\.(\w+))?$')
+_EXT_FORMATS = {**{ext: fmt for fmt, (ext, _) in FORMATS.items()}, 'jpeg': 'jpeg'}
+
+
+class TileService:
+    SWEEP_EVERY = 256
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES,
+                 tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._renders = 0
+        self._counters = {'hits': 0, 'renders': 0, 'described': 0, 'evictions': 0}
+
+    # --- Parameters ---
+    @staticmethod
+    def parse_tile(name: str) -> Tuple[int, int, Optional[str]]:
+        """'<x>_<y>[.ext]' -> (x, y, format 或 None)。"""
+        m = _TILE_NAME.match(name or '')
+        if not m:
+            raise ValueError("瓦片名应为 <x>_<y> 或 <x>_<y>.webp|jpg")
+        ext = (m.group(3) or '').lower()
+        if ext and ext not in _EXT_FORMATS:
+            raise ValueError(f"瓦片格式仅支持 {', '.join(_EXT_FORMATS)}")
+        return int(m.group(1)), int(m.group(2)), _EXT_FORMATS.get(ext)
+
+    def pyramid_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def tile_path(self, key: str, level: int, col: int, row: int, fmt: str) -> str:
+        return os.path.join(self.pyramid_dir(key), str(level), f"{col}_{row}.{FORMATS[fmt][0]}")
+
+    # --- Descriptor ---
+    def describe(self, image: Dict[str, Any]) -> Dict[str, Any]:
+        """金字塔元数据 {width, height, tile_size, overlap, max_level, window}；首次访问时在进程池中读取并落盘。"""
+        key = source_key(image)
+        info_path = os.path.join(self.pyramid_dir(key), 'info.json')
+        info = self._read_info(info_path)
+        if info is not None:
+            return info
+
+        def build() -> Dict[str, Any]:
+            cached = self._read_info(info_path)
+            if cached is not None:
+                return cached
+            if not os.path.isfile(image['path']):
+                raise FileNotFoundError(image['path'])
+            meta = process_pool.submit(imaging.describe, image['path']).result(timeout=TILE_TIMEOUT)
+            meta.update(tile_size=self.tile_size, overlap=self.overlap,
+                        max_level=imaging.dzi_max_level(meta['width'], meta['height']))
+            self._write_info(info_path, meta)
+            self._counters['described'] += 1
+            return meta
+
+        return self._flight.do(info_path, build)
+
+    @staticmethod
+    def _read_info(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+            os.utime(path)  # 金字塔级 LRU：每次访问刷新 mtime
+            return info
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_info(path: str, info: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.info_')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(tmp, path)
+
+    def dzi(self, info: Dict[str, Any], tiles_url: str, fmt: str) -> Dict[str, Any]:
+        """DZI 描述（JSON 形式，OpenSeadragon 可直接使用：瓦片地址为 Url + level/x_y.Format）。"""
+        return {'Image': {
+            'xmlns': DZI_XMLNS,
+            'Url': tiles_url,
+            'Format': FORMATS[fmt][0],
+            'Overlap': str(info['overlap']),
+            'TileSize': str(info['tile_size']),
+            'Size': {'Width': str(info['width']), 'Height': str(info['height'])},
+        }}
+
+    # --- Tiles ---
+    def tile(self, image: Dict[str, Any], level: int, col: int, row: int, fmt: str) -> str:
+        """返回瓦片路径（已生成直接返回，否则在进程池中按区域生成）；坐标越界抛 IndexError。"""
+        info = self.describe(image)
+        imaging.dzi_tile_box(info['width'], info['height'], level, col, row, info['tile_size'], info['overlap'])
+        path = self.tile_path(source_key(image), level, col, row, fmt)
+        if os.path.exists(path):
+            self._counters['hits'] += 1
+            return path
+
+        def build() -> str:
+            if os.path.exists(path):
+                return path
+            if not os.path.isfile(image['path']):
+                raise FileNotFoundError(image['path'])
+            window = tuple(info['window']) if info.get('window') else None
+            process_pool.submit(
+                imaging.render_tile, image['path'], path, info['width'], info['height'],
+                level, col, row, info['tile_size'], info['overlap'], fmt, window,
+            ).result(timeout=TILE_TIMEOUT)
+            self._counters['renders'] += 1
+            self._after_write()
+            return path
+
+        return self._flight.do(path, build)
+
+    def _after_write(self) -> None:
+        with self._lock:
+            self._renders += 1
+            due = self._renders % self.SWEEP_EVERY == 0
+        if due:
+            self.sweep()
+
+    # --- Cache maintenance ---
+    def sweep(self) -> int:
+        """超出体积预算时按 info.json 的 mtime（最近访问）整体淘汰金字塔到预算的 90%，返回删除的金字塔数。"""
+        pyramids = []
+        for shard in os.scandir(self.cache_dir) if os.path.isdir(self.cache_dir) else ():
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir():
+                    continue
+                size = 0
+                for root, _, files in os.walk(entry.path):
+                    for name in files:
+                        try:
+                            size += os.path.getsize(os.path.join(root, name))
+                        except OSError:
+                            pass
+                try:
+                    used = os.path.getmtime(os.path.join(entry.path, 'info.json'))
+                except OSError:
+                    used = entry.stat().st_mtime
+                pyramids.append((used, size, entry.path))
+        total = sum(p[1] for p in pyramids)
+        if total <= self.max_bytes:
+            return 0
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in sorted(pyramids):
+            if total <= target:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        self._counters['evictions'] += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, 'cache_dir': self.cache_dir, 'max_bytes': self.max_bytes}
+
+
+tile_service = TileService()
+
+__all__ = ['tile_service', 'TileService', 'TILE_SIZE', 'TILE_OVERLAP']
@@ -17,6 +17,7 @@ MONGO_DB = os.getenv('MONGODB_DB', 'medical_annotation')
 # 文件上传配置
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'app/static/img')
 MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB
+UPLOAD_WORKERS = max(1, int(os.getenv('UPLOAD_WORKERS', 8)))  # 批量上传并行写盘线程数
 
 # Flask配置
 FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
@@ -2,7 +2,7 @@
 """
 MongoDB数据库工具脚本
 - 数据库清理功能
-- 自增序列管理
+- 自增序列管理（含 hi/lo 分段分配器 SequenceBlockAllocator）
 - 序列状态检查
 """
 
@@ -104,6 +104,131 @@ def get_next_sequence_value(db, sequence_name):
     )
     return sequence_doc['sequence_value']
 
+class SequenceBlockAllocator:
+    """hi/lo 分段序列分配器（每个 worker 进程一份缓存）
+    
+    每次向 sequences 集合用一次 $inc 领取 block_size 个连续值（hi），
+    随后在进程内逐个发放（lo），把 sequences 文档上的写热点降为 1/block_size。
+    
+    每个序列一把锁：补充区间的数据库往返只阻塞同一序列的调用方，
+    其它序列照常从本地区间发放；全局锁只保护锁表与计数，不跨越网络往返。
+    
+    容忍空洞（gap-tolerant）约定：
+      - 分配的值全局唯一，但不保证连续，也不保证跨进程按时间单调递增；
+      - 进程重启/退出时未用完的区间直接丢弃，不回收；
+      - 调用方不得依赖 “值 = 已有记录数” 或 “最大值 = 最新记录”。
+    
+    fork 安全：检测到 pid 变化（如 gunicorn preload 后 fork）时丢弃继承来的区间和锁。
+    """
+    
+    def __init__(self, block_size=None, block_sizes=None):
+        self.block_size = int(block_size or os.getenv('SEQUENCE_BLOCK_SIZE', 1000))
+        # 按序列覆盖块大小，例如 {"labels_id": 10}
+        self.block_sizes = dict(block_sizes or {})
+        self._lock = threading.Lock()
+        self._key_locks = {}  # (db_name, sequence_name) -> threading.Lock
+        self._blocks = {}  # (db_name, sequence_name) -> [next_value, last_value]
+        self._pid = os.getpid()
+        self._round_trips = 0
+        self._issued = 0
+    
+    def _block_size_for(self, sequence_name):
+        return max(int(self.block_sizes.get(sequence_name, self.block_size)), 1)
+    
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._blocks.clear()
+            self._key_locks.clear()
+    
+    def _key_lock(self, key):
+        with self._lock:
+            self._check_fork()
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+    
+    def take(self, db, sequence_name, count=1):
+        """
+        分配 count 个序列值（优先使用本地区间，不足时一次 $inc 补充）
+        
+        Returns:
+            list[int]: 升序、唯一的序列值（跨区间时可能不连续）
+        """
+        if count <= 0:
+            return []
+        key = (db.name, sequence_name)
+        values = []
+        round_trips = 0
+        with self._key_lock(key):
+            while len(values) < count:
+                block = self._blocks.get(key)
+                if not block or block[0] > block[1]:
+                    size = max(self._block_size_for(sequence_name), count - len(values))
+                    first = reserve_sequence_block(db, sequence_name, size)
+                    round_trips += 1
+                    block = [first, first + size - 1]
+                    with self._lock:
+                        self._blocks[key] = block
+                n = min(count - len(values), block[1] - block[0] + 1)
+                values.extend(range(block[0], block[0] + n))
+                block[0] += n
+        with self._lock:
+            self._round_trips += round_trips
+            self._issued += count
+        return values
+    
+    def next_value(self, db, sequence_name):
+        """分配单个序列值（get_next_sequence_value 的分段版本）"""
+        return self.take(db, sequence_name, 1)[0]
+    
+    def discard(self, db=None, sequence_name=None):
+        """丢弃本地缓存区间（序列被外部重置后调用；等待进行中的补充完成后再丢弃）"""
+        with self._lock:
+            keys = [k for k in self._key_locks
+                    if (db is None or k[0] == db.name) and (sequence_name is None or k[1] == sequence_name)]
+        for key in keys:
+            with self._key_lock(key):
+                with self._lock:
+                    self._blocks.pop(key, None)
+    
+    def metrics(self):
+        """分配指标：ids_issued / round_trips / round_trips_saved"""
+        with self._lock:
+            return {
+                "block_size": self.block_size,
+                "block_sizes": dict(self.block_sizes),
+                "ids_issued": self._issued,
+                "round_trips": self._round_trips,
+                "round_trips_saved": self._issued - self._round_trips,
+                "cached_blocks": {
+                    f"{k[0]}.{k[1]}": max(v[1] - v[0] + 1, 0) for k, v in self._blocks.items()
+                }
+            }
+
+def reserve_sequence_block(db, sequence_name, count):
+    """
+    一次原子操作预留连续的 count 个序列值
+    
+    Args:
+        db: MongoDB数据库连接
+        sequence_name: 序列名称
+        count: 需要预留的数量（>0）
+    
+    Returns:
+        int: 预留区间的第一个值，区间为 [first, first + count - 1]
+    """
+    if count <= 0:
+        raise ValueError("count 必须大于 0")
+    sequence_doc = db.sequences.find_one_and_update(
+        {"_id": sequence_name},
+        {"$inc": {"sequence_value": count}},
+        return_document=True,
+        upsert=True
+    )
+    return sequence_doc['sequence_value'] - count + 1
+
 def get_next_annotation_id(db):
     """
     获取下一个标注记录ID (保留旧函数，内部调用新函数)
@@ -116,6 +241,10 @@ def get_next_annotation_id(db):
     """
     return get_next_sequence_value(db, "annotations_record_id")
 
+# 进程级分配器（上传 / 标注 / 标签创建共用）
+# 标签创建低频且 ID 对管理员可见：按请求大小领取，避免 ID 大幅跳号
+sequence_allocator = SequenceBlockAllocator(block_sizes={"labels_id": 1})
+
 def cleanup_database():
     """清理数据库中的重复记录并设置自增序列"""
     print("=== 数据库清理和自增序列设置 ===")
@@ -167,9 +296,10 @@ def cleanup_database():
             "_id": "annotations_record_id",
             "sequence_value": current_max
         }
+        # 使用 $max：序列只前进不回退，避免与各 worker 已领取的分段区间重叠
         db.sequences.update_one(
             {"_id": "annotations_record_id"},
-            {"$set": {"sequence_value": current_max}},
+            {"$max": {"sequence_value": current_max}},
             upsert=True
         )
         print(f"   创建或更新序列集合，当前值: {current_max}")
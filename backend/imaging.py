@@ -0,0 +1,191 @@
+"""Pillow helpers executed in the image process pool.
+
+Only plain arguments (paths, ints, strings) cross the process boundary and
+nothing here touches the DB or Flask, so web workers never decode pixels. The
+module sits next to config.py rather than inside ``app`` so that spawned pool
+workers import only Pillow and this file, not the whole application.
+Results are written to a temp path next to the destination and moved into place
+with ``os.replace``; concurrent renders of the same file simply overwrite each
+other with identical bytes.
+
+Medical sources are often 16-bit grayscale; they are window-stretched to 8 bit
+(min..max) before resampling. JPEG sources use ``draft`` so the decoder scales
+down in the DCT domain and reads far less than the full image.
+
+Deep-zoom tiles follow the DZI layout: level ``max_level`` is the full image,
+each level below halves it (rounding up) down to 1x1 at level 0, and tiles are
+``tile_size`` px plus ``overlap`` on interior edges. ``render_tile`` reads only
+the region it needs where the format allows: TIFF / raw files stored in
+tiles or strips decode just the intersecting blocks, JPEG decodes at the
+coarsest DCT scale the level permits. Other formats are decoded whole once and
+the last decoded image is kept in the pool process, so the next tiles of the
+same image only resample.
+"""
+from __future__ import annotations
+import os
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True},
+}
+
+
+def _pil():
+    try:
+        from PIL import Image, ImageOps  # type: ignore
+    except ImportError as e:  # pragma: no cover - depends on deployment
+        raise RuntimeError("图片渲染需要安装 Pillow") from e
+    return Image, ImageOps
+
+
+WIDE_MODES = ('I;16', 'I;16B', 'I;16L', 'I', 'F')
+ORIENTATION = 0x0112
+
+
+def to_display_mode(img, window: Optional[Tuple[float, float]] = None):
+    """转为可编码为 8 位 WebP / JPEG 的模式（16 位 / 浮点灰度按 window 或自身 min..max 拉伸）。"""
+    Image, _ = _pil()
+    if img.mode in WIDE_MODES:
+        img = img.convert('I') if img.mode != 'F' else img
+        lo, hi = window or img.getextrema()
+        scale = 255.0 / (hi - lo) if hi > lo else 1.0
+        return img.point(lambda v: v * scale - lo * scale).convert('L')
+    if img.mode in ('L', 'RGB'):
+        return img
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return img.convert('RGB')
+
+
+def write_image(img, dst: str, fmt: str) -> int:
+    """原子写入 dst，返回文件字节数。"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.render_')
+    os.close(fd)
+    try:
+        img.save(tmp, **SAVE_OPTIONS[fmt])
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return os.path.getsize(dst)
+
+
+def render(src: str, dst: str, max_px: int, fmt: str) -> Tuple[int, int, int]:
+    """生成长边不超过 max_px 的缩略图 / 预览图，返回 (宽, 高, 字节数)。"""
+    Image, ImageOps = _pil()
+    with Image.open(src) as img:
+        if img.format == 'JPEG':
+            img.draft('RGB' if img.mode != 'L' else 'L', (max_px, max_px))
+        img = ImageOps.exif_transpose(img)
+        img = to_display_mode(img)
+        img.thumbnail((max_px, max_px), Image.LANCZOS, reducing_gap=3.0)
+        size = write_image(img, dst, fmt)
+        return img.width, img.height, size
+
+
+# --- Deep zoom (DZI) ---
+def dzi_max_level(width: int, height: int) -> int:
+    """最高层级 ceil(log2(长边))；该层为原图。"""
+    return (max(width, height, 1) - 1).bit_length()
+
+
+def dzi_level_size(width: int, height: int, level: int) -> Tuple[int, int]:
+    scale = 1 << (dzi_max_level(width, height) - level)
+    return -(-width // scale), -(-height // scale)
+
+
+def dzi_tile_box(width: int, height: int, level: int, col: int, row: int,
+                 tile_size: int, overlap: int) -> Tuple[int, int, int, int]:
+    """该层坐标系下瓦片的范围 (x0, y0, x1, y1)，含内侧重叠；越界抛 IndexError。"""
+    if not 0 <= level <= dzi_max_level(width, height):
+        raise IndexError(level)
+    lw, lh = dzi_level_size(width, height, level)
+    if col < 0 or row < 0 or col * tile_size >= lw or row * tile_size >= lh:
+        raise IndexError((col, row))
+    x0 = col * tile_size - (overlap if col else 0)
+    y0 = row * tile_size - (overlap if row else 0)
+    return x0, y0, min(lw, (col + 1) * tile_size + overlap), min(lh, (row + 1) * tile_size + overlap)
+
+
+def describe(src: str) -> Dict[str, Any]:
+    """瓦片金字塔的源信息：按 EXIF 方向校正后的宽高；高位深灰度另给全图拉伸窗口（瓦片间对比度一致）。"""
+    Image, _ = _pil()
+    with Image.open(src) as img:
+        width, height = img.size
+        if img.getexif().get(ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        window = None
+        if img.mode in WIDE_MODES:
+            window = list((img.convert('I') if img.mode != 'F' else img).getextrema())
+        return {'width': width, 'height': height, 'window': window}
+
+
+# 池进程内最近一次整图解码的结果：{(src, mtime_ns, 降采样倍数): 显示模式图像}
+_decoded: Dict[Tuple[str, int, int], Any] = {}
+
+
+def _block_region(img, box: Tuple[int, int, int, int]):
+    """按块 / 条存储的文件只解码与 box 相交的块；不适用时返回 None。"""
+    tiles = getattr(img, 'tile', None) or []
+    if len(tiles) < 2 or img.format == 'JPEG' or any(t[1] is None for t in tiles):
+        return None
+    if img.getexif().get(ORIENTATION, 1) != 1:
+        return None
+    x0, y0, x1, y1 = box
+    img.tile = [t for t in tiles if t[1][0] < x1 and t[1][2] > x0 and t[1][1] < y1 and t[1][3] > y0]
+    return img.crop(box)
+
+
+def _decoded_image(src: str, scale: int, window):
+    """整图解码（JPEG 按 scale 走 DCT 降采样）并缓存最近一张，返回显示模式图像。"""
+    Image, ImageOps = _pil()
+    reduce = 1
+    img = Image.open(src)
+    if img.format == 'JPEG' and scale > 1:
+        reduce = min(8, 1 << (scale.bit_length() - 1))
+    key = (os.path.abspath(src), os.stat(src).st_mtime_ns, reduce)
+    if key in _decoded:
+        img.close()
+        return _decoded[key]
+    if reduce > 1:
+        img.draft('RGB' if img.mode != 'L' else 'L', (-(-img.width // reduce), -(-img.height // reduce)))
+    img.load()
+    if img.getexif().get(ORIENTATION, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+    _decoded.clear()  # 只保留一张，限制池进程内存
+    _decoded[key] = to_display_mode(img, window)
+    return _decoded[key]
+
+
+def render_tile(src: str, dst: str, width: int, height: int, level: int, col: int, row: int,
+                tile_size: int, overlap: int, fmt: str, window: Optional[Tuple[float, float]] = None) -> int:
+    """生成 DZI 瓦片 level/col_row 写入 dst，返回字节数；width / height 为 describe 的结果。"""
+    Image, _ = _pil()
+    x0, y0, x1, y1 = dzi_tile_box(width, height, level, col, row, tile_size, overlap)
+    scale = 1 << (dzi_max_level(width, height) - level)
+    box = (x0 * scale, y0 * scale, min(width, x1 * scale), min(height, y1 * scale))
+    size = (x1 - x0, y1 - y0)
+    with Image.open(src) as img:
+        region = _block_region(img, box)
+    if region is not None:
+        region = to_display_mode(region, window)
+        tile = region.resize(size, Image.LANCZOS, reducing_gap=3.0) if region.size != size else region
+    else:
+        full = _decoded_image(src, scale, window)
+        fx, fy = full.width / width, full.height / height
+        tile = full.resize(size, Image.LANCZOS, box=(box[0] * fx, box[1] * fy, box[2] * fx, box[3] * fy),
+                           reducing_gap=3.0)
+    return write_image(tile, dst, fmt)
+
+
+__all__ = [
+    'render', 'write_image', 'to_display_mode', 'SAVE_OPTIONS',
+    'describe', 'render_tile', 'dzi_max_level', 'dzi_level_size', 'dzi_tile_box',
+]
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+基准测试：图片-标注哈希 join（app/services/annotation_join.py）
+验证 1k -> 500k 图片规模下耗时线性增长，并与旧的 O(images × annotations) 写法对比
+
+用法：
+    python manual_tests/bench_annotation_join.py [--sizes 1000,10000,100000,500000] [--repeat 3]
+"""
+
+import os
+import time
+import random
+import argparse
+import gc
+import importlib.util
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 直接按文件加载模块，避免导入 app 包时触发数据库连接与蓝图注册
+_spec = importlib.util.spec_from_file_location(
+    'annotation_join', os.path.join(BACKEND_DIR, 'app', 'services', 'annotation_join.py')
+)
+annotation_join = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(annotation_join)
+
+
+def make_data(n_images, annotated_ratio=0.5, n_labels=20):
+    images = [{'image_id': i, 'image_path': f'static/img/{i:08d}.png'} for i in range(1, n_images + 1)]
+    annotated = random.Random(n_images).sample(range(1, n_images + 1), int(n_images * annotated_ratio))
+    annotations = [
+        {'dataset_id': 1, 'image_id': iid, 'expert_id': 'bench', 'label_id': iid % n_labels + 1}
+        for iid in annotated
+    ]
+    labels_dict = {i: f'label_{i}' for i in range(1, n_labels + 1)}
+    return images, annotations, labels_dict
+
+
+def quadratic_join(images, annotations, labels_dict):
+    """旧实现：在图片循环内线性查找标注。"""
+    result = []
+    for img in images:
+        ann = next((a for a in annotations if a.get('image_id') == img.get('image_id')), None)
+        if ann and ann.get('label_id'):
+            ann['label_name'] = labels_dict.get(ann['label_id'], '')
+            ann['label'] = ann.get('label_id')
+        result.append({'image_id': img.get('image_id'), 'annotation': ann})
+    return result
+
+
+def timed(fn, repeat):
+    # 与 timeit 一致：计时期间关闭 GC，避免分代回收扫描大量存活对象造成非线性噪声
+    best = float('inf')
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='annotation join 基准测试')
+    parser.add_argument('--sizes', default='1000,10000,100000,500000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quadratic-max', type=int, default=5000, help='旧写法仅在不超过该规模时对比')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    print("=== annotation join 基准测试 ===")
+    print(f"{'images':>10} {'hash join(s)':>14} {'ns/image':>10} {'quadratic(s)':>14}")
+    baseline = None
+    for n in sizes:
+        images, annotations, labels_dict = make_data(n)
+        t = timed(lambda: annotation_join.join_images(images, labels_dict, annotations=annotations), args.repeat)
+        per_item = t / n * 1e9
+        baseline = baseline or per_item
+        q = '-'
+        if n <= args.quadratic_max:
+            q = f"{timed(lambda: quadratic_join(images, annotations, labels_dict), 1):.3f}"
+        print(f"{n:>10} {t:>14.4f} {per_item:>10.0f} {q:>14}")
+    print(f"\n线性判定：单图耗时相对最小规模的比值应接近 1（最后一档 {per_item / baseline:.2f}x）")
+
+
+if __name__ == "__main__":
+    main()
@@ -181,6 +181,7 @@ def setup_database():
         ]
         
         result = db.annotations.insert_many(sample_annotations)
+        db.annotations.update_many({}, {"$currentDate": {"changed_at": True}})  # 增量导出的变更标记
         print(f"   ✅ 插入了 {len(result.inserted_ids)} 个示例标注")
 
         # 6. 初始化所有序列
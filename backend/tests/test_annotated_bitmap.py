@@ -0,0 +1,54 @@
+import pytest
+from app.repositories.annotated_bitmap_repository import AnnotatedBitmap, annotated_bitmap_repository
+from app.core.db import USE_DATABASE, get_db
+
+
+def test_bitmap_membership_count_and_first_missing():
+    bm = AnnotatedBitmap.from_ids([0, 63, 64, 100000])
+    assert 63 in bm and 64 in bm and 100000 in bm
+    assert 62 not in bm and None not in bm
+    assert bm.count() == 4
+    # 只存储非零字
+    assert sorted(bm.words) == [0, 1, 100000 // 64]
+    assert bm.first_missing([63, 0, 5, 64]) == 2
+    assert bm.first_missing([63, 64], start=10) is None
+
+
+@pytest.mark.skipif(not USE_DATABASE, reason="需要真实数据库环境")
+class TestAnnotatedBitmapRepository:
+    dataset_id = 999998
+
+    def setup_method(self):
+        self.db = get_db()
+        self.db.annotations.delete_many({'dataset_id': self.dataset_id})
+        annotated_bitmap_repository.clear(self.dataset_id)
+
+    def teardown_method(self):
+        self.db.annotations.delete_many({'dataset_id': self.dataset_id})
+        annotated_bitmap_repository.clear(self.dataset_id)
+
+    def test_rebuild_mark_and_persist_high_bit(self):
+        self.db.annotations.insert_one({'dataset_id': self.dataset_id, 'expert_id': 'bm', 'image_id': 5})
+        assert annotated_bitmap_repository.load(self.dataset_id, 'bm').count() == 1
+        annotated_bitmap_repository.mark(self.dataset_id, 'bm', [63, 127, 4096])
+        bm = annotated_bitmap_repository.load(self.dataset_id, 'bm')
+        assert [i in bm for i in (5, 63, 127, 4096, 6)] == [True, True, True, True, False]
+        annotated_bitmap_repository.clear(self.dataset_id, 'bm')
+        # 清除后重建只反映 annotations 中的真实数据
+        assert annotated_bitmap_repository.load(self.dataset_id, 'bm').count() == 1
+
+    def test_save_during_rebuild_scan_is_not_lost(self, monkeypatch):
+        self.db.annotations.insert_one({'dataset_id': self.dataset_id, 'expert_id': 'bm', 'image_id': 5})
+        from_ids = AnnotatedBitmap.from_ids
+
+        def save_after_scan(image_ids):
+            # 扫描已读完 annotations，此时另一请求保存图片 9 并置位
+            self.db.annotations.insert_one({'dataset_id': self.dataset_id, 'expert_id': 'bm', 'image_id': 9})
+            annotated_bitmap_repository.mark(self.dataset_id, 'bm', [9])
+            return from_ids(image_ids)
+
+        monkeypatch.setattr(AnnotatedBitmap, 'from_ids', staticmethod(save_after_scan))
+        annotated_bitmap_repository.rebuild(self.dataset_id, 'bm')
+        monkeypatch.undo()
+        bm = annotated_bitmap_repository.load(self.dataset_id, 'bm')
+        assert 5 in bm and 9 in bm and bm.count() == 2
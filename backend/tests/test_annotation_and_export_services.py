@@ -1,7 +1,11 @@
+import os
+from datetime import datetime, timedelta
 import pytest
 from app.services.annotation_service import annotation_service
 from app.services.export_service import export_service
+from app.services.dataset_service import dataset_service
 from app.core.db import USE_DATABASE, get_db
+from app.repositories import stable_order
 
 
 @pytest.mark.skipif(not USE_DATABASE, reason="需要真实数据库环境")
@@ -23,6 +27,8 @@ class TestAnnotationAndExportServices:
         # 清理测试数据 (不删除公共集合中的其它数据)
         self.db.annotations.delete_many({'dataset_id': self.dataset_id})
         self.db.image_datasets.delete_many({'dataset_id': self.dataset_id})
+        self.db.image_orders.delete_many({'dataset_id': self.dataset_id})
+        self.db.dataset_progress.delete_many({'dataset_id': self.dataset_id})
         # 图片和标签保留以避免并行测试删除其它用例需要的数据
 
     def test_save_and_update_annotation(self):
@@ -32,6 +38,14 @@ class TestAnnotationAndExportServices:
         r2 = annotation_service.update_annotation_fields(self.dataset_id, 80001, 'expert_py', 9001, tip='updated')
         assert r2['msg'] in ('updated', 'not found or not changed')  # 若实现判定无变化也可接受
 
+    def test_save_annotation_upsert_keeps_single_record(self):
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_upsert', 9001, tip='a')
+        first = self.db.annotations.find_one({'dataset_id': self.dataset_id, 'image_id': 80001, 'expert_id': 'expert_upsert'})
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_upsert', 9001, tip='b')
+        docs = list(self.db.annotations.find({'dataset_id': self.dataset_id, 'image_id': 80001, 'expert_id': 'expert_upsert'}))
+        assert len(docs) == 1
+        assert docs[0]['record_id'] == first['record_id'] and docs[0]['tip'] == 'b'
+
     def test_next_image_after_annotation(self):
         # 先保证一个未标注返回该图片
         first = annotation_service.next_image(self.dataset_id, 'expert_next')
@@ -41,6 +55,130 @@ class TestAnnotationAndExportServices:
         second = annotation_service.next_image(self.dataset_id, 'expert_next')
         assert second.get('msg') in ('done',)  # 所有已标注
 
+    def test_next_image_follows_stable_order(self):
+        # 追加多张图片：next_image 依次返回 MD5 种子打乱顺序中的图片（与历史实现一致）
+        extra = [80002, 80003, 80004, 80005]
+        for iid in extra:
+            if not self.db.images.find_one({'image_id': iid}):
+                self.db.images.insert_one({'image_id': iid, 'image_path': f'/tmp/pytest_image{iid}.png'})
+            self.db.image_datasets.insert_one({'dataset_id': self.dataset_id, 'image_id': iid})
+        ids = [d['image_id'] for d in self.db.images.find({'image_id': {'$in': [80001] + extra}}, {'_id': 0, 'image_id': 1})]
+        expected = stable_order(self.dataset_id, 'expert_order', ids)
+        # 乱序先标注顺序中的第二张，cursor 到达时应被跳过
+        annotation_service.save_annotation(self.dataset_id, expected[1], 'expert_order', 9001)
+        seen = []
+        while True:
+            nxt = annotation_service.next_image(self.dataset_id, 'expert_order')
+            if nxt.get('msg') == 'done':
+                break
+            seen.append(nxt['image_id'])
+            annotation_service.save_annotation(self.dataset_id, nxt['image_id'], 'expert_order', 9001)
+        assert seen == [expected[0]] + expected[2:]
+
+    def test_list_images_with_annotations_paginates_server_side(self):
+        extra = [80002, 80003, 80004]
+        for iid in extra:
+            if not self.db.images.find_one({'image_id': iid}):
+                self.db.images.insert_one({'image_id': iid, 'image_path': f'/tmp/pytest_image{iid}.png'})
+            self.db.image_datasets.insert_one({'dataset_id': self.dataset_id, 'image_id': iid})
+        annotation_service.save_annotation(self.dataset_id, 80003, 'expert_page', 9001)
+        pages = [annotation_service.list_images_with_annotations(self.dataset_id, 'expert_page', True, p, 2) for p in (1, 2, 3)]
+        assert [len(p) for p in pages] == [2, 2, 0]
+        flat = pages[0] + pages[1]
+        # 未标注在前，已标注（含 label_name 兼容字段）在最后
+        assert flat[-1]['image_id'] == 80003
+        assert flat[-1]['annotation']['label'] == 9001
+        assert all(r['annotation'] is None for r in flat[:-1])
+        unannotated = annotation_service.list_images_with_annotations(self.dataset_id, 'expert_page', False, 1, 10)
+        assert {r['image_id'] for r in unannotated} == {80001, 80002, 80004}
+
+    def test_save_annotations_bulk(self):
+        if not self.db.images.find_one({'image_id': 80002}):
+            self.db.images.insert_one({'image_id': 80002, 'image_path': '/tmp/pytest_image80002.png'})
+        self.db.image_datasets.insert_one({'dataset_id': self.dataset_id, 'image_id': 80002})
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_bulk', 9001, tip='old')
+        existing = self.db.annotations.find_one({'dataset_id': self.dataset_id, 'image_id': 80001, 'expert_id': 'expert_bulk'})
+        r = annotation_service.save_annotations_bulk(self.dataset_id, 'expert_bulk', [
+            {'image_id': 80001, 'label': 9001, 'tip': 'new'},
+            {'image_id': 80002, 'label_ids': [9001]},
+            {'image_id': 80003},  # 缺少标签
+        ])
+        assert (r['saved'], r['failed']) == (2, 1)
+        by_id = {x['image_id']: x for x in r['results']}
+        assert by_id[80001]['created'] is False and by_id[80001]['record_id'] == existing['record_id']
+        assert by_id[80002]['created'] is True and by_id[80003]['msg'] == 'error'
+        doc = self.db.annotations.find_one({'dataset_id': self.dataset_id, 'image_id': 80002, 'expert_id': 'expert_bulk'})
+        assert doc['record_id'] == by_id[80002]['record_id']
+        assert self.db.annotations.find_one({'dataset_id': self.dataset_id, 'image_id': 80001, 'expert_id': 'expert_bulk'})['tip'] == 'new'
+        assert annotation_service.next_image(self.dataset_id, 'expert_bulk').get('msg') == 'done'
+
+    def test_save_annotations_bulk_reports_what_was_written(self, monkeypatch):
+        from app.services import annotation_service as ann_mod
+        take = ann_mod.sequence_allocator.take
+
+        def concurrent_save(db, name, count):
+            # 领取 record_id 之后、bulk_write 之前，另一请求保存了同一图片
+            self.db.annotations.insert_one({'dataset_id': self.dataset_id, 'image_id': 80001,
+                                            'expert_id': 'expert_race', 'record_id': 987654321, 'label_id': 9001})
+            return take(db, name, count)
+
+        monkeypatch.setattr(ann_mod.sequence_allocator, 'take', concurrent_save)
+        r = annotation_service.save_annotations_bulk(self.dataset_id, 'expert_race', [{'image_id': 80001, 'label': 9001}])
+        assert r['results'] == [{'image_id': 80001, 'msg': 'saved', 'record_id': 987654321, 'created': False}]
+        assert self.db.annotations.count_documents({'dataset_id': self.dataset_id, 'expert_id': 'expert_race'}) == 1
+
+    def test_statistics_use_progress_counters(self):
+        self.db.dataset_progress.delete_many({'dataset_id': self.dataset_id})
+        dataset_service.invalidate_stats(self.dataset_id)
+        # 计数缺失时按数据集对账
+        assert dataset_service.statistics(self.dataset_id, 'expert_prog') == {'total_count': 1, 'annotated_count': 0}
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_prog', 9001)
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_prog', 9001, tip='again')  # 更新不重复计数
+        dataset_service.invalidate_stats(self.dataset_id)
+        assert dataset_service.statistics(self.dataset_id, 'expert_prog')['annotated_count'] == 1
+        # 人为破坏计数后对账恢复
+        self.db.dataset_progress.update_many({'dataset_id': self.dataset_id}, {'$set': {'total_count': 42, 'annotated_count': 7}})
+        dataset_service.reconcile_progress(self.dataset_id)
+        assert dataset_service.statistics(self.dataset_id, 'expert_prog') == {'total_count': 1, 'annotated_count': 1}
+
+    def test_progress_reconcile_is_per_key_and_leased_on_read(self):
+        from app.repositories.progress_repository import progress_repository
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_lease', 9001)
+        dataset_service.reconcile_progress(self.dataset_id)
+        self.db.dataset_progress.update_one({'dataset_id': self.dataset_id, 'expert_id': 'expert_gone'},
+                                            {'$set': {'annotated_count': 3}}, upsert=True)
+        total = self.db.dataset_progress.find_one({'dataset_id': self.dataset_id, 'expert_id': None})
+        dataset_service.reconcile_progress(self.dataset_id)
+        # 逐键覆盖（文档未被删除重建），只删除已无标注的专家计数
+        assert self.db.dataset_progress.find_one({'dataset_id': self.dataset_id, 'expert_id': None})['_id'] == total['_id']
+        assert self.db.dataset_progress.find_one({'dataset_id': self.dataset_id, 'expert_id': 'expert_gone'}) is None
+        # 其它 worker 持有对账租约时，读取直接计数且不写入
+        self.db.dataset_progress.delete_many({'dataset_id': self.dataset_id})
+        lease = f'progress_reconcile:{self.dataset_id}'
+        self.db.system_info.insert_one({'_id': lease, 'until': datetime.utcnow() + timedelta(seconds=60)})
+        try:
+            assert progress_repository.get(self.dataset_id, 'expert_lease') == {'total_count': 1, 'annotated_count': 1}
+            assert self.db.dataset_progress.count_documents({'dataset_id': self.dataset_id}) == 0
+        finally:
+            self.db.system_info.delete_one({'_id': lease})
+        assert progress_repository.get(self.dataset_id, 'expert_lease') == {'total_count': 1, 'annotated_count': 1}
+        assert self.db.dataset_progress.count_documents({'dataset_id': self.dataset_id}) == 2
+        assert self.db.system_info.find_one({'_id': lease}) is None
+
+    def test_progress_increments_never_create_partial_totals(self):
+        from app.repositories.progress_repository import progress_repository
+        self.db.dataset_progress.delete_many({'dataset_id': self.dataset_id})
+        # 未跟踪的数据集：递增改为对账，而不是写入 total_count=delta
+        progress_repository.inc_total(self.dataset_id, 5)
+        assert progress_repository.get(self.dataset_id, None)['total_count'] == 1
+        empty_id = dataset_service.create("pytest_progress_empty", "desc")
+        try:
+            assert progress_repository.get(empty_id, None) == {'total_count': 0, 'annotated_count': 0}
+            assert self.db.dataset_progress.find_one({'dataset_id': empty_id, 'expert_id': None})['total_count'] == 0
+        finally:
+            self.db.dataset_progress.delete_many({'dataset_id': empty_id})
+            self.db.datasets.delete_many({'id': empty_id})
+
     def test_export_workbook_minimal(self):
         # 创建一条标注，导出 workbook
         annotation_service.save_annotation(self.dataset_id, 80001, 'expert_export', 9001, tip='export')
@@ -49,3 +187,183 @@ class TestAnnotationAndExportServices:
         data = wb_bytes.getvalue()
         assert data.startswith(b'PK'), '应为 xlsx (zip) 格式'
         assert len(data) > 2000, '导出内容太小，可能失败'
+
+    def test_stream_export_csv_and_ndjson(self):
+        import csv, io, json
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_stream', None, label_ids=[9001], tip='s')
+        text = ''.join(export_service.stream_annotations(self.dataset_id, 'expert_stream', 'csv'))
+        rows = list(csv.DictReader(io.StringIO(text.lstrip('\ufeff'))))
+        assert len(rows) == 1
+        assert rows[0]['label_ids'] == '9001' and rows[0]['label_name'] == 'pytest_label' and rows[0]['tip'] == 's'
+        lines = ''.join(export_service.stream_annotations(self.dataset_id, 'admin', 'ndjson')).splitlines()
+        docs = [json.loads(l) for l in lines]
+        assert any(d['expert_id'] == 'expert_stream' and d['label_ids'] == [9001] for d in docs)
+
+    def test_columnar_export_typed_tables(self, tmp_path):
+        pa = pytest.importorskip('pyarrow')
+        import pyarrow.parquet as pq
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_columnar', None, label_ids=[9001], tip='c')
+        tables = export_service.build_columnar(self.dataset_id, 'expert_columnar', 'parquet', str(tmp_path))
+        assert set(tables) == {'annotations', 'images', 'labels', 'datasets'}
+        ann = pq.read_table(tables['annotations']['path'])
+        assert ann.num_rows == 1
+        assert ann.schema.field('label_ids').type == pa.list_(pa.int64())
+        assert pa.types.is_timestamp(ann.schema.field('datetime').type)
+        assert ann.column('label_ids').to_pylist() == [[9001]]
+        assert ann.column('datetime').null_count == 0
+        imgs = pq.read_table(tables['images']['path'])
+        assert imgs.column('image_id').to_pylist() == [80001]
+        arrow = export_service.build_columnar(self.dataset_id, 'expert_columnar', 'arrow', str(tmp_path))
+        with pa.ipc.open_file(arrow['annotations']['path']) as reader:
+            assert reader.read_all().column('tip').to_pylist() == ['c']
+
+    def test_write_only_workbook_sheets_and_columns(self):
+        import os
+        from openpyxl import load_workbook
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_xlsx', 9001, tip='x')
+        path = export_service.build_workbook_file(self.dataset_id, 'expert_xlsx')
+        try:
+            wb = load_workbook(path, read_only=True)
+            assert wb.sheetnames == [f'数据集{self.dataset_id}标注', f'数据集{self.dataset_id}图片', f'数据集{self.dataset_id}标签', '数据集信息']
+            rows = list(wb[f'数据集{self.dataset_id}标注'].values)
+            assert list(rows[0]) == ['dataset_id', 'record_id', 'image_id', 'expert_id', 'label_id', 'label_ids', 'label_name', 'tip', 'datetime']
+            assert rows[1][2] == 80001 and rows[1][5] == '[9001]' and rows[1][6] == 'pytest_label'
+            assert list(wb[f'数据集{self.dataset_id}图片'].values) == [('image_id', 'image_path'), (80001, '/tmp/pytest_image1.png')]
+            wb.close()
+        finally:
+            os.remove(path)
+
+    def test_export_job_caches_artifact_by_data_version(self, tmp_path):
+        import time
+        from app.services.export_job_service import ExportJobService
+        jobs = ExportJobService(cache_dir=str(tmp_path), workers=1)
+
+        def wait(job):
+            for _ in range(200):
+                job = jobs.get(job['_id'])
+                if job['status'] not in ('queued', 'running'):
+                    return job
+                time.sleep(0.02)
+            raise AssertionError('导出任务未完成')
+
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_job', 9001, tip='j1')
+        try:
+            first = wait(jobs.submit(self.dataset_id, 'expert_job', 'csv'))
+            assert first['status'] == 'done' and not first['cached']
+            with open(jobs.artifact(first), encoding='utf-8') as f:
+                assert 'j1' in f.read()
+            # 数据未变：命中缓存，不再构建
+            again = jobs.submit(self.dataset_id, 'expert_job', 'csv')
+            assert again['status'] == 'done' and again['cached'] and again['cache_key'] == first['cache_key']
+            # 标注变更后数据版本变化，重新构建
+            time.sleep(0.01)
+            annotation_service.save_annotation(self.dataset_id, 80001, 'expert_job', 9001, tip='j2')
+            third = wait(jobs.submit(self.dataset_id, 'expert_job', 'csv'))
+            assert third['cache_key'] != first['cache_key'] and not third['cached']
+            with open(jobs.artifact(third), encoding='utf-8') as f:
+                assert 'j2' in f.read()
+        finally:
+            self.db.export_jobs.delete_many({'dataset_id': self.dataset_id})
+
+    def test_data_version_changes_on_edit_from_lagging_clock(self):
+        import time
+        from app.services.annotation_service import CHANGE_MARK
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_ver', 9001, tip='v1')
+        query = {'dataset_id': self.dataset_id, 'image_id': 80001, 'expert_id': 'expert_ver'}
+        before = export_service.data_version(self.dataset_id, 'expert_ver')
+        stamp = self.db.annotations.find_one(query)['datetime']
+        time.sleep(0.01)
+        # 时钟落后的 worker 编辑：标注数、最大 record_id、datetime 均不变，指纹仍须变化
+        self.db.annotations.update_one(query, {'$set': {'tip': 'v2', 'datetime': stamp}, '$currentDate': CHANGE_MARK})
+        assert export_service.data_version(self.dataset_id, 'expert_ver') != before
+
+    def test_export_job_claims_build_once_per_key(self, tmp_path, monkeypatch):
+        from app.database_init import upgrade_to_v12
+        from app.services import export_job_service as ejs
+        assert upgrade_to_v12(self.db)
+        jobs = ejs.ExportJobService(cache_dir=str(tmp_path), workers=1)
+        other = ejs.ExportJobService(cache_dir=str(tmp_path), workers=1)  # 模拟另一个 worker
+        started = []
+        for svc in (jobs, other):
+            monkeypatch.setattr(svc, '_executor', lambda: type('P', (), {'submit': lambda _, fn, jid: started.append(jid)})())
+        try:
+            first = jobs.submit(self.dataset_id, 'expert_claim', 'csv')
+            assert other.submit(self.dataset_id, 'expert_claim', 'csv')['_id'] == first['_id']
+            # 查重与插入之间被抢先：唯一索引拒绝插入，返回已占位的任务
+            find_one, calls = self.db.export_jobs.find_one, []
+            monkeypatch.setattr(other.db.export_jobs, 'find_one',
+                                lambda *a, **k: find_one(*a, **k) if calls.append(1) or len(calls) > 1 else None)
+            assert other.submit(self.dataset_id, 'expert_claim', 'csv')['_id'] == first['_id']
+            assert len(calls) == 2 and started == [first['_id']]
+            monkeypatch.delattr(other.db.export_jobs, 'find_one')
+            # 占位任务超时（worker 已退出）则判失败并重新占位
+            self.db.export_jobs.update_one({'_id': first['_id']}, {'$set': {
+                'created_at': datetime.utcnow() - timedelta(seconds=ejs.JOB_TIMEOUT + 1)}})
+            fresh = other.submit(self.dataset_id, 'expert_claim', 'csv')
+            assert fresh['_id'] != first['_id'] and started == [first['_id'], fresh['_id']]
+            assert jobs.get(first['_id'])['status'] == 'failed'
+            assert 'active_key' not in self.db.export_jobs.find_one({'_id': first['_id']})
+        finally:
+            self.db.export_jobs.delete_many({'dataset_id': self.dataset_id})
+
+    def test_annotation_delta_watermark(self):
+        import time
+        for iid in (80002, 80003):
+            if not self.db.images.find_one({'image_id': iid}):
+                self.db.images.insert_one({'image_id': iid, 'image_path': f'/tmp/pytest_image{iid}.png'})
+            self.db.image_datasets.insert_one({'dataset_id': self.dataset_id, 'image_id': iid})
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_delta', 9001, tip='a')
+        annotation_service.save_annotation(self.dataset_id, 80002, 'expert_delta', 9001, tip='b')
+        # 滞后窗口内的变更暂不导出，水位保持不变
+        held, rows = export_service.annotation_delta(self.dataset_id, 'expert_delta', since='2000-01-01T00:00:00Z', lag=60)
+        assert list(rows) == [] and held == {'since': '2000-01-01T00:00:00.000Z', 'since_record_id': None}
+        wm, rows = export_service.annotation_delta(self.dataset_id, 'expert_delta', since='2000-01-01T00:00:00Z', lag=0)
+        assert [r['image_id'] for r in rows] == [80001, 80002]
+        # 无变化：空增量，水位不变
+        same, rows = export_service.annotation_delta(self.dataset_id, 'expert_delta', **wm, lag=0)
+        assert list(rows) == [] and same == wm
+        time.sleep(0.01)
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_delta', 9001, tip='a2')  # 修改
+        annotation_service.save_annotation(self.dataset_id, 80003, 'expert_delta', 9001, tip='c')   # 新增
+        wm2, rows = export_service.annotation_delta(self.dataset_id, 'expert_delta', **wm, lag=0)
+        assert sorted((r['image_id'], r['tip']) for r in rows) == [(80001, 'a2'), (80003, 'c')]
+        assert wm2['since'] > wm['since']
+        # record_id 不随时间单调，不能单独作为水位
+        with pytest.raises(ValueError):
+            export_service.annotation_delta(self.dataset_id, 'expert_delta', since_record_id=wm['since_record_id'])
+        with pytest.raises(ValueError):
+            export_service.annotation_delta(self.dataset_id, 'expert_delta', since='yesterday')
+
+    def test_stream_manifest_with_folds(self):
+        import csv, io
+        from app.services.manifest_export import resolve_image_path
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_manifest', 9001)
+        rows = list(csv.DictReader(io.StringIO(''.join(export_service.stream_manifest(self.dataset_id, 'expert_manifest')))))
+        assert rows == [{'id': '80001', 'image_path': resolve_image_path('/tmp/pytest_image1.png'),
+                         'mask_path': rows[0]['mask_path']}]
+        assert rows[0]['mask_path'].endswith('pytest_image1.png') and os.path.isabs(rows[0]['mask_path'])
+        text = ''.join(export_service.stream_manifest(self.dataset_id, 'expert_manifest', folds=3, seed=1))
+        assert text.splitlines()[0] == 'id,image_path,mask_path,fold'
+        assert list(csv.DictReader(io.StringIO(text)))[0]['fold'] == '0'
+
+    def test_per_dataset_zip_export(self):
+        import io, zipfile
+        from unittest import mock
+        annotation_service.save_annotation(self.dataset_id, 80001, 'expert_multi', 9001, tip='m')
+        data = b''.join(export_service.stream_datasets_zip('expert_multi', 'csv', dataset_ids=[self.dataset_id, 999998], workers=2))
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert sorted(zf.namelist()) == ['dataset_999998.csv', f'dataset_{self.dataset_id}.csv']
+            assert 'm' in zf.read(f'dataset_{self.dataset_id}.csv').decode('utf-8-sig')
+        # 单个数据集失败只影响自身
+        real = export_service.write_artifact
+
+        def flaky(ds, *args):
+            if ds == 999998:
+                raise RuntimeError('boom')
+            return real(ds, *args)
+
+        with mock.patch.object(export_service, 'write_artifact', side_effect=flaky):
+            data = b''.join(export_service.stream_datasets_zip('expert_multi', 'xlsx', dataset_ids=[self.dataset_id, 999998]))
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert sorted(zf.namelist()) == ['dataset_999998_error.txt', f'dataset_{self.dataset_id}.xlsx']
+            assert zf.read('dataset_999998_error.txt') == b'boom'
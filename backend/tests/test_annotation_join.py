@@ -0,0 +1,26 @@
+from app.services.annotation_join import join_images, index_annotations
+
+
+def test_join_images_hash_join_and_label_enrichment():
+    images = [{'image_id': i, 'image_path': f'static/img/{i}.png'} for i in (1, 2, 3)]
+    annotations = [
+        {'image_id': 3, 'label_id': 7},
+        {'image_id': 1, 'label_id': 8},
+        {'image_id': 1, 'label_id': 9},  # 重复：保留第一条
+    ]
+    rows = join_images(images, {7: 'a', 8: 'b'}, annotations=annotations)
+    assert [r['image_id'] for r in rows] == [1, 2, 3]
+    assert rows[0]['filename'] == '1.png'
+    assert rows[0]['annotation']['label_name'] == 'b' and rows[0]['annotation']['label'] == 8
+    assert rows[1]['annotation'] is None
+    assert rows[2]['annotation']['label_name'] == 'a'
+
+
+def test_join_images_uses_inline_annotation_and_filters_annotated():
+    rows = [
+        {'image_id': 1, 'image_path': 'static/img/1.png', 'annotation': {'image_id': 1, 'label_id': 7}},
+        {'image_id': 2, 'image_path': 'static/img/2.png', 'annotation': None},
+    ]
+    out = join_images(rows, {7: 'a'}, include_annotated=False)
+    assert [r['image_id'] for r in out] == [2]
+    assert index_annotations([]) == {}
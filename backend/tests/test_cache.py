@@ -0,0 +1,54 @@
+import threading
+import time
+
+from app.core.cache import LRUCache, approx_size
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = LRUCache('pytest_lru_entries', max_entries=3, stripes=1)
+    for k in 'abc':
+        cache.set(k, k)
+    cache.get('a')  # a 变为最近使用
+    cache.set('d', 'd')
+    assert cache.get('b') is None and cache.get('a') == 'a'
+    assert cache.stats()['evictions'] == 1
+
+    big = LRUCache('pytest_lru_bytes', max_entries=100, max_bytes=approx_size('x' * 100) * 2, stripes=1)
+    for i in range(3):
+        big.set(i, 'x' * 100)
+    assert len(big) == 2 and big.get(0) is None
+    big.set('huge', 'x' * 10_000)  # 超过预算的值不缓存
+    assert big.get('huge') is None
+
+
+def test_ttl_and_invalidate_where():
+    cache = LRUCache('pytest_lru_ttl', ttl=0.01)
+    cache.set(('map', 1), {1: 'a'})
+    cache.set(('map', 2), {2: 'b'}, ttl=60)
+    time.sleep(0.02)
+    assert cache.get(('map', 1)) is None and cache.stats()['expirations'] == 1
+    assert cache.invalidate_where(lambda k: k[1] == 2) == 1
+    assert len(cache) == 0
+
+
+def test_single_flight_coalesces_stampede():
+    cache = LRUCache('pytest_lru_flight')
+    calls = []
+    gate = threading.Event()
+
+    def loader():
+        calls.append(1)
+        gate.wait(5)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', loader))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+    assert cache.stats()['loads'] == 1
@@ -0,0 +1,27 @@
+import pytest
+
+from app.core.db import get_db, USE_DATABASE
+from app.database_init import init_database, retry_pending_indexes
+from config import MONGO_URI  # type: ignore
+
+DB_NAME = 'pytest_database_init'
+
+
+@pytest.mark.skipif(not USE_DATABASE, reason="需要真实数据库环境")
+def test_duplicate_label_ids_do_not_block_later_upgrades():
+    db = get_db().client[DB_NAME]
+    get_db().client.drop_database(DB_NAME)
+    try:
+        db.system_info.insert_one({'key': 'db_version', 'value': 6})
+        db.labels.insert_many([{'label_id': 1, 'label_name': 'a'}, {'label_id': 1, 'label_name': 'b'}])
+        assert init_database(MONGO_URI, DB_NAME)
+        assert db.system_info.find_one({'key': 'db_version'})['value'] == 12
+        assert 'images_content_hash_unique' in db.images.index_information()
+        assert db.system_info.find_one({'key': 'pending_indexes'})['value'] == ['labels_label_id_unique']
+        # 重复处理后重试即补建
+        db.labels.delete_one({'label_name': 'b'})
+        retry_pending_indexes(db)
+        assert 'labels_label_id_unique' in db.labels.index_information()
+        assert db.system_info.find_one({'key': 'pending_indexes'})['value'] == []
+    finally:
+        get_db().client.drop_database(DB_NAME)
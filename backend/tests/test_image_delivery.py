@@ -0,0 +1,38 @@
+from flask import Flask, request
+
+from app.services.image_delivery import file_response, image_etag
+
+app = Flask(__name__)
+
+
+def _image(tmp_path, content_hash='ab' * 32):
+    path = tmp_path / 'img.png'
+    path.write_bytes(bytes(range(256)) * 4)
+    return {'image_id': 1, 'image_path': 'static/img/ab/ab/x.png', 'content_hash': content_hash,
+            'rel': 'ab/ab/x.png', 'path': str(path)}
+
+
+def test_file_response_cache_headers_and_range(tmp_path):
+    image = _image(tmp_path)
+    with app.test_request_context('/'):
+        response = file_response(image, request, accel_prefix='')
+        response.direct_passthrough = False
+        assert response.status_code == 200 and response.get_etag() == (image['content_hash'], False)
+        assert response.cache_control.immutable and response.cache_control.max_age == 365 * 24 * 3600
+        assert response.mimetype == 'image/png' and len(response.get_data()) == 1024
+    with app.test_request_context('/', headers={'If-None-Match': f'"{image["content_hash"]}"'}):
+        response = file_response(image, request, accel_prefix='')
+        assert response.status_code == 304 and not response.get_data()
+    with app.test_request_context('/', headers={'Range': 'bytes=0-99'}):
+        response = file_response(image, request, accel_prefix='')
+        response.direct_passthrough = False
+        assert response.status_code == 206 and response.get_data() == bytes(range(100))
+
+
+def test_file_response_accel_redirect(tmp_path):
+    image = _image(tmp_path, content_hash=None)
+    with app.test_request_context('/'):
+        response = file_response(image, request, accel_prefix='/_protected_img/')
+        assert response.headers['X-Accel-Redirect'] == '/_protected_img/ab/ab/x.png'
+        assert response.get_etag() == (image_etag(image), False) and not response.get_data()
+        assert response.mimetype == 'image/png'
@@ -0,0 +1,99 @@
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from app.core.db import get_db, USE_DATABASE
+from app.services import image_service as image_module
+from app.services.dataset_service import dataset_service
+from app.services.image_service import image_service
+from app.services.image_store import ImageStore, relative_path
+
+
+def test_relative_path_handles_flat_and_sharded_paths():
+    assert relative_path('static/img/abc_x.png') == 'abc_x.png'
+    assert relative_path('static/img/ab/cd/abcd.png') == 'ab/cd/abcd.png'
+    assert relative_path('/tmp/other/x.png') == 'x.png'
+    assert relative_path('') == ''
+
+
+def test_image_store_shards_and_dedupes(tmp_path):
+    store = ImageStore(str(tmp_path))
+    h, rel, size, new = store.save(io.BytesIO(b'pixels'), 'a.PNG')
+    assert rel == f"{h[:2]}/{h[2:4]}/{h}.png" and size == 6 and new
+    assert store.save(io.BytesIO(b'pixels'), 'b.png') == (h, rel, 6, False)
+    with open(store.absolute(rel), 'rb') as f:
+        assert f.read() == b'pixels'
+    assert os.listdir(os.path.join(str(tmp_path), '.incoming')) == []
+
+
+@pytest.mark.skipif(not USE_DATABASE, reason="需要真实数据库环境")
+class TestImageUpload:
+    def setup_method(self):
+        self.db = get_db()
+        self.dataset_id = dataset_service.create("pytest_upload", "desc")
+        self.other_id = dataset_service.create("pytest_upload_other", "desc")
+
+    def teardown_method(self):
+        ds = [self.dataset_id, self.other_id]
+        ids = [l['image_id'] for l in self.db.image_datasets.find({'dataset_id': {'$in': ds}})]
+        self.db.images.delete_many({'image_id': {'$in': ids}})
+        self.db.image_datasets.delete_many({'dataset_id': {'$in': ds}})
+        self.db.dataset_progress.delete_many({'dataset_id': {'$in': ds}})
+        self.db.datasets.delete_many({'id': {'$in': ds}})
+
+    def _files(self, names, content=None):
+        return [FileStorage(io.BytesIO((content or n).encode()), filename=n) for n in names]
+
+    def test_upload_batch_bulk_writes_and_report(self, tmp_path, monkeypatch):
+        store = ImageStore(str(tmp_path))
+        real_save = store.save
+
+        def save(stream, name):
+            if name == 'bad.png':
+                raise OSError('disk full')
+            return real_save(stream, name)
+
+        monkeypatch.setattr(store, 'save', save)
+        monkeypatch.setattr(image_module, 'image_store', store)
+        monkeypatch.setattr(image_service, 'INSERT_CHUNK', 2)
+        names = [f'img{i}.png' for i in range(5)] + ['bad.png']
+        uploaded, failed = image_service.upload_batch(self.dataset_id, self._files(names) + [FileStorage(io.BytesIO(b''), filename='')])
+
+        assert [u['original_name'] for u in uploaded] == names[:5]
+        assert not any(u['duplicate'] for u in uploaded)
+        assert failed == [{'filename': 'bad.png', 'error': 'disk full'}]
+        ids = [u['image_id'] for u in uploaded]
+        assert len(set(ids)) == 5 and ids == sorted(ids)
+        for u in uploaded:
+            with open(store.absolute(u['filename']), 'rb') as f:
+                assert f.read() == u['original_name'].encode()
+        docs = {d['image_id']: d['image_path'] for d in self.db.images.find({'image_id': {'$in': ids}})}
+        assert docs == {u['image_id']: f"static/img/{u['filename']}" for u in uploaded}
+        assert self.db.image_datasets.count_documents({'dataset_id': self.dataset_id}) == 5
+        assert self.db.datasets.find_one({'id': self.dataset_id})['image_count'] == 5
+
+    def test_identical_content_shares_one_image_doc(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(image_module, 'image_store', ImageStore(str(tmp_path)))
+        first, _ = image_service.upload_batch(self.dataset_id, self._files(['a.png', 'b.png', 'c.jpg'], content='same'))
+        assert len({u['image_id'] for u in first}) == 1
+        assert [u['duplicate'] for u in first] == [False, True, True]
+        again, _ = image_service.upload_batch(self.dataset_id, self._files(['d.png'], content='same'))
+        other, _ = image_service.upload_batch(self.other_id, self._files(['e.png'], content='same'))
+        assert again[0]['duplicate'] and not other[0]['duplicate']
+        assert again[0]['image_id'] == other[0]['image_id'] == first[0]['image_id']
+        assert self.db.images.count_documents({'image_id': first[0]['image_id']}) == 1
+        assert self.db.datasets.find_one({'id': self.dataset_id})['image_count'] == 1
+        assert self.db.datasets.find_one({'id': self.other_id})['image_count'] == 1
+        files = [os.path.join(r, f) for r, _, fs in os.walk(str(tmp_path)) for f in fs]
+        assert len(files) == 1  # c.jpg 的副本已删除
+
+    def test_failed_metadata_insert_leaves_no_file(self, tmp_path, monkeypatch):
+        store = ImageStore(str(tmp_path))
+        monkeypatch.setattr(image_module, 'image_store', store)
+        monkeypatch.setattr(image_service, '_insert_chunked', lambda collection, docs: (
+            {0: {'code': 2, 'errmsg': 'write failed'}} if collection.name == 'images' else {}))
+        uploaded, failed = image_service.upload_batch(self.dataset_id, self._files(['x.png']))
+        assert not uploaded and failed == [{'filename': 'x.png', 'error': 'write failed'}]
+        assert [f for _, _, fs in os.walk(str(tmp_path)) for f in fs] == []
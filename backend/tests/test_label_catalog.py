@@ -0,0 +1,77 @@
+import pytest
+from app.core.db import USE_DATABASE, get_db
+from app.services.label_catalog import effective_labels, label_catalog
+from app.services.label_service import label_service
+
+
+def test_effective_labels_fallback_order():
+    docs = [
+        {'label_id': 3, 'label_name': 'null', 'dataset_id': None},
+        {'label_id': 2, 'label_name': 'missing'},
+        {'label_id': 5, 'label_name': 'own-b', 'dataset_id': 7},
+        {'label_id': 4, 'label_name': 'own-a', 'dataset_id': 7},
+    ]
+    assert [d['label_id'] for d in effective_labels(docs, 7)] == [4, 5]
+    assert [d['label_id'] for d in effective_labels(docs, 8)] == [2]
+    assert [d['label_id'] for d in effective_labels(docs[:1], 8)] == [3]
+    assert [d['label_id'] for d in effective_labels(docs, None)] == [2, 3, 4, 5]
+
+
+@pytest.mark.skipif(not USE_DATABASE, reason="需要真实数据库环境")
+class TestLabelCatalog:
+    dataset_id = 999977
+
+    def setup_method(self):
+        self.db = get_db()
+        self.db.labels.delete_many({'dataset_id': self.dataset_id})
+        self.db.label_versions.delete_many({'_id': self.dataset_id})
+
+    def teardown_method(self):
+        self.setup_method()
+
+    def test_version_bump_refreshes_map(self):
+        before = label_catalog.label_map(self.dataset_id)
+        assert label_catalog.label_map(self.dataset_id) is before  # 同一版本命中缓存
+        records = label_service.add_dataset_labels(self.dataset_id, [{'name': 'catalog_a'}])
+        assert label_catalog.version(self.dataset_id) == 1
+        assert label_catalog.label_map(self.dataset_id) == {records[0]['label_id']: 'catalog_a'}
+        label_service.update_dataset_labels(self.dataset_id, [{'name': 'catalog_b'}])
+        assert list(label_catalog.label_map(self.dataset_id).values()) == ['catalog_b']
+        assert [l['name'] for l in label_service.list(self.dataset_id)] == ['catalog_b']
+
+    def test_label_ids_allocated_in_request_sized_blocks(self):
+        first = label_service.add_dataset_labels(self.dataset_id, [{'name': 'blk_a'}, {'name': 'blk_b'}, {'name': 'blk_c'}])
+        second = label_service.add_dataset_labels(self.dataset_id, [{'name': 'blk_d'}])
+        ids = [r['label_id'] for r in first + second]
+        assert ids[:3] == list(range(ids[0], ids[0] + 3))
+        assert len(set(ids)) == 4 and ids[3] > ids[2]
+
+    def test_update_labels_diff_keeps_ids_and_remaps_fallback(self):
+        self.db.labels.delete_many({'label_id': {'$in': [990001, 990002]}})
+        self.db.labels.insert_many([
+            {'label_id': 990001, 'label_name': 'pytest_global_a'},
+            {'label_id': 990002, 'label_name': 'pytest_global_b'},
+        ])
+        self.db.annotations.insert_one({'dataset_id': self.dataset_id, 'image_id': 1, 'expert_id': 'e',
+                                        'label_id': 990001, 'label_ids': [990001, 990002]})
+        try:
+            assert 990001 in label_catalog.label_map(self.dataset_id)
+            # 由全局回退转为专属标签：同名新 ID 重映射到标注
+            r = label_service.update_dataset_labels(self.dataset_id, [{'name': 'pytest_global_a'}, {'name': 'pytest_global_b'}])
+            assert (r['inserted'], r['remapped_annotations']) == (2, 1)
+            own = {l['label_name']: l['label_id'] for l in label_service.get_dataset_labels(self.dataset_id)}
+            ann = self.db.annotations.find_one({'dataset_id': self.dataset_id})
+            assert ann['label_id'] == own['pytest_global_a']
+            assert ann['label_ids'] == [own['pytest_global_a'], own['pytest_global_b']]
+            # 改名（按 label_id）、保留（按名称）、删除、新增
+            r = label_service.update_dataset_labels(self.dataset_id, [
+                {'label_id': own['pytest_global_a'], 'name': 'renamed_a'},
+                {'name': 'new_c'},
+            ])
+            assert {k: r[k] for k in ('kept', 'renamed', 'inserted', 'deleted', 'remapped_annotations')} == \
+                {'kept': 0, 'renamed': 1, 'inserted': 1, 'deleted': 1, 'remapped_annotations': 0}
+            after = {l['label_name']: l['label_id'] for l in label_service.get_dataset_labels(self.dataset_id)}
+            assert after['renamed_a'] == own['pytest_global_a'] and 'pytest_global_b' not in after
+        finally:
+            self.db.labels.delete_many({'label_id': {'$in': [990001, 990002]}})
+            self.db.annotations.delete_many({'dataset_id': self.dataset_id})
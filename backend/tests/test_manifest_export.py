@@ -0,0 +1,31 @@
+import os
+from collections import Counter
+
+import pytest
+from app.services.manifest_export import assign_folds, resolve_image_path, resolve_mask_path, stratum_label
+
+
+def test_stratum_label_majority_then_smallest():
+    assert stratum_label([3, 2, 3]) == 3
+    assert stratum_label([5, 2]) == 2
+    assert stratum_label([None]) is None and stratum_label([]) is None
+
+
+def test_assign_folds_stratified_and_deterministic():
+    strata = {i: (1 if i < 60 else 2 if i < 90 else None) for i in range(100)}
+    folds = assign_folds(strata, 5, seed=7)
+    assert folds == assign_folds(dict(reversed(list(strata.items()))), 5, seed=7)
+    assert folds != assign_folds(strata, 5, seed=8)
+    assert sorted(Counter(folds.values()).values()) == [20] * 5
+    for label, size in ((1, 60), (2, 30), (None, 10)):
+        per_fold = Counter(f for i, f in folds.items() if strata[i] == label)
+        assert max(per_fold.values()) - min(per_fold.values()) <= 1 and sum(per_fold.values()) == size
+    with pytest.raises(ValueError):
+        assign_folds(strata, 1)
+
+
+def test_paths_resolve_under_upload_and_mask_folders(tmp_path):
+    assert resolve_image_path('static/img/abc_x.png', str(tmp_path)) == os.path.join(str(tmp_path), 'abc_x.png')
+    assert resolve_mask_path('static/img/abc_x.jpg', str(tmp_path / 'm'), '_mask.png') == \
+        os.path.join(str(tmp_path / 'm'), 'abc_x_mask.png')
+    assert resolve_image_path(None) == ''
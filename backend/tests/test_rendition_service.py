@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from app.core import process_pool
+from app.services.rendition_service import RenditionService, source_key
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture(autouse=True)
+def fork_pool():
+    # 测试进程内没有完整的应用配置，子进程用 fork 继承已导入的模块
+    process_pool.configure('fork')
+    yield
+    process_pool.configure(process_pool.START_METHOD)
+
+
+def _source(tmp_path, size=(2000, 1500), mode='RGB'):
+    path = str(tmp_path / 'src.png')
+    Image.new(mode, size, 128 if mode == 'L' else (10, 120, 200)).save(path)
+    return {'image_id': 1, 'image_path': 'static/img/src.png', 'path': path}
+
+
+def test_parse_size_and_negotiate():
+    assert RenditionService.parse_size(None) == 256 and RenditionService.parse_size('preview') == 1024
+    assert RenditionService.parse_size('1024') == 1024
+    with pytest.raises(ValueError):
+        RenditionService.parse_size('512')
+    assert RenditionService.negotiate(None, 'image/avif,image/webp,*/*') == 'webp'
+    assert RenditionService.negotiate(None, '*/*') == 'jpeg' and RenditionService.negotiate('jpg') == 'jpeg'
+
+
+def test_render_is_bounded_and_cached(tmp_path):
+    service = RenditionService(cache_dir=str(tmp_path / 'cache'))
+    image = _source(tmp_path)
+    path = service.render(image, 256, 'webp')
+    with Image.open(path) as out:
+        assert out.format == 'WEBP' and max(out.size) == 256 and out.size == (256, 192)
+    assert service.render(image, 256, 'webp') == path
+    assert (service.stats()['renders'], service.stats()['hits']) == (1, 1)
+    assert os.path.basename(path).startswith(source_key(image))
+    small = dict(_source(tmp_path, size=(300, 200), mode='L'), content_hash='ab' * 32)
+    with Image.open(service.render(small, 1024, 'jpeg')) as out:
+        assert out.format == 'JPEG' and out.size == (300, 200)  # 不放大
+
+
+def test_sweep_evicts_least_recently_used(tmp_path):
+    service = RenditionService(cache_dir=str(tmp_path / 'cache'), max_bytes=1)
+    shard = tmp_path / 'cache' / 'aa'
+    shard.mkdir(parents=True)
+    for i, name in enumerate(['old', 'new']):
+        f = shard / f'{name}_256.webp'
+        f.write_bytes(b'x' * 10)
+        os.utime(str(f), (1000 + i, 1000 + i))
+    assert service.sweep() == 2
+    service.max_bytes = 15
+    for i, name in enumerate(['old', 'new']):
+        f = shard / f'{name}_256.webp'
+        f.write_bytes(b'x' * 10)
+        os.utime(str(f), (1000 + i, 1000 + i))
+    assert service.sweep() == 1 and os.listdir(str(shard)) == ['new_256.webp']
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+import db_utils
+from db_utils import SequenceBlockAllocator
+from app.core.db import USE_DATABASE, get_db
+
+
+@pytest.mark.skipif(not USE_DATABASE, reason="需要真实数据库环境")
+class TestSequenceBlockAllocator:
+    seq = 'pytest_hilo_seq'
+    other = 'pytest_hilo_other'
+
+    def setup_method(self):
+        self.db = get_db()
+        self.db.sequences.delete_many({'_id': {'$in': [self.seq, self.other]}})
+
+    def teardown_method(self):
+        self.db.sequences.delete_many({'_id': {'$in': [self.seq, self.other]}})
+
+    def test_block_reuse_and_metrics(self):
+        alloc = SequenceBlockAllocator(block_size=10)
+        values = [alloc.next_value(self.db, self.seq) for _ in range(25)]
+        assert values == list(range(1, 26))
+        m = alloc.metrics()
+        assert m['round_trips'] == 3 and m['ids_issued'] == 25 and m['round_trips_saved'] == 22
+
+    def test_take_larger_than_block_and_concurrent_uniqueness(self):
+        alloc_a = SequenceBlockAllocator(block_size=5)
+        alloc_b = SequenceBlockAllocator(block_size=5)  # 模拟另一个 worker
+        big = alloc_a.take(self.db, self.seq, 12)
+        assert len(big) == 12 and big == sorted(big)
+        out, lock = [], threading.Lock()
+
+        def worker(alloc):
+            got = [alloc.next_value(self.db, self.seq) for _ in range(50)]
+            with lock:
+                out.extend(got)
+
+        threads = [threading.Thread(target=worker, args=(a,)) for a in (alloc_a, alloc_b, alloc_a, alloc_b)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(set(out + big)) == len(out) + len(big)
+
+    def test_refill_blocks_only_its_own_sequence(self, monkeypatch):
+        alloc = SequenceBlockAllocator(block_size=5)
+        alloc.take(self.db, self.other, 1)
+        entered, release = threading.Event(), threading.Event()
+        reserve = db_utils.reserve_sequence_block
+
+        def slow_reserve(db, name, count):
+            if name == self.seq:
+                entered.set()
+                release.wait(5)
+            return reserve(db, name, count)
+
+        monkeypatch.setattr(db_utils, 'reserve_sequence_block', slow_reserve)
+        refill = threading.Thread(target=alloc.take, args=(self.db, self.seq, 1))
+        refill.start()
+        assert entered.wait(5)
+        # 另一序列的补充卡在数据库往返时，本序列仍可从本地区间发放
+        got = []
+        reader = threading.Thread(target=lambda: got.extend(alloc.take(self.db, self.other, 2)))
+        reader.start()
+        reader.join(2)
+        released_early = not reader.is_alive()
+        release.set()
+        refill.join()
+        reader.join()
+        assert released_early and got == [2, 3]
+        assert alloc.metrics()['round_trips'] == 2
@@ -0,0 +1,41 @@
+import multiprocessing
+import sys
+import time
+
+import pytest
+from app.core import shared_cache as sc
+
+
+def _write_from_child(path):
+    sc.SQLiteBackend(path).set('stats:7:expert', {'total_count': 3}, None)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="需要 fork 模拟多 worker")
+def test_sqlite_backend_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    reader = sc.SQLiteBackend(path)
+    p = multiprocessing.get_context('fork').Process(target=_write_from_child, args=(path,))
+    p.start()
+    p.join(30)
+    assert p.exitcode == 0
+    # 另一个进程写入的值立即可见；前缀失效对所有进程生效
+    assert reader.get('stats:7:expert') == {'total_count': 3}
+    reader.set('stats:70:expert', 1, None)
+    reader.delete_prefix('stats:7:')
+    assert reader.get('stats:7:expert') is sc._MISSING
+    assert reader.get('stats:70:expert') == 1
+
+
+def test_ttl_and_hit_miss_counters(tmp_path, monkeypatch):
+    monkeypatch.setattr(sc, '_backend', sc.SQLiteBackend(str(tmp_path / 'cache.sqlite3')))
+    cache = sc.SharedCache('pytest_ns', ttl=60)
+    calls = []
+    loader = lambda: calls.append(1) or {'n': len(calls)}
+    assert cache.get_or_set('k', loader) == {'n': 1}
+    assert cache.get_or_set('k', loader) == {'n': 1}
+    assert cache.metrics()['hits'] == 1 and cache.metrics()['misses'] == 1
+    cache.set('short', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('short') is None
+    cache.clear()
+    assert cache.get('k') is None and len(calls) == 1
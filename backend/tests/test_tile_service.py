@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+import imaging
+from app.core import process_pool
+from app.services.tile_service import TileService
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture(autouse=True)
+def fork_pool():
+    process_pool.configure('fork')
+    yield
+    process_pool.configure(process_pool.START_METHOD)
+
+
+def _source(tmp_path, size=(1000, 700), name='src.png'):
+    path = str(tmp_path / name)
+    Image.radial_gradient('L').resize(size).convert('RGB').save(path)
+    return {'image_id': 1, 'image_path': f'static/img/{name}', 'path': path}
+
+
+def test_dzi_geometry():
+    assert imaging.dzi_max_level(1000, 700) == 10 and imaging.dzi_max_level(1, 1) == 0
+    assert imaging.dzi_level_size(1000, 700, 10) == (1000, 700)
+    assert imaging.dzi_level_size(1000, 700, 8) == (250, 175) and imaging.dzi_level_size(1000, 700, 0) == (1, 1)
+    assert imaging.dzi_tile_box(1000, 700, 10, 0, 0, 254, 1) == (0, 0, 255, 255)
+    assert imaging.dzi_tile_box(1000, 700, 10, 3, 2, 254, 1) == (761, 507, 1000, 700)
+    with pytest.raises(IndexError):
+        imaging.dzi_tile_box(1000, 700, 10, 4, 0, 254, 1)
+    with pytest.raises(IndexError):
+        imaging.dzi_tile_box(1000, 700, 11, 0, 0, 254, 1)
+    assert TileService.parse_tile('3_2') == (3, 2, None) and TileService.parse_tile('0_1.JPG') == (0, 1, 'jpeg')
+    with pytest.raises(ValueError):
+        TileService.parse_tile('3_2.png')
+
+
+def test_tiles_are_built_lazily_and_memoized(tmp_path):
+    service = TileService(cache_dir=str(tmp_path / 'tiles'))
+    image = _source(tmp_path)
+    info = service.describe(image)
+    assert (info['width'], info['height'], info['max_level'], info['window']) == (1000, 700, 10, None)
+    assert service.dzi(info, '/api/images/1/tiles/', 'webp')['Image']['Size'] == {'Width': '1000', 'Height': '700'}
+    path = service.tile(image, 10, 3, 2, 'webp')
+    with Image.open(path) as out:
+        assert out.format == 'WEBP' and out.size == (239, 193)
+    assert service.tile(image, 10, 3, 2, 'webp') == path
+    with Image.open(service.tile(image, 0, 0, 0, 'jpeg')) as out:
+        assert out.size == (1, 1)
+    assert (service.stats()['described'], service.stats()['renders'], service.stats()['hits']) == (1, 2, 1)
+    with pytest.raises(IndexError):
+        service.tile(image, 9, 2, 0, 'webp')
+
+
+def test_wide_gray_tiles_share_one_window(tmp_path):
+    path = str(tmp_path / 'wide.png')
+    Image.linear_gradient('L').resize((600, 300)).convert('I').point(lambda v: v * 100).convert('I;16').save(path)
+    service = TileService(cache_dir=str(tmp_path / 'tiles'), tile_size=254)
+    image = {'image_id': 2, 'image_path': 'static/img/wide.png', 'path': path}
+    assert service.describe(image)['window'] == [0, 25500]
+    # 同一行的瓦片亮度相同，说明使用全图窗口而非各自拉伸
+    left, right = (Image.open(service.tile(image, 10, c, 0, 'webp')).convert('L') for c in (0, 2))
+    assert abs(left.getpixel((10, 0)) - right.getpixel((10, 0))) <= 2 and left.getpixel((10, 0)) < 10
+
+
+def test_sweep_evicts_whole_pyramids(tmp_path):
+    service = TileService(cache_dir=str(tmp_path / 'tiles'), max_bytes=15)
+    for i, key in enumerate(['aa' * 32, 'ab' * 32]):
+        pyramid = tmp_path / 'tiles' / key[:2] / key
+        (pyramid / '10').mkdir(parents=True)
+        (pyramid / '10' / '0_0.webp').write_bytes(b'x' * 10)
+        (pyramid / 'info.json').write_text('{}')
+        os.utime(str(pyramid / 'info.json'), (1000 + i, 1000 + i))
+    assert service.sweep() == 1
+    assert not (tmp_path / 'tiles' / 'aa').joinpath('aa' * 32).exists()
+    assert (tmp_path / 'tiles' / 'ab').joinpath('ab' * 32, '10', '0_0.webp').exists()
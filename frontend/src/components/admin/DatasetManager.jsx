@@ -37,7 +37,7 @@ export default function DatasetManager({ user, role, onBack }) {
 
   useEffect(() => { fetchDatasets(); }, []);
   const fetchDatasets = async () => { setLoading(true); try { const r = await api.get('/datasets'); setDatasets(r.data || []); } catch { } finally { setLoading(false); } };
-  const fetchDatasetLabels = async (datasetId) => { try { const r = await api.get(`/admin/datasets/${datasetId}/labels?role=${role}`); const labels = r.data.map(l => ({ name: l.label_name, category: l.category || '病理学' })); setDatasetLabels(labels.length?labels:[{ name:'', category:'病理学'}]); } catch { setDatasetLabels([{ name:'', category:'病理学'}]); } };
+  const fetchDatasetLabels = async (datasetId) => { try { const r = await api.get(`/admin/datasets/${datasetId}/labels?role=${role}`); const labels = r.data.map(l => ({ label_id: l.label_id, name: l.label_name, category: l.category || '病理学' })); setDatasetLabels(labels.length?labels:[{ name:'', category:'病理学'}]); } catch { setDatasetLabels([{ name:'', category:'病理学'}]); } };
   const handleCreateDataset = async () => { if (!newDatasetName.trim()) { alert('请输入数据集名称'); return; } try { const res = await api.post('/admin/datasets', { name: newDatasetName, description: newDatasetDesc, multi_select: multiSelect, role }); if (res.data.msg==='success') { const validLabels = labelInputs.filter(l=>l.name.trim()!==''); if (validLabels.length) await api.post(`/admin/datasets/${res.data.dataset_id}/labels`, { labels: validLabels, role }); alert('数据集创建成功!'); setNewDatasetName(''); setNewDatasetDesc(''); setLabelInputs([{ name:'', category:'病理学'}]); setMultiSelect(false); setShowCreateForm(false); fetchDatasets(); } } catch (e) { alert(`创建失败: ${e.response?.data?.error||e.message}`); } };
   const handleDeleteDataset = async (datasetId) => { if (!window.confirm('确认删除此数据集? 此操作不可恢复!')) return; try { const res = await api.delete(`/admin/datasets/${datasetId}?role=${role}`); if (res.data.msg==='success') { alert('数据集删除成功!'); fetchDatasets(); } } catch (e) { alert(`删除失败: ${e.response?.data?.error||e.message}`); } };
   const handleFileChange = e => setFiles(Array.from(e.target.files));
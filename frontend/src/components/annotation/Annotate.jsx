@@ -94,7 +94,7 @@ export default function Annotate({ user, dataset, role, onDone, imageIdInit, onS
       if (nextItem) {
         setNextCandidate({ image_id: nextItem.image_id, filename: nextItem.filename, image_path: nextItem.image_path });
         // 通过 JS 预加载下一张图片
-        const url = `/static/img/${nextItem.filename}`;
+        const url = `/api/images/${nextItem.image_id}/file`;
         const imgEl = new Image();
         imgEl.loading = 'eager';
         imgEl.decoding = 'async';
@@ -188,7 +188,7 @@ export default function Annotate({ user, dataset, role, onDone, imageIdInit, onS
         const second = unAnnotatedList[1];
         if (second) {
           setNextCandidate({ image_id: second.image_id, filename: second.filename, image_path: second.image_path });
-          const url = `/static/img/${second.filename}`;
+          const url = `/api/images/${second.image_id}/file`;
           const imgEl = new Image(); imgEl.loading = 'eager'; imgEl.decoding = 'async'; imgEl.src = url;
           imgEl.onload = () => setNextImgSrc(url);
           imgEl.onerror = () => setNextImgSrc(url);
@@ -309,7 +309,7 @@ export default function Annotate({ user, dataset, role, onDone, imageIdInit, onS
         if (data.length > 1) {
             const nextItem = data[1];
             setNextCandidate({ image_id: nextItem.image_id, filename: nextItem.filename, image_path: nextItem.image_path });
-            const url = `/static/img/${nextItem.filename}`;
+            const url = `/api/images/${nextItem.image_id}/file`;
             const imgEl = new Image();
             imgEl.src = url;
             imgEl.onload = () => setNextImgSrc(url);
@@ -346,7 +346,7 @@ export default function Annotate({ user, dataset, role, onDone, imageIdInit, onS
         <div className={`image-viewer ${isImageSelected ? 'selected' : ''}`} onMouseDown={onImageMouseDown} onMouseMove={onImageMouseMove} onMouseUp={onImageMouseUp}>
           <img
             key={`${img.image_id}-${img.filename || ''}`}
-            src={`/static/img/${img.filename}?v=${img.image_id}`}
+            src={`/api/images/${img.image_id}/file`}
             alt={`图片ID: ${img.image_id}`}
             loading="lazy"
             draggable={false}